@@ -0,0 +1,274 @@
+"""Local stand-in for the parts of YouTube Data API the uploader uses.
+
+Implements `playlists.list`, `playlistItems.list`, `videos.list`,
+`videos.update` and resumable `videos.insert` closely enough for the
+googleapiclient based client. Every request can be delayed and a share of
+them answered with 503 to see how the client copes with a slow or flaky API.
+Batch requests are not supported -- googleapiclient always sends them to
+the real API root.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\*|(\d+)-(\d+))/(\d+|\*)')
+
+
+class FakeVideo(object):
+    def __init__(self, videoId: str, title: str, description: str):
+        self.videoId = videoId
+        self.title = title
+        self.description = description
+
+
+class FakePlaylist(object):
+    def __init__(self, playlistId: str, title: str):
+        self.playlistId = playlistId
+        self.title = title
+        self.videos: List[FakeVideo] = []
+
+    @property
+    def etag(self) -> str:
+        digest = hashlib.md5(f'{self.title}|{len(self.videos)}'.encode('utf-8')).hexdigest()
+        return f'"{digest}"'
+
+    @property
+    def items_etag(self) -> str:
+        digest = hashlib.md5('|'.join(video.videoId for video in self.videos).encode('utf-8')).hexdigest()
+        return f'"{digest}"'
+
+
+class UploadSession(object):
+    def __init__(self, metadata: dict):
+        self.metadata = metadata
+        self.received = 0
+
+
+class FakeYouTubeState(object):
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.playlists: Dict[str, FakePlaylist] = {}
+        self.videos: Dict[str, FakeVideo] = {}
+        self.sessions: Dict[str, UploadSession] = {}
+        self.requests = 0
+        self.uploaded_bytes = 0
+        self.lock = threading.Lock()
+        self._ids = 0
+
+    def next_id(self, prefix: str) -> str:
+        with self.lock:
+            self._ids += 1
+            return f'{prefix}{self._ids:08d}'
+
+    def add_playlist(self, title: str) -> FakePlaylist:
+        playlist = FakePlaylist(self.next_id('PL'), title)
+        self.playlists[playlist.playlistId] = playlist
+        return playlist
+
+    def add_video(self, playlist: Optional[FakePlaylist], title: str, description: str) -> FakeVideo:
+        video = FakeVideo(self.next_id('V'), title, description)
+        with self.lock:
+            self.videos[video.videoId] = video
+            if playlist is not None:
+                playlist.videos.append(video)
+        return video
+
+
+def _page(items: list, query: dict) -> dict:
+    max_results = int(query.get('maxResults', ['5'])[0])
+    offset = int(query.get('pageToken', ['0'])[0] or 0)
+    page = {'items': items[offset:offset + max_results]}
+    if offset + max_results < len(items):
+        page['nextPageToken'] = str(offset + max_results)
+    return page
+
+
+class FakeYouTubeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body go out in a single write, otherwise delayed ACKs
+    # add tens of milliseconds to every response
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    @property
+    def state(self) -> FakeYouTubeState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status: int, body: Optional[dict] = None, headers: Optional[dict] = None) -> None:
+        content = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _simulate_network(self) -> bool:
+        """Applies the latency, returns False when the request has to fail."""
+        with self.state.lock:
+            self.state.requests += 1
+            fail = self.state.random.random() < self.state.error_rate
+
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        if fail:
+            self._send(503, {'error': {'code': 503, 'message': 'Injected failure', 'errors': [{'reason': 'backendError'}]}})
+
+        return not fail
+
+    def do_GET(self):
+        body = self._read_body()
+        if not self._simulate_network():
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.endswith('/youtube/v3/playlists'):
+            playlists = list(self.state.playlists.values())
+            if 'id' in query:
+                ids = query['id'][0].split(',')
+                playlists = [playlist for playlist in playlists if playlist.playlistId in ids]
+            items = [{'id': playlist.playlistId, 'etag': playlist.etag,
+                      'snippet': {'title': playlist.title, 'description': ''},
+                      'contentDetails': {'itemCount': len(playlist.videos)}} for playlist in playlists]
+            page = _page(items, query)
+            etag = '"' + hashlib.md5('|'.join(item['etag'] for item in page['items']).encode('utf-8')).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304)
+                return
+            self._send(200, {'etag': etag, **page})
+        elif url.path.endswith('/youtube/v3/playlistItems'):
+            playlist = self.state.playlists.get(query.get('playlistId', [''])[0])
+            if playlist is None:
+                self._send(404, {'error': {'code': 404, 'message': 'Playlist not found'}})
+                return
+            if self.headers.get('If-None-Match') == playlist.items_etag and not query.get('pageToken'):
+                self._send(304)
+                return
+            items = [{'id': video.videoId, 'snippet': {'title': video.title, 'description': video.description}}
+                     for video in playlist.videos]
+            self._send(200, {'etag': playlist.items_etag, **_page(items, query)})
+        elif url.path.endswith('/youtube/v3/videos'):
+            ids = query.get('id', [''])[0].split(',')
+            items = [{'id': videoId, 'snippet': {'title': self.state.videos[videoId].title,
+                                                 'description': self.state.videos[videoId].description}}
+                     for videoId in ids if videoId in self.state.videos]
+            self._send(200, {'items': items})
+        else:
+            self._send(404, {'error': {'code': 404, 'message': f'Unknown path {url.path}'}})
+
+    def do_POST(self):
+        body = self._read_body()
+        if not self._simulate_network():
+            return
+
+        url = urlparse(self.path)
+
+        if url.path.endswith('/upload/youtube/v3/videos'):
+            sessionId = self.state.next_id('S')
+            self.state.sessions[sessionId] = UploadSession(json.loads(body or b'{}'))
+            host = self.headers.get('Host')
+            self._send(200, headers={'Location': f'http://{host}/upload/sessions/{sessionId}'})
+        else:
+            self._send(404, {'error': {'code': 404, 'message': f'Unknown path {url.path}'}})
+
+    def do_PUT(self):
+        body = self._read_body()
+        url = urlparse(self.path)
+
+        if url.path.startswith('/upload/sessions/'):
+            self._upload_chunk(url.path.rsplit('/', 1)[1], body)
+            return
+
+        if not self._simulate_network():
+            return
+
+        if url.path.endswith('/youtube/v3/videos'):
+            update = json.loads(body)
+            video = self.state.videos.get(update['id'])
+            if video is None:
+                self._send(404, {'error': {'code': 404, 'message': 'Video not found'}})
+                return
+            video.title = update['snippet'].get('title', video.title)
+            video.description = update['snippet'].get('description', video.description)
+            self._send(200, {'id': video.videoId, 'snippet': update['snippet']})
+        else:
+            self._send(404, {'error': {'code': 404, 'message': f'Unknown path {url.path}'}})
+
+    def _upload_chunk(self, sessionId: str, body: bytes) -> None:
+        session = self.state.sessions.get(sessionId)
+        if session is None:
+            self._send(404, {'error': {'code': 404, 'message': 'Upload session not found'}})
+            return
+
+        # the chunk is lost when the request fails, the client finds out
+        # what the server has by asking for the upload status
+        if not self._simulate_network():
+            return
+
+        match = CONTENT_RANGE_PATTERN.match(self.headers.get('Content-Range', ''))
+        total = None
+        if match:
+            if match.group(2) is not None and int(match.group(2)) == session.received:
+                session.received += len(body)
+                with self.state.lock:
+                    self.state.uploaded_bytes += len(body)
+            if match.group(4) != '*':
+                total = int(match.group(4))
+
+        if total is not None and session.received >= total:
+            snippet = session.metadata.get('snippet', {})
+            video = self.state.add_video(None, snippet.get('title', ''), snippet.get('description', ''))
+            del self.state.sessions[sessionId]
+            self._send(200, {'id': video.videoId, 'snippet': snippet})
+            return
+
+        headers = {'Range': f'bytes=0-{session.received - 1}'} if session.received else {}
+        self._send(308, headers=headers)
+
+
+class FakeYouTubeServer(object):
+    """Runs the fake API on a random local port in a background thread."""
+
+    def __init__(self, state: Optional[FakeYouTubeState] = None):
+        self.state = state or FakeYouTubeState()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), FakeYouTubeHandler)
+        self._server.daemon_threads = True
+        self._server.state = self.state
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-youtube', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    @property
+    def api_endpoint(self) -> str:
+        return f'{self.url}/youtube/v3/'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,380 @@
+"""Benchmarks of the hot paths of the uploader.
+
+Run from the repository root:
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --output new.json --compare results.json
+
+Every benchmark is repeated and the best time is reported; results are
+written as JSON along with the commit they were taken at, so that runs
+made at different commits can be compared.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from typing import Callable, Dict, List, Optional
+
+from youtube_uploader import cli
+from youtube_uploader.cache import SqliteYoutubeCache, YamlYoutubeCache
+from youtube_uploader.cli import find_already_uploaded, get_files_for_upload
+from youtube_uploader.client import YouTubeClientImpl
+from youtube_uploader.hasher import StagedFingerprints, YouTubeHasher
+from youtube_uploader.quota import CredentialSet
+from youtube_uploader.scheduler import UploadScheduler
+
+from benchmarks.fake_youtube import FakeYouTubeServer, FakeYouTubeState
+from benchmarks.synthetic import make_tree
+
+log = logging.getLogger('benchmarks')
+
+
+class FakeCredentials(object):
+    """Credentials for the fake API, which checks no tokens.
+
+    googleapiclient keeps the scheme of the real API for uploads even when
+    the API endpoint is overridden, while the fake API speaks plain HTTP.
+    """
+
+    access_token_expired = False
+
+    def authorize(self, http):
+        request = http.request
+
+        def local_request(uri, *args, **kwargs):
+            if uri.startswith('https://127.0.0.1:'):
+                uri = 'http://' + uri[len('https://'):]
+            return request(uri, *args, **kwargs)
+
+        http.request = local_request
+        return http
+
+
+class BenchmarkClient(YouTubeClientImpl):
+    def _get_credentials(self, credential_set):
+        return FakeCredentials()
+
+
+class Benchmark(object):
+    def __init__(self, name: str, run: Callable[[], Optional[dict]], setup: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+
+
+class Context(object):
+    """Synthetic archive and scratch space shared by the benchmarks."""
+
+    def __init__(self, args):
+        self.args = args
+        self.root = tempfile.mkdtemp(prefix='youtube-uploader-bench-')
+        self.archive = os.path.join(self.root, 'archive')
+        self.scratch = os.path.join(self.root, 'scratch')
+
+        started_at = timeit.default_timer()
+        self.paths = make_tree(self.archive, args.files, args.file_size * 1024)
+        self.total_bytes = args.files * args.file_size * 1024
+        log.info(f'generated {len(self.paths)} files ({self.total_bytes / (1024 * 1024):.1f} MiB) '
+                 f'in {timeit.default_timer() - started_at:.2f} sec')
+
+    def fresh_scratch(self) -> str:
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        os.makedirs(self.scratch)
+        return self.scratch
+
+    def client(self, **kwargs) -> BenchmarkClient:
+        secrets_path = os.path.join(self.root, 'client_secrets.json')
+        with open(secrets_path, 'w') as file:
+            json.dump({'installed': {'project_id': 'benchmark', 'client_id': 'benchmark'}}, file)
+
+        kwargs.setdefault('cache_path', os.path.join(self.scratch, 'cache.yaml'))
+        return BenchmarkClient(
+            credential_sets=[CredentialSet(secrets_path, os.path.join(self.root, 'credentials.json'))],
+            daily_quota=10 ** 9,
+            **kwargs)
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def discovery_benchmarks(ctx: Context) -> List[Benchmark]:
+    client = ctx.client()
+
+    def cold():
+        files = get_files_for_upload(client, ctx.archive, None)
+        return {'items': len(files)}
+
+    index = YamlYoutubeCache(os.path.join(ctx.root, 'dir-index.yaml'))
+
+    def warm_index():
+        get_files_for_upload(client, ctx.archive, None, dir_index=index)
+
+    def indexed():
+        files = get_files_for_upload(client, ctx.archive, None, dir_index=index)
+        return {'items': len(files)}
+
+    return [
+        Benchmark('discovery.cold', cold),
+        Benchmark('discovery.indexed', indexed, setup=warm_index),
+    ]
+
+
+def hashing_benchmarks(ctx: Context) -> List[Benchmark]:
+    state = {}
+
+    def new_hasher():
+        cache = YamlYoutubeCache(os.path.join(ctx.fresh_scratch(), 'cache.yaml'))
+        cache.read_from_disk()
+        state['hasher'] = YouTubeHasher(cache, workers=ctx.args.hash_workers)
+
+    def md5():
+        for path in ctx.paths:
+            state['hasher'].md5(path)
+        return {'items': len(ctx.paths), 'bytes': ctx.total_bytes}
+
+    def md5_many():
+        state['hasher'].md5_many(ctx.paths)
+        return {'items': len(ctx.paths), 'bytes': ctx.total_bytes}
+
+    def warm_hasher():
+        new_hasher()
+        state['hasher'].md5_many(ctx.paths)
+
+    def cached():
+        for path in ctx.paths:
+            state['hasher'].md5(path)
+        return {'items': len(ctx.paths)}
+
+    def staged():
+        # nothing uploaded yet: only files colliding with each other are hashed fully
+        hasher = state['hasher']
+        fingerprints = StagedFingerprints(hasher.partial_hash, hasher.md5, lambda path: False)
+        unique = sum(1 for _ in fingerprints.iter_unique(ctx.paths))
+        return {'items': len(ctx.paths), 'unique': unique}
+
+    return [
+        Benchmark('hashing.md5', md5, setup=new_hasher),
+        Benchmark('hashing.md5_many', md5_many, setup=new_hasher),
+        Benchmark('hashing.cached', cached, setup=warm_hasher),
+        Benchmark('hashing.staged', staged, setup=new_hasher),
+    ]
+
+
+def cache_benchmarks(ctx: Context) -> List[Benchmark]:
+    entries = [(path, {'md5': f'{i:032x}', 'size': i, 'mtime_ns': i, 'inode': i, 'device': 1})
+               for i, path in enumerate(ctx.paths)]
+
+    def make(backend: str):
+        def run():
+            path = os.path.join(ctx.fresh_scratch(), f'cache.{backend}')
+            cache = SqliteYoutubeCache(path) if backend == 'sqlite' else YamlYoutubeCache(path)
+
+            cache.read_from_disk()
+            for key, value in entries:
+                cache.update('file-hashes-v1', key, value)
+            cache.flush()
+
+            cache = SqliteYoutubeCache(path) if backend == 'sqlite' else YamlYoutubeCache(path)
+            cache.read_from_disk()
+            for key, _ in entries:
+                cache.get('file-hashes-v1', key)
+
+            return {'items': len(entries), 'file_bytes': os.path.getsize(path)}
+
+        return run
+
+    return [
+        Benchmark('cache.yaml', make('yaml')),
+        Benchmark('cache.sqlite', make('sqlite')),
+    ]
+
+
+def dedup_benchmarks(ctx: Context) -> List[Benchmark]:
+    state = {}
+
+    def setup():
+        ctx.fresh_scratch()
+        client = ctx.client()
+        client.cache.read_from_disk()
+        client.file_hashes(ctx.paths)
+
+        # every other file is already uploaded
+        videos = [client.parse_video(f'V{i}', os.path.basename(path), client._generate_metadata(path))
+                  for i, path in enumerate(ctx.paths) if i % 2 == 0]
+
+        state['client'] = client
+        state['index'] = client.build_video_index(videos)
+
+    def make(mode: str):
+        def run():
+            found = sum(1 for path in ctx.paths
+                        if find_already_uploaded(state['client'], state['index'], path, mode) is not None)
+            return {'items': len(ctx.paths), 'found': found}
+
+        return run
+
+    return [
+        Benchmark('dedup.md5', make('off'), setup=setup),
+        Benchmark('dedup.metadata_trust', make('trust'), setup=setup),
+    ]
+
+
+def upload_benchmarks(ctx: Context) -> List[Benchmark]:
+    upload_paths = ctx.paths[:ctx.args.upload_files]
+    upload_bytes = sum(os.path.getsize(path) for path in upload_paths)
+    state = {}
+
+    def setup():
+        ctx.fresh_scratch()
+        fake = FakeYouTubeState(latency=ctx.args.latency / 1000, error_rate=ctx.args.error_rate)
+        playlist = fake.add_playlist('Backup')
+        for i in range(ctx.args.remote_videos):
+            fake.add_video(playlist, f'remote{i}', f'File name: remote{i}.mp4\nMD5: {i:032x}\n[auto uploaded]')
+
+        state['server'] = FakeYouTubeServer(fake).__enter__()
+
+    def run():
+        server = state.pop('server')
+        try:
+            with ctx.client(api_endpoint=server.api_endpoint,
+                            upload_chunk_size=ctx.args.upload_chunk_size * 1024) as client:
+                playlists = client.get_my_playlists().playlists
+                indices = client.get_playlist_video_indices(playlists)
+                index = indices[playlists[0].playlistId]
+
+                scheduler = UploadScheduler(
+                    client,
+                    find_uploaded=lambda path: find_already_uploaded(client, index, path),
+                    concurrency=ctx.args.upload_concurrency)
+                summary = scheduler.run(upload_paths)
+        finally:
+            server.__exit__(None, None, None)
+
+        return {'items': summary.uploaded, 'bytes': upload_bytes, 'requests': server.state.requests}
+
+    return [Benchmark('upload.e2e', run, setup=setup)]
+
+
+BENCHMARK_GROUPS = {
+    'discovery': discovery_benchmarks,
+    'hashing': hashing_benchmarks,
+    'cache': cache_benchmarks,
+    'dedup': dedup_benchmarks,
+    'upload': upload_benchmarks,
+}
+
+
+def measure(benchmark: Benchmark, repeat: int) -> dict:
+    runs = []
+    extra = {}
+
+    for _ in range(repeat):
+        if benchmark.setup:
+            benchmark.setup()
+
+        started_at = timeit.default_timer()
+        extra = benchmark.run() or {}
+        runs.append(timeit.default_timer() - started_at)
+
+    best = min(runs)
+    result = {'seconds': best, 'runs': runs, **extra}
+
+    if 'bytes' in extra and best > 0:
+        result['mb_per_second'] = extra['bytes'] / (1024 * 1024) / best
+
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, dict], baseline_path: str) -> None:
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+
+    print(f'\ncompared to {baseline_path} ({baseline.get("commit") or "unknown commit"}):')
+    print(f'{"benchmark":<24}{"before":>12}{"after":>12}{"change":>10}')
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name, {}).get('seconds')
+        if before is None:
+            print(f'{name:<24}{"-":>12}{result["seconds"]:>12.4f}{"new":>10}')
+            continue
+        change = (result['seconds'] - before) / before * 100 if before > 0 else 0.0
+        print(f'{name:<24}{before:>12.4f}{result["seconds"]:>12.4f}{change:>+9.1f}%')
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, dict]:
+    argparser = argparse.ArgumentParser(description='Benchmarks of the uploader hot paths')
+    argparser.add_argument('--files', type=int, default=2000, help='Number of files in the synthetic archive')
+    argparser.add_argument('--file-size', type=int, default=64, help='Size of every file in KiB')
+    argparser.add_argument('--only', default=None,
+                           help=f'Comma separated groups to run: {",".join(BENCHMARK_GROUPS)}')
+    argparser.add_argument('--repeat', type=int, default=3, help='Times every benchmark is repeated')
+    argparser.add_argument('--hash-workers', type=int, default=4)
+    argparser.add_argument('--upload-files', type=int, default=20, help='Number of files uploaded end-to-end')
+    argparser.add_argument('--upload-chunk-size', type=int, default=256, help='Upload chunk size in KiB')
+    argparser.add_argument('--upload-concurrency', type=int, default=1)
+    argparser.add_argument('--remote-videos', type=int, default=1000,
+                           help='Number of videos in the playlist of the fake API')
+    argparser.add_argument('--latency', type=float, default=0.0, help='Latency of the fake API in ms')
+    argparser.add_argument('--error-rate', type=float, default=0.0,
+                           help='Share of the fake API requests answered with 503')
+    argparser.add_argument('--output', default=None, help='Write the results into the JSON file')
+    argparser.add_argument('--compare', default=None, help='Compare the results with the ones in the JSON file')
+    args = argparser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    log.setLevel(logging.INFO)
+    # scratch caches are always new, retries are reported in the results
+    logging.getLogger('youtube_uploader').setLevel(logging.ERROR)
+
+    # cli functions log into the logger main() sets up
+    cli.log = logging.getLogger('main')
+
+    groups = args.only.split(',') if args.only else list(BENCHMARK_GROUPS)
+    unknown = [group for group in groups if group not in BENCHMARK_GROUPS]
+    if unknown:
+        argparser.error(f'unknown benchmark groups: {", ".join(unknown)}')
+
+    ctx = Context(args)
+    results = {}
+    try:
+        for group in groups:
+            for benchmark in BENCHMARK_GROUPS[group](ctx):
+                results[benchmark.name] = measure(benchmark, args.repeat)
+                extra = results[benchmark.name]
+                rate = f', {extra["mb_per_second"]:.1f} MB/s' if 'mb_per_second' in extra else ''
+                print(f'{benchmark.name:<24}{extra["seconds"]:>10.4f} sec{rate}')
+    finally:
+        ctx.cleanup()
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'commit': git_commit(),
+                'taken_at': time.time(),
+                'python': sys.version,
+                'platform': platform.platform(),
+                'arguments': vars(args),
+                'results': results,
+            }, file, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Synthetic archives for the benchmarks."""
+import os
+import random
+from typing import List
+
+
+def make_tree(root: str, files: int, size: int, fanout: int = 20, seed: int = 0) -> List[str]:
+    """Creates `files` video files of `size` bytes spread over nested directories.
+
+    Every directory holds at most `fanout` files and `fanout` subdirectories.
+    Files share the same random payload prefixed with their number, so that
+    every file has a distinct MD5 while generation stays cheap.
+    """
+    rnd = random.Random(seed)
+    payload = bytes(rnd.getrandbits(8) for _ in range(min(size, 1024 * 1024)))
+    extensions = ['.mp4', '.mov', '.mkv', '.avi']
+    paths = []
+
+    for i in range(files):
+        dir_number = i // fanout
+        parts = []
+        while True:
+            parts.append(f'd{dir_number % fanout:02d}')
+            dir_number //= fanout
+            if dir_number == 0:
+                break
+
+        dir = os.path.join(root, *reversed(parts))
+        os.makedirs(dir, exist_ok=True)
+
+        path = os.path.join(dir, f'clip{i:06d}{extensions[i % len(extensions)]}')
+        header = f'{i:016d}'.encode('ascii')
+        with open(path, 'wb') as file:
+            remaining = size
+            file.write(header[:remaining])
+            remaining -= min(len(header), remaining)
+            while remaining > 0:
+                chunk = payload[:remaining]
+                file.write(chunk)
+                remaining -= len(chunk)
+        paths.append(path)
+
+        # some noise which discovery has to skip
+        if i % fanout == 0:
+            with open(os.path.join(dir, 'notes.txt'), 'w') as file:
+                file.write('not a video')
+
+    return paths
@@ -1,24 +1,116 @@
+import io
 import logging
 import os
-from typing import Optional
+import pickle
+import sqlite3
+import threading
+import timeit
+from typing import Dict, Optional
 
+import portalocker
 import yaml
 
+from youtube_uploader.metrics import registry as metrics
+
 log = logging.getLogger(__name__)
 
+# the run goes on for at least that many times longer than the last checkpoint took before the next one
+CHECKPOINT_SLOWDOWN = 20
+
+# classes besides the builtin types cached values may consist of
+PLAIN_DATA_CLASSES = {
+    ('datetime', 'date'),
+    ('datetime', 'datetime'),
+    ('datetime', 'timedelta'),
+    ('datetime', 'timezone'),
+}
+
+
+class _CacheYamlLoader(getattr(yaml, 'CSafeLoader', yaml.SafeLoader)):
+    """Safe loader which reads python objects written by older versions as None.
+
+    Entries holding them are then treated as missing (and fetched again)
+    instead of constructing arbitrary objects while loading.
+    """
+
+
+_CacheYamlLoader.add_multi_constructor('tag:yaml.org,2002:python/', lambda loader, suffix, node: None)
+
+_CacheYamlDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+class _PlainDataUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) not in PLAIN_DATA_CLASSES:
+            raise pickle.UnpicklingError(f'{module}.{name} is not plain data')
+        return super().find_class(module, name)
+
 
 class YoutubeCacheBase():
+    def __init__(self, checkpoint_interval: Optional[float] = None):
+        # when set, changes are flushed to the disk at least that often (in
+        # seconds) so that an interrupted run does not lose everything
+        self.checkpoint_interval = checkpoint_interval
+        self._last_checkpoint_at = timeit.default_timer()
+
+        # grows when checkpoints get slow, see _maybe_checkpoint
+        self._checkpoint_delay = checkpoint_interval
+
+        # caches are used from several threads (e.g. playlists fetching)
+        self._lock = threading.RLock()
+
+    def _maybe_checkpoint(self) -> None:
+        if not self.checkpoint_interval:
+            return
+
+        if timeit.default_timer() - self._last_checkpoint_at < self._checkpoint_delay:
+            return
+
+        started_at = timeit.default_timer()
+        self.flush()
+        self._last_checkpoint_at = timeit.default_timer()
+
+        elapsed = self._last_checkpoint_at - started_at
+        log.info(f'cache checkpoint took {elapsed:.3f} sec')
+
+        # e.g. YAML cache is rewritten as a whole on every flush, which takes
+        # long for a large cache -- checkpoints are made rarer then, so that
+        # they never block the run for more than a small share of its time
+        delay = max(self.checkpoint_interval, elapsed * CHECKPOINT_SLOWDOWN)
+        if delay > self._checkpoint_delay:
+            log.info(f'cache checkpoints are slow, making them every {delay:.0f} sec instead')
+        self._checkpoint_delay = delay
+
+    def read_from_disk(self) -> None:
+        raise NotImplementedError()
+
+    def flush(self) -> None:
+        raise NotImplementedError()
+
     def get(self, section: str, key: str) -> Optional[object]:
         raise NotImplementedError()
 
     def update(self, section: str, key: str, data: Optional[object]) -> None:
         raise NotImplementedError()
 
+    def entries(self, section: str) -> Dict[str, object]:
+        """All the entries of the section, the ones set to None are left out."""
+        raise NotImplementedError()
+
 
 class YamlYoutubeCache(YoutubeCacheBase):
-    def __init__(self, path):
+    def __init__(self, path, checkpoint_interval: Optional[float] = None, shared: bool = False,
+                 lock_timeout: float = 300):
+        super().__init__(checkpoint_interval)
         self.path = path
         self._data = None
+        self._dirty = set()  # (section, key) updated since the last flush
+
+        # in shared mode several processes use the same cache file: reads
+        # take a shared lock, flushes take an exclusive one and merge changed
+        # entries into whatever other processes have written in the meantime
+        self.shared = shared
+        self.lock_timeout = lock_timeout
 
     def __enter__(self):
         self.read_from_disk()
@@ -28,43 +120,236 @@ class YamlYoutubeCache(YoutubeCacheBase):
         log.debug('flushing the cache to the disk...')
         self.flush()
 
+    def _file_lock(self, exclusive: bool):
+        flags = portalocker.LockFlags.EXCLUSIVE if exclusive else portalocker.LockFlags.SHARED
+        # lock a separate file as the cache file itself gets replaced on flush
+        return portalocker.Lock(
+            f'{self.path}.lock',
+            mode='a',
+            timeout=self.lock_timeout,
+            flags=flags | portalocker.LockFlags.NON_BLOCKING)
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.path):
+            log.warning('cache does not exist')
+            return {}  # init as empty cache
+
+        try:
+            with open(self.path, 'r') as file:
+                return yaml.load(file, Loader=_CacheYamlLoader) or {}
+        except yaml.scanner.ScannerError as scannerError:
+            raise Exception(f'Cache YAML file looks broken -- consider removing it and retrying: {scannerError}')
+
     def read_from_disk(self):
         log.debug('reading the cache from the disk...')
 
-        if os.path.exists(self.path):
-            try:
-                with open(self.path, 'r') as file:
-                    self._data = yaml.load(file, Loader=yaml.Loader) or {}
-                    log.debug('  ok')
-            except yaml.scanner.ScannerError as scannerError:
-                raise Exception(f'Cache YAML file looks broken -- consider removing it and retrying: {scannerError}')
-        else:
-            log.warning('cache does not exist')
-            self._data = {}  # init as empty cache
+        with self._lock, metrics.timed('cache.load'):
+            if self.shared:
+                with self._file_lock(exclusive=False):
+                    self._data = self._load()
+            else:
+                self._data = self._load()
+
+            self._dirty.clear()
+        log.debug('  ok')
+
+    def _write(self, data: dict) -> None:
+        # write into a temporary file and atomically replace the cache with
+        # it, so that an interrupted flush never leaves a truncated cache
+        temp_path = f'{self.path}.tmp.{os.getpid()}'
+        try:
+            with open(temp_path, 'w') as file:
+                yaml.dump(data, file, Dumper=_CacheYamlDumper)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
 
     def flush(self):
-        log.debug('flushing the cache to the disk...')
+        with self._lock:
+            if not self._dirty:
+                log.debug('cache was not changed, nothing to flush')
+                return
+
+            log.debug(f'flushing the cache to the disk ({len(self._dirty)} changed entries)...')
+            started_at = timeit.default_timer()
+
+            if self.shared:
+                with self._file_lock(exclusive=True):
+                    merged = self._load()
+
+                    for section, key in self._dirty:
+                        merged.setdefault(section, {})[key] = self._data[section][key]
+
+                    self._write(merged)
+
+                    # entries written by other processes become visible as well
+                    self._data = merged
+            else:
+                self._write(self._data)
 
-        # use portalocked to handle cases of multiple processes using the same cache file
-        with open(self.path, 'w') as file:
-            yaml.dump(self._data, file)
+            self._dirty.clear()
+            metrics.record_timing('cache.flush', timeit.default_timer() - started_at)
         log.debug('  ok')
 
     def update(self, section: str, key: str, value: Optional[object]) -> None:
-        if self._data is None:
-            self.read_from_disk()
+        with self._lock:
+            if self._data is None:
+                self.read_from_disk()
 
-        if section not in self._data:
-            self._data[section] = {}
+            if section not in self._data:
+                self._data[section] = {}
 
-        self._data[section][key] = value
+            self._data[section][key] = value
+            self._dirty.add((section, key))
+
+            self._maybe_checkpoint()
 
     def get(self, section: str, key: str) -> Optional[object]:
-        if self._data is None:
-            self.read_from_disk()
+        with self._lock:
+            if self._data is None:
+                self.read_from_disk()
+
+            if not self._data or section not in self._data or key not in self._data[section]:
+                return None
+
+            return self._data[section][key]
+
+    def entries(self, section: str) -> Dict[str, object]:
+        with self._lock:
+            if self._data is None:
+                self.read_from_disk()
+
+            return {key: value for key, value in (self._data.get(section) or {}).items() if value is not None}
 
-        if not self._data or section not in self._data or key not in self._data[section]:
+
+class SqliteYoutubeCache(YoutubeCacheBase):
+    """Cache stored in SQLite database with a row per (section, key).
+
+    Unlike YamlYoutubeCache it never loads the whole cache into memory --
+    values are looked up one by one and only updated values are written
+    back on flush.
+    """
+
+    def __init__(self, path, checkpoint_interval: Optional[float] = None):
+        super().__init__(checkpoint_interval)
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._dirty = {}  # (section, key) -> value
+
+    def __enter__(self):
+        self.read_from_disk()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        log.debug('flushing the cache to the disk...')
+        self.flush()
+
+    def read_from_disk(self):
+        with self._lock:
+            if self._connection is not None:
+                return
+
+            log.debug(f'opening the cache database {self.path}...')
+
+            # SQLite handles several processes using the same database on its
+            # own, just give the other writers enough time to finish; access
+            # from several threads is serialized by the lock
+            self._connection = sqlite3.connect(self.path, timeout=300, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                '  section TEXT NOT NULL,'
+                '  key TEXT NOT NULL,'
+                '  value BLOB,'
+                '  PRIMARY KEY (section, key)'
+                ') WITHOUT ROWID')
+            self._connection.commit()
+        log.debug('  ok')
+
+    def flush(self):
+        with self._lock:
+            if self._connection is None:
+                self.read_from_disk()
+
+            if not self._dirty:
+                return
+
+            log.debug(f'flushing {len(self._dirty)} changed cache entries to the disk...')
+
+            with metrics.timed('cache.flush'), self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO cache (section, key, value) VALUES (?, ?, ?)',
+                    ((section, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+                     for (section, key), value in self._dirty.items()))
+
+            self._dirty.clear()
+        log.debug('  ok')
+
+    def update(self, section: str, key: str, value: Optional[object]) -> None:
+        with self._lock:
+            self._dirty[(section, key)] = value
+
+            self._maybe_checkpoint()
+
+    def get(self, section: str, key: str) -> Optional[object]:
+        with self._lock:
+            if (section, key) in self._dirty:
+                return self._dirty[(section, key)]
+
+            if self._connection is None:
+                self.read_from_disk()
+
+            row = self._connection.execute(
+                'SELECT value FROM cache WHERE section = ? AND key = ?', (section, key)).fetchone()
+
+        if row is None:
+            return None
+
+        return self._unpickle(section, key, row[0])
+
+    @staticmethod
+    def _unpickle(section: str, key: str, value: Optional[bytes]) -> Optional[object]:
+        if value is None:
+            return None
+
+        try:
+            return _PlainDataUnpickler(io.BytesIO(value)).load()
+        except (pickle.UnpicklingError, AttributeError, ImportError) as e:
+            # e.g. python objects written by older versions
+            log.debug(f'ignoring cached {section}/{key}: {e}')
             return None
 
-        return self._data[section][key]
+    def entries(self, section: str) -> Dict[str, object]:
+        with self._lock:
+            if self._connection is None:
+                self.read_from_disk()
+
+            rows = self._connection.execute('SELECT key, value FROM cache WHERE section = ?', (section,)).fetchall()
+            dirty = {key: value for (dirty_section, key), value in self._dirty.items() if dirty_section == section}
+
+        result = {key: self._unpickle(section, key, value) for key, value in rows}
+        result.update(dirty)
+
+        return {key: value for key, value in result.items() if value is not None}
+
+    def import_from_yaml(self, yaml_path: str) -> int:
+        """Copies all the entries from the YAML cache file, returns amount of entries imported."""
+        source = YamlYoutubeCache(yaml_path)
+        source.read_from_disk()
+
+        count = 0
+        for section, entries in source._data.items():
+            for key, value in (entries or {}).items():
+                self.update(section, key, value)
+                count += 1
+
+        self.flush()
+
+        log.info(f'imported {count} cache entries from {yaml_path}')
 
+        return count
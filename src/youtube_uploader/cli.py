@@ -1,69 +1,185 @@
 import argparse
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
-from typing import Iterable, Optional, List
+from typing import Callable, Iterable, Iterator, Optional, List
 
 import coloredlogs
 
-from youtube_uploader.model import YouTubeClient, Playlist, Video
+from youtube_uploader.cache import SqliteYoutubeCache, YoutubeCacheBase
+from youtube_uploader.discovery import DirectoryScanner, filter_by_cut_off, ordered_by_modification_time, stat_files
+from youtube_uploader.hasher import StagedFingerprints
+from youtube_uploader.metrics import registry as metrics
+from youtube_uploader.model import UNKNOWN_SIZE, YouTubeClient, LocalFile, Playlist, Video, VideoIndex
+from youtube_uploader.plan import RUN_STATS_CACHE_SECTION, build_plan
+from youtube_uploader.quota import CredentialSet, DEFAULT_DAILY_QUOTA, QUOTA_COSTS
+from youtube_uploader.scheduler import UploadScheduler, UploadSummary
+from youtube_uploader.throttle import BandwidthLimiter, BandwidthSchedule, next_occurrence, parse_time_of_day
+from youtube_uploader.watcher import FileWatcher, create_watcher
 from youtube_uploader.client import YouTubeClientImpl
 
 log: Optional[logging.Logger] = None
 
+# uploaded videos are added to the playlist in batches of that many as the
+# uploads go, so that an interrupted run leaves few of them behind
+PLAYLIST_ADD_BATCH_SIZE = 5
+
+
+def find_already_uploaded(
+        client: YouTubeClient,
+        index: VideoIndex,
+        local_file_path: str,
+        metadata_match: str = 'off',
+        hash_while_upload: bool = False,
+        needs_md5: Optional[Callable[[str], bool]] = None,
+) -> Optional[Video]:
+    # when file name, size and modification time match the ones in the
+    # description the file is most likely uploaded already -- in "trust"
+    # mode it's taken as is, in "confirm" mode MD5 is still checked
+    candidate = None
+    if metadata_match != 'off' or hash_while_upload:
+        candidate = index.find_by_metadata(client.file_metadata_key(local_file_path))
+        if candidate and metadata_match == 'trust':
+            return candidate
+
+    # no uploaded video has the size of the file, so it's not uploaded
+    # whatever its hash is -- it's hashed only when uploaded
+    if needs_md5 is not None and candidate is None and not needs_md5(local_file_path):
+        return None
+
+    # a new file as far as metadata goes -- unless its hash is already
+    # known, it will be hashed from the uploaded chunks
+    if hash_while_upload and candidate is None and needs_md5 is None:
+        local_hash = client.cached_file_hash(local_file_path)
+        return index.find_by_md5(local_hash) if local_hash else None
 
-def find_already_uploaded(client: YouTubeClient, videos: Iterable[Video], local_file_path: str) -> Optional[Video]:
     local_hash = client.file_hash(local_file_path)
 
     # work using videos description MD5 inside!
-    for video in videos:
-        if client.is_matching_video(local_hash, video):
-            return video
+    return index.find_by_md5(local_hash)
 
-    return None
 
+def add_to_playlist(client: YouTubeClient, playlistId: str) -> None:
+    # the videos stay queued, so e.g. running out of quota must not fail the upload they came from
+    try:
+        results = client.add_queued_videos_to_playlist(playlistId)
+    except Exception as e:
+        log.error(f'unable to add videos to the playlist, will retry later: {e}')
+        return
 
-def get_files_for_upload(
+    for videoId, result in results.items():
+        if result.error is not None:
+            log.error(f'  unable to add video {videoId} to the playlist, will retry later: {result.error}')
+        else:
+            log.debug(f'  added {videoId} -> {playlistId}')
+
+
+def iter_files_for_upload(
         client: YouTubeClient,
         dir: str,
         creation_cut_off: Optional[datetime],
         modification_cut_off: Optional[datetime] = None,
+        dir_index: Optional[YoutubeCacheBase] = None,
+        look_ahead: Optional[int] = None,
+) -> Iterator[LocalFile]:
+    log.debug(f'Discovering videos in {dir}...')
+
+    files = DirectoryScanner(client.is_video, cache=dir_index).iter_files(dir)
+
+    if creation_cut_off or modification_cut_off:
+        log.debug(f'Cut-off date was specified, applying filter...')
+        files = filter_by_cut_off(files, creation_cut_off, modification_cut_off)
+
+    return ordered_by_modification_time(files, look_ahead)
+
+
+def select_watched_files(
+        paths: List[str],
+        creation_cut_off: Optional[datetime],
+        modification_cut_off: Optional[datetime] = None,
 ) -> List[str]:
-    upload_queue = []
+    """Applies the same filter as the discovery to the files reported by the watcher."""
+    return [file.path for file in filter_by_cut_off(stat_files(paths), creation_cut_off, modification_cut_off)]
 
-    log.debug(f'Discovering videos in {dir}...')
 
-    for root, subdirs, files in os.walk(dir):
-        log.debug(f'  walking in {root}...')
+def get_files_for_upload(
+        client: YouTubeClient,
+        dir: str,
+        creation_cut_off: Optional[datetime],
+        modification_cut_off: Optional[datetime] = None,
+        dir_index: Optional[YoutubeCacheBase] = None,
+) -> List[LocalFile]:
+    return list(iter_files_for_upload(client, dir, creation_cut_off, modification_cut_off, dir_index))
+
 
-        for file in files:
-            if not client.is_video(file):
-                continue
+def load_uploaded_index(client: YouTubeClient, playlists: List[Playlist], concurrency: int) -> VideoIndex:
+    uploaded_index = VideoIndex()
 
-            path = os.path.join(root, file)
-            created_at = datetime.fromtimestamp(os.path.getctime(path))
-            modified_at = datetime.fromtimestamp(os.path.getmtime(path))
+    log.debug(f'Populating ALL videos to detect already uploaded')
+
+    playlist_indices = client.get_playlist_video_indices(playlists, concurrency=concurrency)
+
+    playlist: Playlist
+    for playlist in playlists:
+        playlist_index = playlist_indices[playlist.playlistId]
+        log.debug(
+            f'  {playlist.title:30} {playlist.playlistId:38} {len(playlist_index):5} items')
+        uploaded_index.update(playlist_index)
 
-            log.debug(f'    looking at {file} (created at: {created_at}, modified at: {modified_at})')
-            upload_queue.append(path)
+    log.debug(
+        f'Populated {len(uploaded_index)} videos in total in {len(playlists)} playlists')
 
-    if creation_cut_off:
-        log.debug(f'Creation cut-off date was specified, applying filter... '
-                  f'Discovered: {len(upload_queue)}')
-        upload_queue = list(filter(lambda path: datetime.fromtimestamp(
-            os.path.getctime(path)) >= creation_cut_off, upload_queue))
-        log.debug(f'  after creation date filter: {len(upload_queue)}')
+    # older uploads have only MD5 in the description, any local file may be one of them
+    unsized = len(uploaded_index.by_size.get(UNKNOWN_SIZE, []))
+    if unsized:
+        log.warning(f'{unsized} uploaded videos have no size in the description, '
+                    f'local files have to be hashed to be compared with them')
 
-    if modification_cut_off:
-        log.debug(f'Modification cut-off date was specified, applying filter... '
-                  f'Discovered: {len(upload_queue)}')
-        upload_queue = list(filter(lambda path: datetime.fromtimestamp(
-            os.path.getmtime(path)) >= modification_cut_off, upload_queue))
-        log.debug(f'  after modification date filter: {len(upload_queue)}')
+    return uploaded_index
 
-    upload_queue.sort(key=lambda path: os.path.getmtime(path))
 
-    return upload_queue
+def watch_and_upload(
+        watcher: FileWatcher,
+        upload: Callable[[List[str]], UploadSummary],
+        deadline: Optional[datetime] = None,
+        select: Optional[Callable[[List[str]], List[str]]] = None,
+) -> int:
+    """Uploads the files as they appear until interrupted or the deadline passes, returns the number of uploads."""
+    log.info(f'Watching {watcher.root} for new videos, press Ctrl+C to stop')
+
+    uploaded = 0
+
+    try:
+        for batch in watcher.batches(should_stop=lambda: deadline is not None and datetime.now() >= deadline):
+            # the watcher reports every file which appears, also old ones
+            # moved in or listed again after the events were lost
+            if select is not None:
+                batch = select(batch)
+                if not batch:
+                    continue
+
+            log.info(f'{len(batch)} new or changed files to upload')
+
+            # a failed file is left for the next run, watching goes on
+            try:
+                uploaded += upload(batch).uploaded
+            except Exception as e:
+                log.error(f'unable to upload new files: {e}')
+    except KeyboardInterrupt:
+        log.info('Stopped watching')
+
+    return uploaded
+
+
+def log_duplicates(fingerprints: StagedFingerprints) -> None:
+    if not fingerprints.duplicates:
+        return
+
+    log.info(f'Found {len(fingerprints.duplicates)} local duplicates, uploaded only once:')
+    for path, original in fingerprints.duplicates.items():
+        log.info(f'  {path} -> {original}')
 
 
 def valid_date(s):
@@ -74,6 +190,20 @@ def valid_date(s):
         raise argparse.ArgumentTypeError(msg)
 
 
+def valid_time_of_day(s):
+    try:
+        return parse_time_of_day(s)
+    except Exception as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def valid_bandwidth_limit(s):
+    try:
+        return BandwidthSchedule.parse(s)
+    except Exception as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def init_logging(log_level: str = 'INFO') -> None:
     # file logger
     file_handler = logging.FileHandler("youtube_uploader.log", encoding='utf8')
@@ -93,48 +223,69 @@ def init_logging(log_level: str = 'INFO') -> None:
     logging.getLogger('googleapiclient.discovery').disabled = True
 
 
-def main():
-    global log
+def report_metrics(metrics_file: Optional[str]) -> None:
+    log.info('API calls and local operations of the run:')
+    for line in metrics.summary_table().splitlines():
+        log.info(f'  {line}')
 
-    argparser = argparse.ArgumentParser()
+    if metrics_file:
+        try:
+            metrics.write(metrics_file)
+        except OSError as e:
+            log.warning(f'unable to write metrics into {metrics_file}: {e}')
 
-    argparser.add_argument("--dir", required=True,
-                           help="Directory to digest files inside")
-    argparser.add_argument("--playlist", required=True,
-                           help="Playlist to for video to be added to (will be found via contains)")
-    argparser.add_argument("--client-secrets-file", required=False, default='client_secrets.json',
-                           help="Path to client secrets file, when different from client_secrets.json")
-    argparser.add_argument("--credentials-file", required=False, default='credentials.json',
-                           help="Path to stored credentials file, when different from credentials.json")
-    argparser.add_argument("--creation-date-cutoff", required=False, default=None, type=valid_date,
-                           help="Allows to specify cutoff date (YYYY-MM-DD) for the file creation time in order to be picked up")
-    argparser.add_argument("--modification-date-cutoff", required=False, default=None, type=valid_date,
-                           help="Allows to specify cutoff date (YYYY-MM-DD) for the file modification time in order to be picked up")
-    argparser.add_argument("--log-level", required=False, default='INFO',
-                           help="Logging level (DEBUG, INFO, WARN, ERROR)")
-    argparser.add_argument("--disable-ssl-validation", required=False, default=False,
-                           action=argparse.BooleanOptionalAction,
-                           help="Disables SSL validation")
 
-    args = argparser.parse_args()
+def upload_directory(args: argparse.Namespace) -> None:
+    """Uploads the new videos of the directory (or only plans it) as the parsed arguments say."""
+    client_secrets_files = args.client_secrets_file or ['client_secrets.json']
+    credentials_files = args.credentials_file or ['credentials.json']
 
-    init_logging(args.log_level)
+    if len(client_secrets_files) != len(credentials_files):
+        raise Exception('Every --client-secrets-file has to be paired with --credentials-file')
 
-    log = logging.getLogger("main")
+    credential_sets = [CredentialSet(client_secrets_file, credentials_file)
+                       for client_secrets_file, credentials_file in zip(client_secrets_files, credentials_files)]
 
-    log.info(f'YouTube uploader started ({args.dir})!')
-    log.debug(f'CWD: {os.getcwd()}')
-    log.debug(f'Arguments: {args.__dict__}')
+    bandwidth_limiter = BandwidthLimiter(args.bandwidth_limit) if args.bandwidth_limit else None
+    deadline = next_occurrence(args.until) if args.until else None
+
+    if deadline:
+        log.info(f'Uploads are only started when expected to finish before {deadline:%Y-%m-%d %H:%M}')
 
     # construct the client
     youtube: YouTubeClient
     with YouTubeClientImpl(
-        client_secrets_file_path=args.client_secrets_file,
-            credentials_file_path=args.credentials_file,
-            disable_ssl_validation=args.disable_ssl_validation) as youtube:
-
-        # authorize the user!
-        youtube.authorize()
+            credential_sets=credential_sets,
+            daily_quota=args.daily_quota,
+            disable_ssl_validation=args.disable_ssl_validation,
+            hash_workers=args.hash_workers,
+            hash_block_size=args.hash_block_size * 1024 * 1024,
+            cache_backend=args.cache_backend,
+            cache_path=args.cache_file,
+            cache_checkpoint_interval=args.cache_checkpoint_interval,
+            cache_shared=args.shared_cache,
+            upload_chunk_size=args.upload_chunk_size * 1024 * 1024,
+            hash_while_upload=args.hash_while_upload,
+            offline=args.plan,
+            bandwidth_limiter=bandwidth_limiter) as youtube:
+
+        for project in youtube.projects:
+            log.info(f'Project {project} has about {youtube.quota.remaining(project)} quota units left for today')
+
+        # planning hashes all the files, so that the real run does not have to
+        hash_while_upload = args.hash_while_upload and not args.plan
+
+        if not args.plan:
+            # authorize the user!
+            youtube.authorize()
+
+            # finish what previous runs uploaded with the hash calculated on the fly
+            youtube.complete_pending_descriptions()
+
+            # videos uploaded by previous runs are only found as uploaded
+            # once they are in a playlist, so they are added before listing
+            for playlistId in youtube.queued_playlist_adds():
+                add_to_playlist(youtube, playlistId)
 
         # get ALL playlists
         playlists_response = youtube.get_my_playlists()
@@ -152,65 +303,271 @@ def main():
         log.debug(
             f'Found the target playlist -- {target_playlist.title} ({target_playlist.playlistId})')
 
-        all_videos = []
-
-        log.debug(f'Populating ALL videos to detect already uploaded')
-
-        playlist: Playlist
-        for playlist in playlists_response.playlists:
-            playlist_videos_response = youtube.get_playlist_videos(playlist.playlistId, etag=playlist.etag)
-            log.debug(
-                f'  {playlist.title:30} {playlist.playlistId:38} {len(playlist_videos_response.videos):5} items')
-            all_videos.extend(playlist_videos_response.videos)
-
-        log.debug(
-            f'Populated {len(all_videos)} videos in total in {len(playlists_response.playlists)} playlists')
-
-        # find all files for upload
-        upload_queue = get_files_for_upload(
-            youtube, args.dir, args.creation_date_cutoff, args.modification_date_cutoff)
-
-        if len(upload_queue) > 0:
-            log.debug(f"Discovered {len(upload_queue)} items, start upload procedure")
+        # remote listings are loaded while the local files are already being
+        # discovered and staged, the pipeline waits for them when deciding
+        # what to hash and whether a file is uploaded already
+        with ExitStack() as stack:
+            background = stack.enter_context(ThreadPoolExecutor(max_workers=1, thread_name_prefix='index'))
+            index_future = background.submit(
+                load_uploaded_index, youtube, playlists_response.playlists, args.playlist_fetch_concurrency)
+
+            def has_metadata_match(path: str) -> bool:
+                return index_future.result().find_by_metadata(youtube.file_metadata_key(path)) is not None
+
+            # watching starts before the discovery so that the files coming
+            # in the meantime are not missed
+            if args.watch:
+                watcher = stack.enter_context(create_watcher(
+                    args.dir, youtube.is_video, settle=args.watch_settle, poll_interval=args.watch_poll_interval))
+            else:
+                watcher = None
+
+            files = iter_files_for_upload(
+                youtube, args.dir, args.creation_date_cutoff, args.modification_date_cutoff,
+                dir_index=youtube.cache if args.dir_index else None,
+                look_ahead=args.look_ahead)
+
+            # files are told apart by size and partial hash first: full MD5
+            # is needed only when an uploaded video has the same size or
+            # when another local file looks the same, local duplicates are
+            # dropped right away; when every file is hashed anyway, files of
+            # the same size are compared by MD5 straight away
+            hash_everything = args.metadata_match == 'off' and not hash_while_upload
+            fingerprints = StagedFingerprints(
+                youtube.file_hash if hash_everything else youtube.file_partial_hash,
+                youtube.file_hash,
+                lambda path: index_future.result().has_size_candidate(youtube.file_size_key(path)))
+
+            def prepare(paths: Iterable[str]) -> Iterator[str]:
+                paths = fingerprints.iter_unique(paths)
+
+                # hash ahead using all the workers; without metadata matching or
+                # hashing while uploading every file needs its MD5 either to be
+                # found among the uploaded videos or to be uploaded, otherwise
+                # files with nothing to compare with are hashed when uploaded
+                if hash_everything:
+                    should_hash = None
+                elif args.metadata_match == 'trust':
+                    def should_hash(path: str) -> bool:
+                        return fingerprints.needs_md5(path) and not has_metadata_match(path)
+                else:
+                    def should_hash(path: str) -> bool:
+                        return fingerprints.needs_md5(path) or has_metadata_match(path)
+
+                return (path for path, _ in youtube.file_hashes_ahead(paths, should_hash=should_hash))
+
+            paths = prepare(file.path for file in files)
+
+            def find_uploaded(path: str) -> Optional[Video]:
+                return find_already_uploaded(
+                    youtube, index_future.result(), path, args.metadata_match, hash_while_upload,
+                    needs_md5=fingerprints.needs_md5)
+
+            if args.plan:
+                # bandwidth in bytes per second, falls back to the aggregate
+                # throughput (MB/s) achieved by the last real run
+                bandwidth = args.plan_bandwidth or youtube.cache.get(RUN_STATS_CACHE_SECTION, 'upload-throughput')
+
+                plan = build_plan(
+                    paths,
+                    find_uploaded,
+                    youtube.cached_file_hash,
+                    units_per_upload=QUOTA_COSTS['videos.insert'] + QUOTA_COSTS['playlistItems.insert'],
+                    bandwidth=bandwidth * 1024 * 1024 if bandwidth else None,
+                    daily_units=args.daily_quota * len(youtube.projects))
+
+                plan.log_summary()
+                log_duplicates(fingerprints)
+
+                if args.plan_file:
+                    plan.write(args.plan_file)
+                    log.info(f'Plan was written into {args.plan_file}')
+
+                return
+
+            def on_uploaded(path: str, videoId: str) -> None:
+                queued = youtube.queue_playlist_add(target_playlist.playlistId, videoId)
+
+                # files coming later (e.g. in watch mode) are checked against it as well
+                try:
+                    md5 = youtube.cached_file_hash(path)
+                    index_future.result().add(
+                        Video(videoId, os.path.splitext(os.path.basename(path))[0], md5=md5),
+                        md5,
+                        youtube.file_metadata_key(path),
+                        youtube.file_size_key(path))
+                except OSError as e:
+                    log.warning(f'unable to index uploaded {path}: {e}')
+
+                if queued >= PLAYLIST_ADD_BATCH_SIZE:
+                    add_to_playlist(youtube, target_playlist.playlistId)
+
+            # until the first upload is done the speed of a single upload is
+            # estimated from the limit or the aggregate throughput (MB/s)
+            # of the last run, both shared by the concurrent uploads
+            upload_rate = None
+            if deadline:
+                throughput = youtube.cache.get(RUN_STATS_CACHE_SECTION, 'upload-throughput')
+                rates = [rate for rate in [
+                    bandwidth_limiter.current_rate() if bandwidth_limiter else None,
+                    throughput * 1024 * 1024 if throughput else None,
+                ] if rate]
+                if rates:
+                    upload_rate = min(rates) / max(1, args.upload_concurrency)
+
+            def upload(paths: Iterable[str]) -> UploadSummary:
+                scheduler = UploadScheduler(
+                    youtube,
+                    find_uploaded=find_uploaded,
+                    concurrency=args.upload_concurrency,
+                    on_uploaded=on_uploaded,
+                    deadline=deadline,
+                    upload_rate=upload_rate)
+
+                try:
+                    return scheduler.run(paths)
+                finally:
+                    add_to_playlist(youtube, target_playlist.playlistId)
+
+            summary = upload(paths)
+            uploaded = summary.uploaded
+
+            if watcher is not None:
+                uploaded += watch_and_upload(
+                    watcher,
+                    lambda batch: upload(prepare(batch)),
+                    deadline,
+                    select=lambda batch: select_watched_files(
+                        batch, args.creation_date_cutoff, args.modification_date_cutoff))
+
+            log_duplicates(fingerprints)
+
+        if uploaded > 0:
+            log.info(f'Uploaded {uploaded} new videos!')
+
+            try:
+                youtube.cache.update(RUN_STATS_CACHE_SECTION, 'upload-throughput', summary.throughput)
+            except Exception as e:
+                log.warning(f'unable to save upload throughput into the cache: {e}')
         else:
-            log.info('Nothing to upload!')
+            log.info(f'No new videos uploaded')
 
-        upload_count = 0
 
-        for path in upload_queue:
-            log.debug(f'handling {path}...')
+def main():
+    global log
 
-            already_uploaded: Optional[Video] = find_already_uploaded(
-                youtube, all_videos, path)
+    argparser = argparse.ArgumentParser()
 
-            if already_uploaded:
-                log.debug(
-                    f'  already uploaded as {already_uploaded.title} (ID: {already_uploaded.videoId})')
-                continue
+    argparser.add_argument("--dir", required=True,
+                           help="Directory to digest files inside")
+    argparser.add_argument("--playlist", required=True,
+                           help="Playlist to for video to be added to (will be found via contains)")
+    argparser.add_argument("--client-secrets-file", required=False, default=None, action='append',
+                           help="Path to client secrets file, when different from client_secrets.json; "
+                                "can be repeated to rotate across several projects")
+    argparser.add_argument("--credentials-file", required=False, default=None, action='append',
+                           help="Path to stored credentials file, when different from credentials.json; "
+                                "repeated along with --client-secrets-file, one per project")
+    argparser.add_argument("--creation-date-cutoff", required=False, default=None, type=valid_date,
+                           help="Allows to specify cutoff date (YYYY-MM-DD) for the file creation time in order to be picked up")
+    argparser.add_argument("--modification-date-cutoff", required=False, default=None, type=valid_date,
+                           help="Allows to specify cutoff date (YYYY-MM-DD) for the file modification time in order to be picked up")
+    argparser.add_argument("--log-level", required=False, default='INFO',
+                           help="Logging level (DEBUG, INFO, WARN, ERROR)")
+    argparser.add_argument("--disable-ssl-validation", required=False, default=False,
+                           action=argparse.BooleanOptionalAction,
+                           help="Disables SSL validation")
+    argparser.add_argument("--hash-workers", required=False, default=4, type=int,
+                           help="Number of files to hash in parallel")
+    argparser.add_argument("--hash-block-size", required=False, default=8, type=int,
+                           help="Size of a single read when hashing files, in MiB")
+    argparser.add_argument("--cache-backend", required=False, default='yaml', choices=['yaml', 'sqlite'],
+                           help="Storage used for the cache")
+    argparser.add_argument("--cache-file", required=False, default=None,
+                           help="Path to the cache file, default is cache.yaml or cache.sqlite depending on backend")
+    argparser.add_argument("--import-yaml-cache", required=False, default=None,
+                           help="Path to the YAML cache to import into the SQLite cache before the run")
+    argparser.add_argument("--cache-checkpoint-interval", required=False, default=60, type=float,
+                           help="How often (in seconds) cache changes are saved to the disk during the run, 0 to only save at the end")
+    argparser.add_argument("--shared-cache", required=False, default=False,
+                           action=argparse.BooleanOptionalAction,
+                           help="Lock and merge the YAML cache so that several processes can share it")
+    argparser.add_argument("--playlist-fetch-concurrency", required=False, default=8, type=int,
+                           help="Number of playlists to fetch in parallel")
+    argparser.add_argument("--upload-concurrency", required=False, default=1, type=int,
+                           help="Number of videos to upload in parallel")
+    argparser.add_argument("--upload-chunk-size", required=False, default=64, type=int,
+                           help="Size of a single upload request in MiB, progress of interrupted uploads is kept per chunk; "
+                                "0 uploads the whole file in a single request")
+    argparser.add_argument("--hash-while-upload", required=False, default=False,
+                           action=argparse.BooleanOptionalAction,
+                           help="Hash new files from the uploaded chunks instead of reading them twice, "
+                                "MD5 is added to the description once the upload is done")
+    argparser.add_argument("--dir-index", required=False, default=False,
+                           action=argparse.BooleanOptionalAction,
+                           help="Keep directory listings in the cache and only list directories changed since the previous run")
+    argparser.add_argument("--look-ahead", required=False, default=None, type=int,
+                           help="Start uploading while files are still being discovered, keeping them ordered by "
+                                "modification time within a window of that many files; by default all the files "
+                                "are discovered and sorted first")
+    argparser.add_argument("--metadata-match", required=False, default='off', choices=['off', 'confirm', 'trust'],
+                           help="Use file name, size and modification time to find already uploaded files: "
+                                "'confirm' only hashes upfront files with a matching video and the rest right before upload, "
+                                "'trust' skips hashing matching files altogether")
+    argparser.add_argument("--daily-quota", required=False, default=DEFAULT_DAILY_QUOTA, type=int,
+                           help="Quota units every project gets per day")
+    argparser.add_argument("--metrics-file", required=False, default=None,
+                           help="Write API call, hashing and cache statistics of the run into the file: "
+                                "Prometheus text format when it ends with .prom, JSON otherwise")
+    argparser.add_argument("--plan", required=False, default=False,
+                           action=argparse.BooleanOptionalAction,
+                           help="Only find out what would be uploaded using the cached playlists, without "
+                                "authorization or any API calls; files are still hashed and the hashes cached")
+    argparser.add_argument("--plan-file", required=False, default=None,
+                           help="Write the plan into the file: a row per file when it ends with .csv, JSON otherwise")
+    argparser.add_argument("--plan-bandwidth", required=False, default=None, type=float,
+                           help="Upload throughput in MB/s the upload time is estimated with, "
+                                "default is the throughput of the last run")
+    argparser.add_argument("--bandwidth-limit", required=False, default=None, type=valid_bandwidth_limit,
+                           help="Limit of the upload rate of all the uploads together in MB/s, optionally "
+                                "per time of day, e.g. '08:00-23:00=1,5' uploads at 1 MB/s during the day "
+                                "and at 5 MB/s at night (0 means no limit)")
+    argparser.add_argument("--until", required=False, default=None, type=valid_time_of_day,
+                           help="Time of day (HH:MM) to stop starting uploads at; uploads which are not "
+                                "expected to finish by then are left for the next run")
+    argparser.add_argument("--watch", required=False, default=False,
+                           action=argparse.BooleanOptionalAction,
+                           help="Keep running after the files are uploaded and upload new files as they appear "
+                                "in the directory (inotify, listing the directory periodically where not available)")
+    argparser.add_argument("--watch-settle", required=False, default=10, type=float,
+                           help="Seconds a new file has to stay unchanged before it's uploaded in watch mode")
+    argparser.add_argument("--watch-poll-interval", required=False, default=30, type=float,
+                           help="Seconds between directory listings in watch mode when inotify is not available")
 
-            _, fileName = os.path.split(path)
-            fileNameNoExt = os.path.splitext(fileName)[0]
-            size = os.path.getsize(path)
+    args = argparser.parse_args()
 
-            log.info(f'  uploading a video ({size / (1024 * 1024):.2f} MiB)...')
+    init_logging(args.log_level)
 
-            upload_response = youtube.upload_video(
-                path, title=fileNameNoExt, privacyLevel='unlisted')
+    log = logging.getLogger("main")
 
-            log.info(f'  upload successfull, ID: {upload_response.videoId}')
+    log.info(f'YouTube uploader started ({args.dir})!')
+    log.debug(f'CWD: {os.getcwd()}')
+    log.debug(f'Arguments: {args.__dict__}')
 
-            log.info(f'  adding video to the playlist... ({upload_response.videoId} -> {target_playlist.playlistId})')
-            youtube.add_video_to_playlist(
-                playlistId=target_playlist.playlistId, videoId=upload_response.videoId)
+    if args.import_yaml_cache:
+        if args.cache_backend != 'sqlite':
+            raise Exception('YAML cache can only be imported when SQLite cache backend is used')
 
-            log.info(f'  processed!')
+        with SqliteYoutubeCache(args.cache_file or 'cache.sqlite') as cache:
+            cache.import_from_yaml(args.import_yaml_cache)
 
-            upload_count += 1
+    if args.watch and args.plan:
+        raise Exception('--watch can not be combined with --plan')
 
-        if upload_count > 0:
-            log.info(f'Uploaded {upload_count} new videos!')
-        else:
-            log.info(f'No new videos uploaded')
+    try:
+        upload_directory(args)
+    finally:
+        report_metrics(args.metrics_file)
 
 
 def entrypoint():
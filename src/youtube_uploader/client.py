@@ -1,67 +1,240 @@
-import http.client
 import logging
 import os
-import random
-from datetime import datetime, time
-from typing import Optional
+import re
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import httplib2
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import HttpRequest, MediaFileUpload
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.file import Storage
 from oauth2client.tools import run_flow
 
-from youtube_uploader.cache import YamlYoutubeCache
-from youtube_uploader.hasher import YouTubeHasher
+from youtube_uploader.cache import YamlYoutubeCache, SqliteYoutubeCache, YoutubeCacheBase
+from youtube_uploader.hasher import HashClaims, YouTubeHasher
+from youtube_uploader.media import HashingMediaFileUpload, ThrottledMediaFileUpload
+from youtube_uploader.metrics import registry as metrics, instrument_http
 from youtube_uploader.model import (
     YouTubeClient,
+    BatchItemResult,
     GetMyPlaylistsResponse,
     Playlist,
     PlaylistVideosResponse,
     Video,
+    VideoIndex,
+    UNKNOWN_SIZE,
     UploadVideoResponse,
 )
+from youtube_uploader.quota import (
+    CredentialSet,
+    QuotaTracker,
+    QUOTA_COSTS,
+    DEFAULT_DAILY_QUOTA,
+    is_quota_exceeded,
+)
+from youtube_uploader.retry import (
+    RETRY_POLICIES,
+    SINGLE_ATTEMPT,
+    CircuitBreaker,
+    RetryPolicy,
+    call_with_retries,
+    is_retriable,
+)
+from youtube_uploader.throttle import BandwidthLimiter
 
 log = logging.getLogger(__name__)
 
+# matches the lines written by _generate_metadata
+MD5_DESCRIPTION_PATTERN = re.compile(r'^MD5: ([0-9a-f]{32})\s*$', re.MULTILINE)
+FILE_NAME_DESCRIPTION_PATTERN = re.compile(r'^File name: (.+?)\s*$', re.MULTILINE)
+SIZE_DESCRIPTION_PATTERN = re.compile(r'^Size: (.+?)\s*$', re.MULTILINE)
+MODIFIED_AT_DESCRIPTION_PATTERN = re.compile(r'^Modified at: (.+?)\s*$', re.MULTILINE)
+
+# max amount of items per page or IDs per single call the API allows
+API_MAX_RESULTS = 50
+
+UPLOAD_SESSIONS_CACHE_SECTION = 'upload-sessions-v1'
+
+# listing of the playlists of the channel, so that it's known offline
+MY_PLAYLISTS_CACHE_SECTION = 'my-playlists-v2'
+
+# contract of the cached playlist content: pages of videos, see Video.to_data
+PLAYLIST_VIDEOS_DATA_VERSION = 'v3'
+
+# videos uploaded with the hash calculated during the upload, which
+# description still has to be updated with the MD5, video ID -> description
+PENDING_DESCRIPTIONS_CACHE_SECTION = 'pending-descriptions-v2'
+
+# videos uploaded but not added to their playlist yet, an entry per video
+# (keyed by playlist and video ID), so that processes sharing the cache do
+# not overwrite each other's queue
+PENDING_PLAYLIST_ADDS_CACHE_SECTION = 'pending-playlist-adds-v2'
+
+# placeholder for the MD5 in descriptions while the file is being uploaded
+PENDING_MD5 = 'pending'
+
+# resumable upload chunks have to be multiple of this size
+UPLOAD_CHUNK_GRANULARITY = 256 * 1024
+
 SUPPORTED_VIDEO_EXTENSIONS = ['.mp4', '.mov', '.avi', '.mkv', '.wmv', '.m4v', '.flv', '.webm', '.mpeg', '.mpg']
 
 
+def resume_upload_request(request: HttpRequest, uri: str, progress: int) -> None:
+    """Points a new resumable request at the upload session started by an earlier request.
+
+    googleapiclient has no public way to resume a session created by
+    another request (or process): HttpRequest.next_chunk only asks the
+    server how many bytes it has (an empty PUT with "Content-Range: bytes
+    */size") when the private `_in_error_state` flag is set, which it sets
+    itself after a failed chunk. Relies on google-api-python-client 2.x
+    internals (2.196 is pinned in requirements.txt), the behavior is checked
+    against the installed library by ResumableUploadSessionTest.
+    """
+    if not hasattr(request, '_in_error_state'):
+        raise Exception('This version of google-api-python-client can not resume uploads -- '
+                        'check resume_upload_request against it')
+
+    request.resumable_uri = uri
+    request.resumable_progress = progress
+    request._in_error_state = True
+
+
+def build_http(disable_ssl_validation: bool = False) -> httplib2.Http:
+    """Http for the API calls, chunked resumable uploads included.
+
+    Resumable uploads answer every chunk but the last one with 308, which
+    httplib2 (0.19+) lists in `redirect_codes` and would follow as a
+    redirect. googleapiclient removes it only from the Http objects it
+    creates itself, so an Http passed to build() has to do the same.
+    """
+    http = httplib2.Http(disable_ssl_certificate_validation=disable_ssl_validation)
+    http.redirect_codes = http.redirect_codes - {308}
+
+    return http
+
+
 class YouTubeClientImpl(YouTubeClient):
     def __init__(
             self,
             client_secrets_file_path: str = 'client_secrets.json',
             credentials_file_path: str = 'credentials.json',
-            disable_ssl_validation: bool = False):
+            disable_ssl_validation: bool = False,
+            hash_workers: int = 4,
+            hash_block_size: int = 8 * 1024 * 1024,
+            cache_backend: str = 'yaml',
+            cache_path: Optional[str] = None,
+            cache_checkpoint_interval: Optional[float] = 60,
+            cache_shared: bool = False,
+            upload_chunk_size: int = 64 * 1024 * 1024,
+            hash_while_upload: bool = False,
+            credential_sets: Optional[List[CredentialSet]] = None,
+            daily_quota: int = DEFAULT_DAILY_QUOTA,
+            offline: bool = False,
+            api_endpoint: Optional[str] = None,
+            bandwidth_limiter: Optional[BandwidthLimiter] = None):
         log.debug('Creating YouTube client...')
         self.scopes = ['https://www.googleapis.com/auth/youtube.readonly',
                        'https://www.googleapis.com/auth/youtube.upload',
                        'https://www.googleapis.com/auth/youtube']  # to add files to playlists
         self.api_service = 'youtube'
         self.api_version = 'v3'
+        # e.g. a local stand-in of the API for benchmarks, the default one when not set
+        self.api_endpoint = api_endpoint
         self.client_secrets_file_path = client_secrets_file_path
         self.credentials_file_path = credentials_file_path
-        self._cache = YamlYoutubeCache('cache.yaml')
-        self._hasher = YouTubeHasher(self._cache)
+
+        # every set belongs to a separate project with its own daily quota,
+        # calls go to the first project which still has enough units left
+        self.credential_sets = credential_sets or [CredentialSet(client_secrets_file_path, credentials_file_path)]
+
+        if cache_backend == 'sqlite':
+            self._cache = SqliteYoutubeCache(cache_path or 'cache.sqlite', cache_checkpoint_interval)
+        elif cache_backend == 'yaml':
+            self._cache = YamlYoutubeCache(cache_path or 'cache.yaml', cache_checkpoint_interval, shared=cache_shared)
+        else:
+            raise Exception(f'Unsupported cache backend: {cache_backend}')
+        self._hasher = YouTubeHasher(
+            self._cache,
+            workers=hash_workers,
+            block_size=hash_block_size,
+            claims=HashClaims(f'{self._cache.path}.hashing') if cache_shared else None)
+        self._quota = QuotaTracker(self._cache, daily_limit=daily_quota)
         self._disable_ssl_validation = disable_ssl_validation
 
+        # -1 sends the whole file in a single request
+        if upload_chunk_size > 0:
+            upload_chunk_size = -(-upload_chunk_size // UPLOAD_CHUNK_GRANULARITY) * UPLOAD_CHUNK_GRANULARITY
+        else:
+            upload_chunk_size = -1
+        self._upload_chunk_size = upload_chunk_size
+
+        # files without a known hash are hashed from the uploaded chunks and
+        # the description is updated with the MD5 once the upload is done
+        self._hash_while_upload = hash_while_upload
+
+        # shared by all the uploads, limits their aggregate speed
+        self._bandwidth_limiter = bandwidth_limiter
+
+        # shared by all the threads, so that sustained failures pause all of them
+        self._breaker = CircuitBreaker()
+        self._pending_playlist_adds_lock = threading.Lock()
+        self._playlist_adds_lock = threading.Lock()
+        # (playlistId, videoId) queued by this process and not sent yet, the
+        # rest of the queue may have been added by an attempt which failed
+        self._unsent_playlist_adds: Set[Tuple[str, str]] = set()
+        self._credentials = {}  # project -> credentials
+        self._credentials_lock = threading.RLock()
+
+        # httplib2.Http is not thread-safe, so every thread gets its own
+        # authorized Http and service per project sharing the same credentials
+        self._local = threading.local()
+
+        # offline client never authorizes nor calls the API -- playlists and
+        # their content are taken from the cache as is, even if outdated
+        self.offline = offline
+
+    @property
+    def quota(self) -> QuotaTracker:
+        return self._quota
+
+    @property
+    def projects(self) -> List[str]:
+        return [credential_set.project_id for credential_set in self.credential_sets]
+
+    @property
+    def cache(self) -> YoutubeCacheBase:
+        return self._cache
+
     def __enter__(self):
         self._cache.read_from_disk()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._cache.flush()
+        # hashes are in the shared cache now, other processes do not need the claims
+        self._hasher.release_claims()
 
-    def _get_authenticated_service(self):
+    def _get_credential_set(self, project: str) -> CredentialSet:
+        for credential_set in self.credential_sets:
+            if credential_set.project_id == project:
+                return credential_set
+
+        raise Exception(f'Unknown project: {project}')
+
+    def _get_credentials(self, credential_set: CredentialSet):
         flow = flow_from_clientsecrets(
-            self.client_secrets_file_path,
+            credential_set.client_secrets_file_path,
             scope=self.scopes,
             message="missing secrets message here!"
         )
 
-        storage = Storage(self.credentials_file_path)
+        storage = Storage(credential_set.credentials_file_path)
         credentials = storage.get()
 
         class Args(object):
@@ -77,117 +250,338 @@ class YouTubeClientImpl(YouTubeClient):
         if credentials is None or credentials.invalid:
             credentials = run_flow(flow, storage, args)
 
-        return build(
+        return credentials
+
+    def _get_authenticated_service(self, project: Optional[str] = None):
+        if self.offline:
+            raise Exception('YouTube API can not be used by the offline client')
+
+        started_at = timeit.default_timer()
+
+        project = project or self.projects[0]
+
+        if not hasattr(self._local, 'services'):
+            self._local.services = {}  # project -> (http, service)
+
+        if project in self._local.services:
+            http, service = self._local.services[project]
+
+            # credentials were obtained from the Storage, so refreshed tokens
+            # are written back to the credentials file by oauth2client itself
+            with self._credentials_lock:
+                credentials = self._credentials[project]
+                if credentials.access_token_expired:
+                    log.debug(f'access token for {project} expired, refreshing...')
+                    credentials.refresh(http)
+
+            log.debug(f'reused YouTube service in {timeit.default_timer() - started_at:.3f} sec')
+            return service
+
+        with self._credentials_lock:
+            if project not in self._credentials:
+                self._credentials[project] = self._get_credentials(self._get_credential_set(project))
+            credentials = self._credentials[project]
+
+        # the same authorized Http object is used for all the calls made by
+        # the thread, so that connections are kept alive and tokens are
+        # refreshed in place on 401
+        http = instrument_http(credentials.authorize(build_http(self._disable_ssl_validation)))
+
+        service = build(
             self.api_service,
             self.api_version,
-            http=credentials.authorize(
-                httplib2.Http(disable_ssl_certificate_validation=self._disable_ssl_validation))
+            http=http,
+            client_options={'api_endpoint': self.api_endpoint} if self.api_endpoint else None
         )
 
+        self._local.services[project] = (http, service)
+
+        log.debug(f'built YouTube service for {project} in {timeit.default_timer() - started_at:.3f} sec')
+
+        return service
+
     def authorize(self) -> None:
-        _ = self._get_authenticated_service()
+        # all the projects are authorized upfront, so that the browser flow
+        # does not pop up in the middle of the run
+        for project in self.projects:
+            _ = self._get_authenticated_service(project)
 
-    def get_my_playlists(self) -> GetMyPlaylistsResponse:
-        youtube = self._get_authenticated_service()
+    def _pick_project(self, endpoint: str, calls: int = 1) -> str:
+        return self._quota.pick(self.projects, QUOTA_COSTS[endpoint] * calls)
+
+    def _spend(self, project: str, endpoint: str, calls: int = 1) -> None:
+        self._quota.spend(project, QUOTA_COSTS[endpoint] * calls)
+        metrics.record_units(endpoint, QUOTA_COSTS[endpoint] * calls)
+
+    def _call(self, endpoint: str, call: Callable, policy: Optional[RetryPolicy] = None):
+        """Makes a single API call, repeated on transient errors according to the endpoint retry policy."""
+        def measured_call():
+            with metrics.call(endpoint):
+                return call()
+
+        return call_with_retries(endpoint, measured_call, self._breaker, policy)
 
-        playlists = []
-        nextPageToken = None
+    def _execute(self, endpoint: str, make_request: Callable, calls: int = 1, policy: Optional[RetryPolicy] = None):
+        """Executes the request made by make_request(youtube) using the project with quota left.
 
+        Transient errors are retried with a backoff, when a project turns out
+        to be out of quota it is marked as exhausted and the request is made
+        again using the next one.
+        """
         while True:
-            request = youtube.playlists().list(
-                part="snippet,contentDetails",
-                maxResults=25,
-                mine=True,
-                pageToken=nextPageToken
-            )
+            project = self._pick_project(endpoint, calls)
+            request = make_request(self._get_authenticated_service(project))
+
+            # every attempt sent costs the quota, retries included
+            def execute():
+                self._spend(project, endpoint, calls)
+                return request.execute()
 
-            response = request.execute()
+            try:
+                return self._call(endpoint, execute, policy)
+            except HttpError as e:
+                if not is_quota_exceeded(e):
+                    raise
+
+                self._quota.mark_exhausted(project)
+                metrics.record_retry(endpoint)
+
+    def _list_pages(
+            self,
+            endpoint: str,
+            make_request: Callable,
+            cached_pages: List[dict],
+            to_data: Callable[[dict], dict]) -> Tuple[List[dict], bool]:
+        """Lists all pages of endpoint, reusing the cached pages which were not modified.
+
+        Every page is asked for conditionally with the etag it had when cached --
+        304 means that page is still valid (the call still costs a quota unit,
+        but nothing is sent or parsed) and an etag of a page does not cover the
+        pages after it, so all of them are checked.
+
+        make_request is called with the service and the page token; to_data turns
+        a response into the data kept in the page. Returns the pages and whether
+        any of them differ from cached_pages.
+        """
+        pages = []
+        pageToken = None
+
+        while True:
+            cached_page = cached_pages[len(pages)] if len(pages) < len(cached_pages) else None
 
-            for item in response['items']:
-                playlistId = item['id']
-                title = item['snippet']['title']
-                description = item['snippet']['description']
-                etag = item['etag']
+            def make_conditional_request(youtube):
+                request = make_request(youtube, pageToken)
 
-                playlist = Playlist(playlistId, title, description=description, etag=etag)
-                playlists.append(playlist)
+                if cached_page is not None and cached_page.get('pageToken') == pageToken and cached_page.get('etag'):
+                    request.headers['If-None-Match'] = cached_page['etag']
 
-            if 'nextPageToken' in response:
-                nextPageToken = response['nextPageToken']
+                return request
+
+            try:
+                response = self._execute(endpoint, make_conditional_request)
+            except HttpError as e:
+                if e.resp.status != 304:
+                    raise
+
+                page = cached_page
             else:
-                break
+                page = {
+                    'pageToken': pageToken,
+                    'etag': response.get('etag'),
+                    'nextPageToken': response.get('nextPageToken'),
+                    **to_data(response),
+                }
 
-        return GetMyPlaylistsResponse(playlists)
+            pages.append(page)
 
-    def _get_playlist_current_etag(self, playlistId: str) -> str:
-        youtube = self._get_authenticated_service()
+            if not page['nextPageToken']:
+                break  # all pages digested
 
-        playlist_request = youtube.playlists().list(
-            part="snippet",
-            maxResults=25,
-            id=playlistId,
+            pageToken = page['nextPageToken']
+
+        modified = not cached_pages or len(pages) != len(cached_pages) \
+            or any(page is not cached for page, cached in zip(pages, cached_pages))
+
+        return pages, modified
+
+    def get_my_playlists(self) -> GetMyPlaylistsResponse:
+        if self.offline:
+            from_cache = self._cache.get(MY_PLAYLISTS_CACHE_SECTION, 'mine')
+
+            if from_cache is None or 'pages' not in from_cache:
+                raise Exception('Playlists are not cached yet -- run the upload without offline mode first')
+
+            log.debug(f'using playlists cached at {from_cache.get("cached_at")}')
+            return self._playlists_from_pages(from_cache['pages'])
+
+        from_cache = self._cache.get(MY_PLAYLISTS_CACHE_SECTION, 'mine')
+        cached_pages = from_cache.get('pages', []) if isinstance(from_cache, dict) else []
+
+        pages, modified = self._list_pages(
+            'playlists.list',
+            lambda youtube, pageToken: youtube.playlists().list(
+                part="snippet,contentDetails",
+                maxResults=API_MAX_RESULTS,
+                mine=True,
+                pageToken=pageToken
+            ),
+            cached_pages,
+            lambda response: {'playlists': [
+                Playlist(item['id'], item['snippet']['title'], etag=item['etag']).to_data()
+                for item in response['items']
+            ]},
         )
 
-        playlist_response = playlist_request.execute()
-        playlist_etag = playlist_response['etag']
-        return playlist_etag
+        if not modified:
+            log.debug('playlists were not modified')
+            return self._playlists_from_pages(pages)
+
+        try:
+            self._cache.update(MY_PLAYLISTS_CACHE_SECTION, 'mine', {
+                'pages': pages,
+                'cached_at': datetime.now(),
+            })
+        except Exception as e:
+            log.warning(f'An error occurred caching playlists: {e}')
+
+        return self._playlists_from_pages(pages)
+
+    @staticmethod
+    def _playlists_from_pages(pages: List[dict]) -> GetMyPlaylistsResponse:
+        return GetMyPlaylistsResponse([Playlist.from_data(data) for page in pages for data in page['playlists']])
+
+    def _get_playlist_current_etag(self, playlistId: str) -> str:
+        result = self.get_playlist_etags([playlistId])[playlistId]
+
+        if result.error is not None:
+            raise result.error
+
+        return result.result
+
+    def get_playlist_etags(self, playlistIds: Iterable[str]) -> Dict[str, BatchItemResult]:
+        playlistIds = list(dict.fromkeys(playlistIds))
+        results = {}
+
+        for offset in range(0, len(playlistIds), API_MAX_RESULTS):
+            chunk = playlistIds[offset:offset + API_MAX_RESULTS]
+
+            try:
+                # the same parts as in get_my_playlists, so that etags match
+                response = self._execute('playlists.list', lambda youtube: youtube.playlists().list(
+                    part="snippet,contentDetails",
+                    maxResults=API_MAX_RESULTS,
+                    id=",".join(chunk),
+                ))
+            except HttpError as e:
+                results.update({playlistId: BatchItemResult(playlistId, error=e) for playlistId in chunk})
+                continue
+
+            etags = {item['id']: item['etag'] for item in response['items']}
+
+            for playlistId in chunk:
+                if playlistId in etags:
+                    results[playlistId] = BatchItemResult(playlistId, result=etags[playlistId])
+                else:
+                    results[playlistId] = BatchItemResult(
+                        playlistId, error=Exception(f'Playlist {playlistId} was not found'))
+
+        return results
 
     def get_playlist_videos(self, playlistId: str, etag: Optional[str] = None) -> PlaylistVideosResponse:
-        playlist_etag = etag or self._get_playlist_current_etag(playlistId)
+        cache_val = self._get_playlist_videos_cache_entry(playlistId, etag)
+        return PlaylistVideosResponse([Video.from_data(data) for page in cache_val['pages'] for data in page['videos']])
+
+    def get_playlist_video_index(self, playlistId: str, etag: Optional[str] = None) -> VideoIndex:
+        # descriptions are parsed once when listed, so the index is built
+        # from the cached fields without any text processing
+        return self.build_video_index(self.get_playlist_videos(playlistId, etag).videos)
+
+    def get_playlist_video_indices(self, playlists: Iterable[Playlist], concurrency: int = 8) -> Dict[str, VideoIndex]:
+        playlists = list(playlists)
+
+        # resolve missing etags in bulk instead of one call per playlist
+        missing_etags = [playlist.playlistId for playlist in playlists if not playlist.etag]
+        etags = {}
+        if missing_etags:
+            for playlistId, result in self.get_playlist_etags(missing_etags).items():
+                if result.error is not None:
+                    raise result.error
+                etags[playlistId] = result.result
+
+        log.debug(f'fetching {len(playlists)} playlists using {concurrency} threads...')
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='playlists') as executor:
+            futures = {
+                playlist.playlistId: executor.submit(
+                    self.get_playlist_video_index, playlist.playlistId, playlist.etag or etags[playlist.playlistId])
+                for playlist in playlists
+            }
 
+            return {playlistId: future.result() for playlistId, future in futures.items()}
+
+    def _get_playlist_videos_cache_entry(self, playlistId: str, etag: Optional[str] = None) -> dict:
         # check in the cache!
         cache_section = "playlists"
-        data_ver = 'v1'
+        data_ver = PLAYLIST_VIDEOS_DATA_VERSION
+
+        if self.offline:
+            from_cache = self._cache.get(cache_section, playlistId)
+
+            if from_cache is None or from_cache.get('version') != data_ver or 'pages' not in from_cache:
+                log.warning(f'content of playlist {playlistId} is not cached, assuming it is empty')
+                return {'pages': [], 'version': data_ver, 'etag': None}
+
+            if etag is not None and from_cache.get('etag') != etag:
+                log.warning(f'cached content of playlist {playlistId} may be outdated')
+
+            return from_cache
+
+        playlist_etag = etag or self._get_playlist_current_etag(playlistId)
+
         from_cache = self._cache.get(cache_section, playlistId)
 
         if (from_cache is not None
                 and 'etag' in from_cache and from_cache['etag'] == playlist_etag  # check etag
                 and 'version' in from_cache and from_cache['version'] == data_ver  # check data contract
-                and 'data' in from_cache):  # check data is there
-            return from_cache['data']
+                and 'pages' in from_cache):  # check data is there
+            return from_cache
 
         log.debug(f'cache miss for playlist content for {playlistId}, populating...')
 
-        youtube = self._get_authenticated_service()
+        cached_pages = from_cache.get('pages', []) \
+            if from_cache is not None and from_cache.get('version') == data_ver else []
 
-        videos = []
-        pageToken = None
-
-        while True:
-            request = youtube.playlistItems().list(
+        # playlist etag also changes when e.g. its title is changed, so the
+        # pages are asked for conditionally instead of listed all over again
+        pages, modified = self._list_pages(
+            'playlistItems.list',
+            lambda youtube, pageToken: youtube.playlistItems().list(
                 part="snippet,contentDetails",
-                maxResults=50,
+                maxResults=API_MAX_RESULTS,
                 pageToken=pageToken,
                 playlistId=playlistId
-            )
-
-            response = request.execute()
-
-            for item in response['items']:
-                videoId = item['id']
-                title = item['snippet']['title']
-                description = item['snippet']['description']
-
-                videos.append(Video(videoId, title, description))
-
-            if 'nextPageToken' not in response:
-                break  # all pages digested
+            ),
+            cached_pages,
+            lambda response: {'videos': [
+                self.parse_video(item['id'], item['snippet']['title'], item['snippet']['description']).to_data()
+                for item in response['items']
+            ]},
+        )
 
-            pageToken = response['nextPageToken']
+        if not modified:
+            log.debug(f'playlist content for {playlistId} was not modified')
 
-        result = PlaylistVideosResponse(videos)
+        cache_val = {'pages': pages,
+                     'version': data_ver,
+                     'etag': playlist_etag}
 
         # cache in the cache
         try:
-            cache_val = {'data': result,
-                         'version': data_ver,
-                         'etag': playlist_etag}
-
             self._cache.update(cache_section, playlistId, cache_val)
         except Exception as e:
             log.warning(f'An error occurred caching playlist listing results: {e}')
 
-        return result
+        return cache_val
 
     def is_video(self, path) -> bool:
         for ext in SUPPORTED_VIDEO_EXTENSIONS:
@@ -196,72 +590,155 @@ class YouTubeClientImpl(YouTubeClient):
 
         return False
 
+    def parse_video(self, videoId: str, title: str, description: Optional[str]) -> Video:
+        description = description or ''
+
+        def find(pattern: re.Pattern) -> Optional[str]:
+            match = pattern.search(description)
+            return match.group(1) if match else None
+
+        return Video(
+            videoId,
+            title,
+            md5=find(MD5_DESCRIPTION_PATTERN),
+            size=find(SIZE_DESCRIPTION_PATTERN),
+            fileName=find(FILE_NAME_DESCRIPTION_PATTERN),
+            modifiedAt=find(MODIFIED_AT_DESCRIPTION_PATTERN))
+
     def is_matching_video(self, local_hash: str, video: Video) -> bool:
-        return local_hash in video.description
+        return video.md5 == local_hash
+
+    def build_video_index(self, videos: Iterable[Video]) -> VideoIndex:
+        index = VideoIndex()
+
+        for video in videos:
+            if video.md5:
+                index.by_md5[video.md5] = video
+                index.by_size.setdefault(video.size or UNKNOWN_SIZE, []).append(video)
+
+            if video.fileName and video.size and video.modifiedAt:
+                index.by_metadata[self._metadata_key(video.fileName, video.size, video.modifiedAt)] = video
+
+        return index
+
+    @staticmethod
+    def _format_size(size: int) -> str:
+        return f'{(size/(1024*1024)):.2f} MiB'
+
+    @staticmethod
+    def _format_timestamp(timestamp: float) -> str:
+        return f'{datetime.fromtimestamp(timestamp):%Y-%m-%dT%H:%M:%S}'
+
+    @staticmethod
+    def _metadata_key(file_name: str, size: str, modified_at: str) -> str:
+        return f'{file_name}|{size}|{modified_at}'
+
+    def file_metadata_key(self, path: str) -> str:
+        stat = os.stat(path)
+        return self._metadata_key(
+            os.path.basename(path), self._format_size(stat.st_size), self._format_timestamp(stat.st_mtime))
+
+    def file_size_key(self, path: str) -> str:
+        return self._format_size(os.path.getsize(path))
 
     def file_hash(self, path) -> str:
         return self._hasher.md5(path)
 
-    def _generate_metadata(self, path: str) -> str:
+    def file_partial_hash(self, path: str) -> str:
+        return self._hasher.partial_hash(path)
+
+    def file_hashes(self, paths: Iterable[str]) -> Dict[str, str]:
+        return self._hasher.md5_many(paths)
+
+    def file_hashes_ahead(
+            self,
+            paths: Iterable[str],
+            should_hash: Optional[Callable[[str], bool]] = None,
+    ) -> Iterator[Tuple[str, Optional[str]]]:
+        return self._hasher.md5_ahead(paths, should_hash)
+
+    def cached_file_hash(self, path: str) -> Optional[str]:
+        return self._hasher.cached_md5(path)
+
+    def _generate_metadata(self, path: str, hash: Optional[str] = None) -> str:
         dir, fileName = os.path.split(path)
-        hash = self.file_hash(path)
-        createdAt = datetime.fromtimestamp(os.path.getctime(path))
-        modifiedAt = datetime.fromtimestamp(os.path.getmtime(path))
-        size = os.path.getsize(path)
+        hash = hash or self.file_hash(path)
+        stat = os.stat(path)
 
         description = f'File name: {fileName}\n'
         description += f'Dir: {dir}\n'
-        description += f'Created at: {createdAt:%Y-%m-%dT%H:%M:%S}\n'
-        description += f'Modified at: {modifiedAt:%Y-%m-%dT%H:%M:%S}\n'
-        description += f'Size: {(size/(1024*1024)):.2f} MiB\n'
+        description += f'Created at: {self._format_timestamp(stat.st_ctime)}\n'
+        description += f'Modified at: {self._format_timestamp(stat.st_mtime)}\n'
+        description += f'Size: {self._format_size(stat.st_size)}\n'
         description += f'MD5: {hash}\n'
         description += f'[auto uploaded]'
 
         return description
 
-    def _resumable_upload(self, insert_request) -> str:
-        response = None
-        error = None
-        retry = 0
-        max_retries = 10
+    def _resumable_upload(self, insert_request, on_progress: Optional[Callable[[], None]] = None) -> str:
+        while True:
+            # after a failed chunk the request asks the server how much it
+            # has got before sending the rest
+            status, response = self._call('videos.insert', insert_request.next_chunk)
 
-        while response is None:
-            try:
-                status, response = insert_request.next_chunk()
-                if response is not None:
-                    if 'id' not in response:
-                        raise Exception("The upload failed with an unexpected response: %s" % response)
+            if response is not None:
+                if 'id' not in response:
+                    raise Exception("The upload failed with an unexpected response: %s" % response)
 
-                    return response['id']
-            except HttpError as e:
-                if e.resp.status in [500, 502, 503, 504]:
-                    error = "A retriable HTTP error %d occurred:\n%s" % (e.resp.status, e.content)
-                else:
-                    raise
-            except (httplib2.HttpLib2Error, IOError, http.client.NotConnected,
-                    http.client.IncompleteRead, http.client.ImproperConnectionState,
-                    http.client.CannotSendRequest, http.client.CannotSendHeader,
-                    http.client.ResponseNotReady, http.client.BadStatusLine) as e:
-                error = "A retriable error occurred: %s" % e
-
-            if error is not None:
-                log.warning(error)
-                retry += 1
-                if retry > max_retries:
-                    raise Exception("No longer attempting to retry.")
-
-                max_sleep = 2 ** retry
-                sleep_seconds = random.random() * max_sleep
-                log.warning("Sleeping %f seconds and then retrying..." % sleep_seconds)
-                time.sleep(sleep_seconds)
+                return response['id']
+
+            if status is not None:
+                log.debug(f'  uploaded {status.progress() * 100:.1f}%')
+
+            if on_progress:
+                on_progress()
+
+    def _get_upload_session(self, path: str, stat: os.stat_result) -> Optional[dict]:
+        session = self._cache.get(UPLOAD_SESSIONS_CACHE_SECTION, path)
+
+        if session is None:
+            return None
+
+        # file was changed since the upload was started
+        if session.get('size') != stat.st_size or session.get('mtime_ns') != stat.st_mtime_ns:
+            log.debug(f'discarding upload session for changed file {path}')
+            self._cache.update(UPLOAD_SESSIONS_CACHE_SECTION, path, None)
+            return None
+
+        return session
+
+    def _save_upload_session(
+            self, path: str, stat: os.stat_result, insert_request, project: str, pending_md5: bool = False) -> None:
+        if insert_request.resumable_uri is None:
+            return
+
+        self._cache.update(UPLOAD_SESSIONS_CACHE_SECTION, path, {
+            'project': project,
+            'pending_md5': pending_md5,
+            'uri': insert_request.resumable_uri,
+            'progress': insert_request.resumable_progress,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'updated_at': datetime.now(),
+        })
 
     def upload_video(self, path: str, title: str, description: str = '', privacyLevel: str = 'unlisted') -> UploadVideoResponse:
-        description += self._generate_metadata(path)
+        stat = os.stat(path)
+        session = self._get_upload_session(path, stat)
+        known_md5 = self.cached_file_hash(path)
+
+        # a session started with the MD5 placeholder already has it in the
+        # description on the server, whatever is known about the file now
+        pending_md5 = bool(session is not None and session.get('pending_md5')) \
+            or (self._hash_while_upload and known_md5 is None)
+        hash_while_upload = pending_md5 and known_md5 is None
+
+        metadata = self._generate_metadata(path, PENDING_MD5 if pending_md5 else None)
 
         body = dict(
             snippet=dict(
                 title=title,
-                description=description,
+                description=description + metadata,
                 tags=[],
                 categoryId=22
             ),
@@ -270,35 +747,293 @@ class YouTubeClientImpl(YouTubeClient):
             )
         )
 
-        youtube = self._get_authenticated_service()
+        while True:
+            # upload session can only be continued by the project which
+            # started it, sessions saved before projects rotation was
+            # introduced were started by the only project there was
+            if session is not None and session.get('project', self.projects[0]) not in self.projects:
+                log.debug(f'discarding upload session started by unknown project {session.get("project")}')
+                session = None
+                self._cache.update(UPLOAD_SESSIONS_CACHE_SECTION, path, None)
+
+            if session is not None:
+                project = session.get('project', self.projects[0])
+            else:
+                project = self._pick_project('videos.insert')
 
-        insert_request = youtube.videos().insert(
-            part=",".join(list(body.keys())),
-            body=body,
-            media_body=MediaFileUpload(path, chunksize=-1, resumable=True)
-        )
+            youtube = self._get_authenticated_service(project)
+
+            if hash_while_upload:
+                # the file is hashed while it's read for sending, throttled the same way
+                media = HashingMediaFileUpload(
+                    path, chunksize=self._upload_chunk_size, limiter=self._bandwidth_limiter)
+            elif self._bandwidth_limiter is not None:
+                media = ThrottledMediaFileUpload(path, chunksize=self._upload_chunk_size, limiter=self._bandwidth_limiter)
+            else:
+                media = MediaFileUpload(path, chunksize=self._upload_chunk_size, resumable=True)
+
+            insert_request = youtube.videos().insert(
+                part=",".join(list(body.keys())),
+                body=body,
+                media_body=media
+            )
+
+            if session is not None:
+                # the server is asked for the amount of bytes it already has
+                # before sending anything else
+                log.info(f'  resuming previously started upload ({session["progress"] / (1024 * 1024):.2f} MiB confirmed)')
+                resume_upload_request(insert_request, session['uri'], session['progress'])
+            else:
+                self._spend(project, 'videos.insert')
+
+            try:
+                videoId = self._resumable_upload(
+                    insert_request,
+                    on_progress=lambda: self._save_upload_session(path, stat, insert_request, project, pending_md5))
+                break
+            except HttpError as e:
+                if is_quota_exceeded(e):
+                    self._quota.mark_exhausted(project)
+                    metrics.record_retry('videos.insert')
+                    log.warning(f'  project {project} is out of quota, starting over using another project...')
+                    session = None
+                    self._cache.update(UPLOAD_SESSIONS_CACHE_SECTION, path, None)
+                    continue
+
+                if session is None or e.resp.status not in [404, 410]:
+                    raise
 
-        videoId = self._resumable_upload(insert_request)
+                # upload sessions expire after about a week
+                log.warning(f'  upload session expired ({e.resp.status}), starting over...')
+                session = None
+                self._cache.update(UPLOAD_SESSIONS_CACHE_SECTION, path, None)
+
+        self._cache.update(UPLOAD_SESSIONS_CACHE_SECTION, path, None)
+
+        if hash_while_upload:
+            known_md5 = media.md5()
+            log.debug(f'  hashed {path} while uploading: {known_md5}')
+
+            try:
+                self._hasher.remember(path, known_md5, stat)
+            except Exception as e:
+                log.warning(f'unable to save hashing result into the cache: {e}')
+
+        if pending_md5:
+            self._complete_description(videoId, description + self._generate_metadata(path, known_md5))
 
         return UploadVideoResponse(videoId)
 
+    def _persist(self) -> None:
+        """Saves the cache right away, for the entries an interrupted run must not lose."""
+        try:
+            self._cache.flush()
+        except Exception as e:
+            log.warning(f'unable to save the cache: {e}')
+
+    def _set_pending_description(self, videoId: str, newDescription: Optional[str]) -> None:
+        self._cache.update(PENDING_DESCRIPTIONS_CACHE_SECTION, videoId, newDescription)
+
+        # saved right away -- a video left with the MD5 placeholder is
+        # not found as uploaded by its hash, so it'd be uploaded again
+        if newDescription is not None:
+            self._persist()
+
+    def _complete_description(self, videoId: str, newDescription: str) -> None:
+        # remembered first, so that it's retried by the next run if it fails
+        self._set_pending_description(videoId, newDescription)
+
+        try:
+            self.update_video(videoId, newTitle=None, newDescription=newDescription)
+        except Exception as e:
+            log.error(f'  unable to update the description of {videoId} with MD5, will retry on the next run: {e}')
+            return
+
+        self._set_pending_description(videoId, None)
+
+    def complete_pending_descriptions(self) -> None:
+        """Retries description updates which failed right after the upload."""
+        pending = self._cache.entries(PENDING_DESCRIPTIONS_CACHE_SECTION)
+
+        for videoId, newDescription in pending.items():
+            log.info(f'completing the description of previously uploaded video {videoId}...')
+            self._complete_description(videoId, newDescription)
+
+    def update_video(self, videoId: str, newTitle: Optional[str], newDescription: Optional[str]) -> None:
+        # snippet is replaced as a whole, so the current one is used as a base
+        response = self._execute('videos.list', lambda youtube: youtube.videos().list(part="snippet", id=videoId))
+
+        if not response['items']:
+            raise Exception(f'Video {videoId} was not found')
+
+        snippet = response['items'][0]['snippet']
+
+        if newTitle is not None:
+            snippet['title'] = newTitle
+
+        if newDescription is not None:
+            snippet['description'] = newDescription
+
+        self._execute('videos.update', lambda youtube: youtube.videos().update(
+            part="snippet",
+            body={'id': videoId, 'snippet': snippet}
+        ))
+
     def add_video_to_playlist(self, playlistId: str, videoId: str):
-        body = {
-            "snippet": {
-                "playlistId": playlistId,
-                "resourceId": {
-                    "kind": "youtube#video",
-                    "videoId": videoId
-                }
-            }
-        }
+        result = self.add_videos_to_playlist(playlistId, [videoId])[videoId]
+        if result.error is not None:
+            raise result.error
 
-        youtube = self._get_authenticated_service()
+    def queue_playlist_add(self, playlistId: str, videoId: str) -> int:
+        """Remembers that the video has to be added to the playlist, returns amount of videos queued for it.
 
-        request = youtube.playlistItems().insert(
-            part=",".join(list(body.keys())),
-            body=body
-        )
+        The queue is saved right away -- a video uploaded but never added to
+        the playlist would not be found among the uploaded ones and would be
+        uploaded again by the next run.
+        """
+        with self._pending_playlist_adds_lock:
+            self._cache.update(PENDING_PLAYLIST_ADDS_CACHE_SECTION, f'{playlistId}/{videoId}', {
+                'playlistId': playlistId,
+                'videoId': videoId,
+                'queued_at': time.time(),
+            })
+            self._persist()
+
+            self._unsent_playlist_adds.add((playlistId, videoId))
+
+        return len(self.queued_playlist_adds().get(playlistId, []))
+
+    def queued_playlist_adds(self) -> Dict[str, List[str]]:
+        entries = sorted(self._cache.entries(PENDING_PLAYLIST_ADDS_CACHE_SECTION).values(),
+                         key=lambda entry: entry['queued_at'])
+
+        result = {}
+        for entry in entries:
+            result.setdefault(entry['playlistId'], []).append(entry['videoId'])
+
+        return result
+
+    def add_queued_videos_to_playlist(self, playlistId: str) -> Dict[str, BatchItemResult]:
+        """Adds the videos queued for the playlist, the ones which fail stay queued for the next attempt."""
+        # one batch at a time, so that a video is never sent twice
+        with self._playlist_adds_lock:
+            videoIds = self.queued_playlist_adds().get(playlistId, [])
+            if not videoIds:
+                return {}
+
+            log.info(f'adding {len(videoIds)} videos to the playlist {playlistId}...')
+
+            # videos queued by a previous run (or another process sharing the
+            # cache) or failed to be added before may have been added after all
+            with self._pending_playlist_adds_lock:
+                maybe_added = [videoId for videoId in videoIds if (playlistId, videoId) not in self._unsent_playlist_adds]
+                self._unsent_playlist_adds.difference_update((playlistId, videoId) for videoId in videoIds)
+
+            results = {}
+            self._not_in_playlist(playlistId, maybe_added, results)
+            results.update(self.add_videos_to_playlist(
+                playlistId, [videoId for videoId in videoIds if videoId not in results]))
+
+            # videos queued in the meantime have entries of their own
+            with self._pending_playlist_adds_lock:
+                for videoId, result in results.items():
+                    if result.error is None:
+                        self._cache.update(PENDING_PLAYLIST_ADDS_CACHE_SECTION, f'{playlistId}/{videoId}', None)
+
+        return results
+
+    def add_videos_to_playlist(self, playlistId: str, videoIds: Iterable[str]) -> Dict[str, BatchItemResult]:
+        pending = list(videoIds)
+        results = {}
+        policy = RETRY_POLICIES['playlistItems.insert']
+
+        # inserts are not idempotent -- a batch or an item which failed may
+        # still have been handled by the server, so before sending videos
+        # again the playlist is checked for them
+        for attempt in range(policy.max_retries + 1):
+            if attempt > 0:
+                delay = policy.delay(attempt)
+                log.warning(f'{len(pending)} videos failed to be added to the playlist, '
+                            f'retrying in {delay:.1f} sec ({attempt}/{policy.max_retries})...')
+                metrics.record_retry('playlistItems.insert')
+                time.sleep(delay)
+
+                pending = self._not_in_playlist(playlistId, pending, results)
+                if not pending:
+                    break
+
+            for videoId in pending:
+                results.pop(videoId, None)
+
+            self._add_videos_to_playlist(playlistId, pending, results)
+
+            pending = [videoId for videoId in pending
+                       if results[videoId].error is not None and is_retriable(results[videoId].error, policy)]
+            if not pending:
+                break
 
-        request.execute()
+        return results
+
+    def _not_in_playlist(self, playlistId: str, videoIds: List[str], results: Dict[str, BatchItemResult]) -> List[str]:
+        """Returns the videos which are not in the playlist, the ones which are get a successful result."""
+        missing = []
+
+        for videoId in videoIds:
+            try:
+                response = self._execute('playlistItems.list', lambda youtube: youtube.playlistItems().list(
+                    part="id",
+                    playlistId=playlistId,
+                    videoId=videoId,
+                    maxResults=1
+                ))
+            except (HttpError, httplib2.HttpLib2Error, IOError) as e:
+                # can't tell, the video is left for the next attempt rather than added twice
+                log.warning(f'  unable to check whether {videoId} is in the playlist {playlistId}: {e}')
+                results[videoId] = BatchItemResult(videoId, error=e)
+                continue
+
+            if response.get('items'):
+                log.debug(f'  {videoId} is in the playlist {playlistId} already')
+                results[videoId] = BatchItemResult(videoId, result=response['items'][0])
+            else:
+                missing.append(videoId)
+
+        return missing
+
+    def _add_videos_to_playlist(self, playlistId: str, videoIds: List[str], results: Dict[str, BatchItemResult]) -> None:
+        """Adds the videos in batches, each batch is sent once."""
+        for offset in range(0, len(videoIds), API_MAX_RESULTS):
+            chunk = videoIds[offset:offset + API_MAX_RESULTS]
+
+            def callback(request_id, response, exception):
+                videoId = chunk[int(request_id)]
+                results[videoId] = BatchItemResult(videoId, result=response, error=exception)
+
+            def make_batch(youtube):
+                batch = youtube.new_batch_http_request(callback=callback)
+
+                for idx, videoId in enumerate(chunk):
+                    body = {
+                        "snippet": {
+                            "playlistId": playlistId,
+                            "resourceId": {
+                                "kind": "youtube#video",
+                                "videoId": videoId
+                            }
+                        }
+                    }
+
+                    batch.add(youtube.playlistItems().insert(
+                        part=",".join(list(body.keys())),
+                        body=body
+                    ), request_id=str(idx))
+
+                return batch
+
+            try:
+                self._execute('playlistItems.insert', make_batch, calls=len(chunk), policy=SINGLE_ATTEMPT)
+            except (HttpError, httplib2.HttpLib2Error, IOError) as e:
+                # the whole batch failed, mark all its items not yet reported
+                for videoId in chunk:
+                    results.setdefault(videoId, BatchItemResult(videoId, error=e))
 
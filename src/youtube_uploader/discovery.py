@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import logging
+import os
+import timeit
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from youtube_uploader.cache import YoutubeCacheBase
+from youtube_uploader.model import LocalFile
+
+log = logging.getLogger(__name__)
+
+DIR_INDEX_CACHE_SECTION = 'dir-index-v1'
+
+
+class DirectoryScanner(object):
+    """Discovers files using a single stat per file.
+
+    When a cache is given, listing of every directory is stored in it along
+    with the directory mtime -- directories which mtime did not change since
+    the previous run are not listed again. Note that changing a file in place
+    does not change the mtime of its directory, so sizes and modification
+    times of such files in the index may be outdated.
+    """
+
+    def __init__(self, is_wanted: Callable[[str], bool], cache: Optional[YoutubeCacheBase] = None):
+        self.is_wanted = is_wanted
+        self.cache = cache
+
+        self.dirs_scanned = 0
+        self.dirs_reused = 0
+
+    def _scan_dir(self, dir: str, dir_mtime_ns: int) -> dict:
+        files = []
+        subdirs = []
+
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_file() and self.is_wanted(entry.name):
+                        stat = entry.stat()
+                        files.append([entry.name, stat.st_size, stat.st_ctime, stat.st_mtime])
+                except OSError as e:
+                    log.warning(f'unable to stat {entry.path}: {e}')
+
+        self.dirs_scanned += 1
+
+        return {'mtime_ns': dir_mtime_ns, 'files': files, 'dirs': subdirs}
+
+    def _list_dir(self, dir: str) -> dict:
+        dir_mtime_ns = os.stat(dir).st_mtime_ns
+
+        if self.cache is not None:
+            cached = self.cache.get(DIR_INDEX_CACHE_SECTION, dir)
+            if cached is not None and cached.get('mtime_ns') == dir_mtime_ns:
+                self.dirs_reused += 1
+                return cached
+
+        listing = self._scan_dir(dir, dir_mtime_ns)
+
+        if self.cache is not None:
+            self.cache.update(DIR_INDEX_CACHE_SECTION, dir, listing)
+
+        return listing
+
+    def iter_files(self, root: str) -> Iterator[LocalFile]:
+        """Yields files as directories get listed."""
+        started_at = timeit.default_timer()
+        count = 0
+        pending = [root]
+
+        self.dirs_scanned = 0
+        self.dirs_reused = 0
+
+        while pending:
+            dir = pending.pop()
+            log.debug(f'  walking in {dir}...')
+
+            try:
+                listing = self._list_dir(dir)
+            except OSError as e:
+                log.warning(f'unable to list {dir}: {e}')
+                continue
+
+            pending.extend(os.path.join(dir, name) for name in reversed(listing['dirs']))
+
+            for name, size, created_at, modified_at in listing['files']:
+                count += 1
+                yield LocalFile(os.path.join(dir, name), size, created_at, modified_at)
+
+        log.info(f'Discovered {count} files in {root} in {timeit.default_timer() - started_at:.2f} sec '
+                 f'({self.dirs_scanned} directories listed, {self.dirs_reused} taken from the index)')
+
+    def scan(self, root: str) -> List[LocalFile]:
+        return list(self.iter_files(root))
+
+
+def stat_files(paths: Iterable[str]) -> Iterator[LocalFile]:
+    """Takes the stat of files found by other means than the scanner (e.g. reported by the watcher)."""
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            log.warning(f'unable to stat {path}: {e}')
+            continue
+
+        yield LocalFile(path, stat.st_size, stat.st_ctime, stat.st_mtime)
+
+
+def filter_by_cut_off(
+        files: Iterable[LocalFile],
+        creation_cut_off: Optional[datetime],
+        modification_cut_off: Optional[datetime] = None,
+) -> Iterator[LocalFile]:
+    """Drops the files created or modified before the cut-off dates."""
+    creation_cut_off_ts = creation_cut_off.timestamp() if creation_cut_off else None
+    modification_cut_off_ts = modification_cut_off.timestamp() if modification_cut_off else None
+
+    for file in files:
+        if creation_cut_off_ts is not None and file.created_at < creation_cut_off_ts:
+            continue
+        if modification_cut_off_ts is not None and file.modified_at < modification_cut_off_ts:
+            continue
+        yield file
+
+
+def ordered_by_modification_time(files: Iterable[LocalFile], look_ahead: Optional[int] = None) -> Iterator[LocalFile]:
+    """Orders files by modification time.
+
+    Without look-ahead all the files are collected and sorted first. With
+    look-ahead only that many files are kept in memory and the oldest of
+    them is yielded every time a new one comes in -- files come out as soon
+    as they are discovered, ordered within the look-ahead window.
+    """
+    if look_ahead is None:
+        yield from sorted(files, key=lambda file: file.modified_at)
+        return
+
+    heap = []
+    counter = itertools.count()  # tie breaker, files themselves are not comparable
+
+    for file in files:
+        heapq.heappush(heap, (file.modified_at, next(counter), file))
+        if len(heap) > look_ahead:
+            yield heapq.heappop(heap)[2]
+
+    while heap:
+        yield heapq.heappop(heap)[2]
@@ -1,57 +1,504 @@
 import hashlib
+import json
 import logging
+import os
+import threading
+import timeit
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import portalocker
 
 from youtube_uploader.cache import YoutubeCacheBase
+from youtube_uploader.metrics import registry as metrics
 
 log = logging.getLogger(__name__)
 
+# partial hash covers that many bytes at the start and at the end of the file
+PARTIAL_HASH_SPAN = 4 * 1024 * 1024
+
+# smallest buffer files are read into while hashing
+MIN_HASH_BLOCK_SIZE = 64 * 1024
+
+
+class HashClaims(object):
+    """Lets the processes sharing a cache hash every file only once.
+
+    Hashes written by other processes show up in the cache only after they
+    flush it, so right before hashing a file a process takes an exclusive
+    lock on a claim file named after the path. Another process about to
+    hash the same file waits for the lock and then takes the hash the first
+    one left in the claim file instead of reading the file once more. Locks
+    are released by the OS when a process dies, so a killed worker never
+    blocks the others.
+
+    Claims stay until release() is called once their hashes are flushed to
+    the shared cache -- from then on the other processes find the hashes in
+    the cache. Claims left by a killed process are removed by the process
+    which takes a hash from them.
+    """
+
+    def __init__(self, dir: str):
+        self.dir = dir
+        os.makedirs(dir, exist_ok=True)
+
+        # claim files written or read by this process
+        self._taken: Set[str] = set()
+        self._taken_lock = threading.Lock()
+
+    def hash_once(self, path: str, fingerprint: dict, calculate: Callable[[], str]) -> str:
+        claim_path = os.path.join(self.dir, hashlib.md5(path.encode('utf-8')).hexdigest())
+
+        with open(claim_path, 'a+') as file:
+            # blocks while another process is hashing the file
+            started_at = timeit.default_timer()
+            portalocker.lock(file, portalocker.LockFlags.EXCLUSIVE)
+            try:
+                file.seek(0)
+                try:
+                    claim = json.loads(file.read() or 'null')
+                except ValueError:
+                    claim = None
+
+                if isinstance(claim, dict) and claim.get('path') == path \
+                        and all(claim.get(key) == expected for key, expected in fingerprint.items()):
+                    log.debug(f'{path} was hashed by another process')
+                    metrics.record_timing('hasher.claimed', timeit.default_timer() - started_at)
+                    md5 = claim['md5']
+                else:
+                    md5 = calculate()
+
+                    file.seek(0)
+                    file.truncate()
+                    json.dump({'path': path, 'md5': md5, **fingerprint}, file)
+                    file.flush()
+            finally:
+                portalocker.unlock(file)
+
+        with self._taken_lock:
+            self._taken.add(claim_path)
+
+        return md5
+
+    def release(self) -> None:
+        """Removes the claims taken so far, call it only after their hashes are flushed to the cache."""
+        with self._taken_lock:
+            taken, self._taken = self._taken, set()
+
+        for claim_path in taken:
+            try:
+                os.remove(claim_path)
+            except OSError as e:
+                # e.g. removed by another process which took the same claim
+                log.debug(f'unable to remove claim {claim_path}: {e}')
+
 
 class YouTubeHasher(object):
-    def __init__(self, cache: YoutubeCacheBase):
+    def __init__(
+            self,
+            cache: YoutubeCacheBase,
+            workers: int = 4,
+            block_size: int = 8 * 1024 * 1024,
+            claims: Optional[HashClaims] = None):
         self.cache = cache
         self.section = 'file-hashes-v1'
+        self.partial_section = 'file-partial-hashes-v1'
+        self.workers = max(1, workers)
+        self.block_size = max(MIN_HASH_BLOCK_SIZE, block_size)
+
+        # set when the cache is shared with other processes
+        self.claims = claims
 
-    def _save_to_cache(self, path: str, md5: str) -> None:
+        # per worker thread name: [bytes hashed, seconds spent]
+        self._worker_stats: Dict[str, list] = {}
+        self._worker_stats_lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(stat: os.stat_result) -> dict:
+        return {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'inode': stat.st_ino,
+            'device': stat.st_dev,
+        }
+
+    def _save_to_cache(self, path: str, md5: str, stat: os.stat_result) -> None:
         val = {
             'md5': md5,
-            'calculated_at': datetime.now()
+            'calculated_at': datetime.now(),
+            **self._fingerprint(stat),
         }
         self.cache.update(self.section, path, val)
 
-    def _get_from_cache(self, path: str) -> Optional[str]:
+    def _get_from_cache(self, path: str, stat: os.stat_result) -> Optional[str]:
         val = self.cache.get(self.section, path)
 
         if val is None or 'md5' not in val:
             return None
 
+        fingerprint = self._fingerprint(stat)
+
+        if 'size' not in val:
+            # entry written before fingerprints were introduced -- trust it
+            # only when the file was not modified after the hash was calculated
+            # and backfill the fingerprint so that it is validated from now on
+            calculated_at = val.get('calculated_at')
+            if calculated_at is None or stat.st_mtime >= calculated_at.timestamp():
+                log.debug(f'Legacy cached hash for {path} is outdated')
+                return None
+            self.cache.update(self.section, path, {**val, **fingerprint})
+            return val['md5']
+
+        for key, expected in fingerprint.items():
+            if val.get(key) != expected:
+                log.debug(f'Cached hash for {path} is outdated ({key} changed)')
+                return None
+
         return val['md5']
 
     def _caclculate_md5(self, path: str) -> str:
-        BLOCKSIZE = 65536
+        started_at = timeit.default_timer()
+        total = 0
         hasher = hashlib.md5()
-        with open(path, 'rb') as afile:
-            buf = afile.read(BLOCKSIZE)
-            while len(buf) > 0:
-                hasher.update(buf)
-                buf = afile.read(BLOCKSIZE)
+
+        with open(path, 'rb', buffering=0) as afile:
+            # read into a single preallocated buffer -- hashlib releases the GIL
+            # while hashing large buffers, so several workers can run in parallel;
+            # small files get a small buffer instead of a zero-filled block
+            size = os.fstat(afile.fileno()).st_size
+            buf = bytearray(min(self.block_size, max(size, MIN_HASH_BLOCK_SIZE)))
+            view = memoryview(buf)
+
+            while True:
+                n = afile.readinto(buf)
+                if not n:
+                    break
+                hasher.update(view[:n])
+                total += n
+
+        elapsed = timeit.default_timer() - started_at
+        self._record_worker_stats(total, elapsed)
+        metrics.record_timing('hasher.md5', elapsed, total)
+
         return hasher.hexdigest()
 
+    def _hash(self, path: str, stat: os.stat_result) -> str:
+        """Calculates the hash unless another process sharing the cache has done it already."""
+        if self.claims is None:
+            return self._caclculate_md5(path)
+
+        return self.claims.hash_once(path, self._fingerprint(stat), lambda: self._caclculate_md5(path))
+
+    def release_claims(self) -> None:
+        """Removes the claims of the hashes flushed to the shared cache."""
+        if self.claims is not None:
+            self.claims.release()
+
+    def _record_worker_stats(self, size: int, elapsed: float) -> None:
+        name = threading.current_thread().name
+        with self._worker_stats_lock:
+            stats = self._worker_stats.setdefault(name, [0, 0.0])
+            stats[0] += size
+            stats[1] += elapsed
+
+    def _log_worker_stats(self) -> None:
+        with self._worker_stats_lock:
+            for name, (size, elapsed) in sorted(self._worker_stats.items()):
+                rate = size / (1024 * 1024) / elapsed if elapsed > 0 else 0.0
+                log.info(f'  {name}: hashed {size / (1024 * 1024):.2f} MiB in {elapsed:.2f} sec ({rate:.2f} MB/s)')
+            self._worker_stats.clear()
+
+    def _calculate_partial_hash(self, path: str, size: int) -> Tuple[str, Optional[str]]:
+        """Hashes the size along with the head and the tail of the file.
+
+        Files not larger than the head and the tail together are read
+        completely, so their full MD5 is returned as well.
+        """
+        started_at = timeit.default_timer()
+
+        with open(path, 'rb') as afile:
+            if size <= 2 * PARTIAL_HASH_SPAN:
+                md5 = hashlib.md5(afile.read()).hexdigest()
+                partial = md5
+            else:
+                hasher = hashlib.md5(f'{size}:'.encode())
+                hasher.update(afile.read(PARTIAL_HASH_SPAN))
+                afile.seek(-PARTIAL_HASH_SPAN, os.SEEK_END)
+                hasher.update(afile.read(PARTIAL_HASH_SPAN))
+                md5 = None
+                partial = hasher.hexdigest()
+
+        metrics.record_timing('hasher.partial', timeit.default_timer() - started_at, min(size, 2 * PARTIAL_HASH_SPAN))
+
+        return partial, md5
+
+    def partial_hash(self, path: str) -> str:
+        """Cheap fingerprint telling apart most of the files of the same size."""
+        stat = os.stat(path)
+        fingerprint = self._fingerprint(stat)
+
+        val = self.cache.get(self.partial_section, path)
+        if val is not None and val.get('span') == PARTIAL_HASH_SPAN \
+                and all(val.get(key) == expected for key, expected in fingerprint.items()):
+            return val['partial']
+
+        log.debug(f'Calculating {path} partial hash...')
+        partial, md5 = self._calculate_partial_hash(path, stat.st_size)
+
+        try:
+            self.cache.update(self.partial_section, path, {
+                'partial': partial,
+                'span': PARTIAL_HASH_SPAN,
+                **fingerprint,
+            })
+            if md5 is not None:
+                self._save_to_cache(path, md5, stat)
+        except Exception as e:
+            log.warning(f'unable to save hashing result into the cache: {e}')
+
+        return partial
+
+    def cached_md5(self, path: str) -> Optional[str]:
+        """Returns the hash only when it's known without reading the file."""
+        return self._get_from_cache(path, os.stat(path))
+
+    def remember(self, path: str, md5: str, stat: os.stat_result) -> None:
+        """Saves the hash calculated elsewhere (e.g. during the upload) for the file with given stat."""
+        self._save_to_cache(path, md5, stat)
+
     def md5(self, path) -> str:
-        from_cache = self._get_from_cache(path)
+        stat = os.stat(path)
+        from_cache = self._get_from_cache(path, stat)
 
         if from_cache:
             log.debug(f'Found {path} hash in the cache')
             return from_cache
 
         log.info(f'Calculating {path} hash...')
-        md5 = self._caclculate_md5(path)
+        md5 = self._hash(path, stat)
 
         try:
-            self._save_to_cache(path, md5)
+            self._save_to_cache(path, md5, stat)
         except Exception as e:
             log.warning(f'unable to save hashing result into the cache: {e}')
 
         return md5
 
+    def md5_many(self, paths: Iterable[str]) -> Dict[str, str]:
+        """Hashes given files using a bounded pool of worker threads.
+
+        Files which hash can not be calculated (e.g. removed in the meantime)
+        are logged and omitted from the result.
+        """
+        result = {}
+        pending = []
+
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                log.warning(f'unable to calculate hash for {path}: {e}')
+                continue
+
+            from_cache = self._get_from_cache(path, stat)
+            if from_cache:
+                result[path] = from_cache
+            else:
+                pending.append((path, stat))
+
+        if not pending:
+            return result
+
+        log.info(f'Calculating hashes for {len(pending)} files using {self.workers} workers...')
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hasher') as executor:
+            futures = {executor.submit(self._hash, path, stat): (path, stat) for path, stat in pending}
+
+            # cache is only touched from the calling thread
+            for future in as_completed(futures):
+                path, stat = futures[future]
+                try:
+                    md5 = future.result()
+                except OSError as e:
+                    log.warning(f'unable to calculate hash for {path}: {e}')
+                    continue
+
+                log.debug(f'  calculated {path} hash')
+                result[path] = md5
+
+                try:
+                    self._save_to_cache(path, md5, stat)
+                except Exception as e:
+                    log.warning(f'unable to save hashing result into the cache: {e}')
+
+        self._log_worker_stats()
+
+        return result
+
+    def md5_ahead(
+            self,
+            paths: Iterable[str],
+            should_hash: Optional[Callable[[str], bool]] = None,
+            ahead: Optional[int] = None,
+    ) -> Iterator[Tuple[str, Optional[str]]]:
+        """Yields (path, hash) in the order of the given paths while hashing the next ones in the background.
+
+        At most `ahead` paths are taken from the input before their hash is
+        yielded, so the paths can come from a lazy source. Paths which
+        `should_hash` rejects or which can not be hashed are yielded with
+        None as a hash.
+        """
+        ahead = ahead or self.workers * 2
+        pending = deque()
+
+        def resolve(path: str, stat: Optional[os.stat_result], md5) -> Tuple[str, Optional[str]]:
+            if not isinstance(md5, Future):
+                return path, md5
+
+            try:
+                md5 = md5.result()
+            except OSError as e:
+                log.warning(f'unable to calculate hash for {path}: {e}')
+                return path, None
+
+            # cache is only touched from the calling thread
+            try:
+                self._save_to_cache(path, md5, stat)
+            except Exception as e:
+                log.warning(f'unable to save hashing result into the cache: {e}')
+
+            return path, md5
+
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hasher')
+        try:
+            for path in paths:
+                stat = None
+                md5 = None
+
+                if should_hash is None or should_hash(path):
+                    try:
+                        stat = os.stat(path)
+                        md5 = self._get_from_cache(path, stat) or executor.submit(self._hash, path, stat)
+                    except OSError as e:
+                        log.warning(f'unable to calculate hash for {path}: {e}')
+
+                pending.append((path, stat, md5))
+
+                while len(pending) > ahead:
+                    yield resolve(*pending.popleft())
+
+            while pending:
+                yield resolve(*pending.popleft())
+        except GeneratorExit:
+            # the consumer stopped early (e.g. deadline or Ctrl+C), files
+            # queued for hashing are not needed anymore
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        finally:
+            executor.shutdown(wait=True)
+            self._log_worker_stats()
+
+
+class StagedFingerprints(object):
+    """Finds out which files need the full MD5, finding local duplicates on the way.
+
+    Files are grouped by size and partial hash as they come: a file is only
+    compared by the full MD5 with the earlier files of the same size and
+    partial hash, and a file is partially hashed only once another file
+    of its size comes. A file with the same MD5 as an earlier one is a
+    duplicate and is not yielded by `iter_unique`. Besides the files hashed
+    for the comparison, full MD5 is needed only for the files
+    `has_remote_candidate` accepts (i.e. an uploaded video may have the same
+    content); it's asked only by `needs_md5`, so that the local files are
+    staged without waiting for the uploaded videos to be known.
+
+    A path of every unique file is kept to compare the later files with, so
+    the memory grows with the number of files seen (also while watching).
+    """
+
+    def __init__(
+            self,
+            partial_hash: Callable[[str], str],
+            md5: Callable[[str], str],
+            has_remote_candidate: Callable[[str], bool]):
+        self.partial_hash = partial_hash
+        self.md5 = md5
+        self.has_remote_candidate = has_remote_candidate
+
+        # duplicate path -> path of the earlier file with the same content
+        self.duplicates: Dict[str, str] = {}
+
+        # size -> the only file of that size seen so far (not hashed at all),
+        # or None once there were more and they are grouped by partial hash
+        self._sizes: Dict[int, Optional[str]] = {}
+        self._by_partial_hash: Dict[Tuple[int, str], List[str]] = {}
+        self._needs_md5: Set[str] = set()
+
+    def needs_md5(self, path: str) -> bool:
+        return path in self._needs_md5 or self.has_remote_candidate(path)
+
+    def _find_original(self, path: str, size: int) -> Optional[str]:
+        if size not in self._sizes:
+            self._sizes[size] = path
+            return None
+
+        alone = self._sizes[size]
+        if alone == path:
+            # the same file seen again, e.g. written once more
+            return None
+
+        if alone is not None:
+            self._sizes[size] = None
+            try:
+                self._by_partial_hash.setdefault((size, self.partial_hash(alone)), []).append(alone)
+            except OSError:
+                # removed or changed since it was seen
+                pass
+
+        partial = self.partial_hash(path)
+        same_partial = self._by_partial_hash.setdefault((size, partial), [])
+
+        for other in list(same_partial):
+            if other == path:
+                continue
+
+            try:
+                other_partial = self.partial_hash(other)
+            except OSError:
+                other_partial = None
+
+            if other_partial != partial:
+                # removed or changed since it was seen
+                same_partial.remove(other)
+                continue
+
+            self._needs_md5.add(path)
+            self._needs_md5.add(other)
+
+            if self.md5(other) == self.md5(path):
+                return other
+
+        if path not in same_partial:
+            same_partial.append(path)
+
+        return None
+
+    def iter_unique(self, paths: Iterable[str]) -> Iterator[str]:
+        for path in paths:
+            try:
+                original = self._find_original(path, os.path.getsize(path))
+            except OSError as e:
+                # let the later stages fail on it as they would without staging
+                log.warning(f'unable to fingerprint {path}: {e}')
+                self._needs_md5.add(path)
+                yield path
+                continue
+
+            if original is not None:
+                log.debug(f'{path} is a duplicate of {original}, skipping')
+                self.duplicates[path] = original
+                continue
+
+            yield path
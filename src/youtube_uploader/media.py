@@ -0,0 +1,122 @@
+import hashlib
+from typing import Callable, Optional
+
+from googleapiclient.http import MediaFileUpload
+
+from youtube_uploader.throttle import BandwidthLimiter
+
+# size of reads used to hash parts of the file which were not uploaded
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+# largest read of the throttled file, keeps the sending smooth
+THROTTLE_BLOCK_SIZE = 64 * 1024
+
+
+class ThrottledFile(object):
+    """File which reads are paced by the bandwidth limiter.
+
+    The request body is sent while it's being read, so pacing the reads
+    paces the upload itself.
+    """
+
+    def __init__(self, fd, limiter: BandwidthLimiter):
+        self._fd = fd
+        self._limiter = limiter
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0 or size > THROTTLE_BLOCK_SIZE:
+            size = THROTTLE_BLOCK_SIZE
+        data = self._fd.read(size)
+        self._limiter.consume(len(data))
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._fd.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._fd.tell()
+
+
+class ThrottledMediaFileUpload(MediaFileUpload):
+    """MediaFileUpload which upload speed is limited by the bandwidth limiter."""
+
+    def __init__(self, filename: str, chunksize: int, limiter: BandwidthLimiter, mimetype: str = None):
+        super().__init__(filename, mimetype=mimetype, chunksize=chunksize, resumable=True)
+        self._throttled = ThrottledFile(self._fd, limiter)
+
+    def stream(self):
+        return self._throttled
+
+
+class HashedReads(object):
+    """File which reads are reported to the callback along with the position they were made at."""
+
+    def __init__(self, fd, on_read: Callable[[int, bytes], None]):
+        self._fd = fd
+        self._on_read = on_read
+
+    def read(self, size: int = -1) -> bytes:
+        begin = self._fd.tell()
+        data = self._fd.read(size)
+        self._on_read(begin, data)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._fd.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._fd.tell()
+
+
+class HashingMediaFileUpload(MediaFileUpload):
+    """MediaFileUpload which calculates MD5 of the file from the uploaded chunks.
+
+    Chunks are hashed as they are read for the upload, so that the file is
+    read from the disk only once. Parts that were never read (e.g. uploaded
+    by a previous run of a resumed upload) are read separately when needed.
+    """
+
+    def __init__(self, filename: str, chunksize: int, mimetype: str = None,
+                 limiter: Optional[BandwidthLimiter] = None):
+        super().__init__(filename, mimetype=mimetype, chunksize=chunksize, resumable=True)
+        self._md5 = hashlib.md5()
+        self._hashed_upto = 0
+
+        # the chunks are read while being sent, so the reads are paced the
+        # same way as for ThrottledMediaFileUpload
+        self._stream = HashedReads(self._fd, self._hash_read)
+        if limiter is not None:
+            self._stream = ThrottledFile(self._stream, limiter)
+
+    def stream(self):
+        return self._stream
+
+    def _hash_from_disk(self, end: int) -> None:
+        # the same file object is used for the upload, so its position is kept
+        position = self._fd.tell()
+        self._fd.seek(self._hashed_upto)
+        while self._hashed_upto < end:
+            buf = self._fd.read(min(HASH_BLOCK_SIZE, end - self._hashed_upto))
+            if not buf:
+                break
+            self._md5.update(buf)
+            self._hashed_upto += len(buf)
+        self._fd.seek(position)
+
+    def _hash_read(self, begin: int, data: bytes) -> None:
+        if begin > self._hashed_upto:
+            self._hash_from_disk(begin)
+
+        end = begin + len(data)
+        if begin <= self._hashed_upto < end:
+            self._md5.update(memoryview(data)[self._hashed_upto - begin:])
+            self._hashed_upto = end
+
+    def getbytes(self, begin, length):
+        data = super().getbytes(begin, length)
+        self._hash_read(begin, data)
+        return data
+
+    def md5(self) -> str:
+        self._hash_from_disk(self.size())
+        return self._md5.hexdigest()
@@ -0,0 +1,261 @@
+import json
+import os
+import threading
+import time
+import timeit
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class CallStats(object):
+    """Aggregated numbers of all the calls made to a single API endpoint."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.units = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.statuses: Dict[int, int] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'units': self.units,
+            'latency': self.latency,
+            'max_latency': self.max_latency,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+        }
+
+
+class TimingStats(object):
+    """Aggregated durations of a local operation (hashing, cache flush, etc.)."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes = 0
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'seconds': self.seconds, 'bytes': self.bytes}
+
+
+class ApiCall(object):
+    """Numbers collected while a single API call is in progress."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.status: Optional[int] = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class MetricsRegistry(object):
+    """Collects per-endpoint API call statistics and timings of local operations.
+
+    API calls are measured by wrapping them into `call()`, while the
+    transport reports bytes and HTTP statuses of the requests it makes into
+    the call in progress on the same thread via `record_transfer()`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started_at = time.time()
+        self.api: Dict[str, CallStats] = {}
+        self.timings: Dict[str, TimingStats] = {}
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started_at = time.time()
+            self.api.clear()
+            self.timings.clear()
+
+    @contextmanager
+    def call(self, endpoint: str) -> Iterator[ApiCall]:
+        current = ApiCall(endpoint)
+        previous = getattr(self._local, 'call', None)
+        self._local.call = current
+
+        started_at = timeit.default_timer()
+        failed = False
+        try:
+            yield current
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            latency = timeit.default_timer() - started_at
+            self._local.call = previous
+
+            with self._lock:
+                stats = self.api.setdefault(endpoint, CallStats())
+                stats.calls += 1
+                stats.errors += 1 if failed else 0
+                stats.latency += latency
+                stats.max_latency = max(stats.max_latency, latency)
+                stats.bytes_sent += current.bytes_sent
+                stats.bytes_received += current.bytes_received
+                if current.status is not None:
+                    stats.statuses[current.status] = stats.statuses.get(current.status, 0) + 1
+
+    def record_transfer(self, bytes_sent: int, bytes_received: int, status: Optional[int]) -> None:
+        current: Optional[ApiCall] = getattr(self._local, 'call', None)
+        if current is None:
+            return
+
+        current.bytes_sent += bytes_sent
+        current.bytes_received += bytes_received
+        current.status = status
+
+    def record_retry(self, endpoint: str) -> None:
+        with self._lock:
+            self.api.setdefault(endpoint, CallStats()).retries += 1
+
+    def record_units(self, endpoint: str, units: int) -> None:
+        with self._lock:
+            self.api.setdefault(endpoint, CallStats()).units += units
+
+    def record_timing(self, name: str, seconds: float, size: int = 0) -> None:
+        with self._lock:
+            stats = self.timings.setdefault(name, TimingStats())
+            stats.count += 1
+            stats.seconds += seconds
+            stats.bytes += size
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        started_at = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.record_timing(name, timeit.default_timer() - started_at)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'api': {endpoint: stats.to_dict() for endpoint, stats in sorted(self.api.items())},
+                'timings': {name: stats.to_dict() for name, stats in sorted(self.timings.items())},
+            }
+
+    def summary_table(self) -> str:
+        data = self.to_dict()
+        lines: List[str] = []
+
+        if data['api']:
+            header = f'{"endpoint":<24}{"calls":>7}{"errors":>8}{"retries":>9}{"units":>8}' \
+                     f'{"avg ms":>9}{"max ms":>9}{"sent MiB":>10}{"recv MiB":>10}'
+            lines.append(header)
+            lines.append('-' * len(header))
+            for endpoint, stats in data['api'].items():
+                average = stats['latency'] / stats['calls'] * 1000 if stats['calls'] else 0.0
+                lines.append(f'{endpoint:<24}{stats["calls"]:>7}{stats["errors"]:>8}{stats["retries"]:>9}'
+                             f'{stats["units"]:>8}{average:>9.1f}{stats["max_latency"] * 1000:>9.1f}'
+                             f'{stats["bytes_sent"] / (1024 * 1024):>10.2f}'
+                             f'{stats["bytes_received"] / (1024 * 1024):>10.2f}')
+
+        if data['timings']:
+            if lines:
+                lines.append('')
+            header = f'{"operation":<24}{"count":>7}{"seconds":>10}{"MiB":>10}'
+            lines.append(header)
+            lines.append('-' * len(header))
+            for name, stats in data['timings'].items():
+                lines.append(f'{name:<24}{stats["count"]:>7}{stats["seconds"]:>10.2f}'
+                             f'{stats["bytes"] / (1024 * 1024):>10.2f}')
+
+        return '\n'.join(lines)
+
+    def to_prometheus(self) -> str:
+        """Renders the metrics in the format node_exporter textfile collector reads."""
+        data = self.to_dict()
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: List[tuple]) -> None:
+            lines.append(f'# HELP youtube_uploader_{name} {help}')
+            lines.append(f'# TYPE youtube_uploader_{name} {kind}')
+            for labels, value in samples:
+                rendered = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                rendered = f'{{{rendered}}}' if rendered else ''
+                lines.append(f'youtube_uploader_{name}{rendered} {value}')
+
+        api = data['api'].items()
+        metric('api_calls_total', 'counter', 'API calls made',
+               [({'endpoint': endpoint}, stats['calls']) for endpoint, stats in api])
+        metric('api_errors_total', 'counter', 'API calls which failed',
+               [({'endpoint': endpoint}, stats['errors']) for endpoint, stats in api])
+        metric('api_retries_total', 'counter', 'API calls retried',
+               [({'endpoint': endpoint}, stats['retries']) for endpoint, stats in api])
+        metric('api_quota_units_total', 'counter', 'Estimated quota units spent',
+               [({'endpoint': endpoint}, stats['units']) for endpoint, stats in api])
+        metric('api_latency_seconds_total', 'counter', 'Time spent in API calls',
+               [({'endpoint': endpoint}, stats['latency']) for endpoint, stats in api])
+        metric('api_sent_bytes_total', 'counter', 'Bytes sent to the API',
+               [({'endpoint': endpoint}, stats['bytes_sent']) for endpoint, stats in api])
+        metric('api_received_bytes_total', 'counter', 'Bytes received from the API',
+               [({'endpoint': endpoint}, stats['bytes_received']) for endpoint, stats in api])
+        metric('api_responses_total', 'counter', 'API responses by HTTP status',
+               [({'endpoint': endpoint, 'status': status}, count)
+                for endpoint, stats in api for status, count in stats['statuses'].items()])
+
+        timings = data['timings'].items()
+        metric('operation_seconds_total', 'counter', 'Time spent in local operations',
+               [({'operation': name}, stats['seconds']) for name, stats in timings])
+        metric('operation_count_total', 'counter', 'Local operations performed',
+               [({'operation': name}, stats['count']) for name, stats in timings])
+        metric('operation_bytes_total', 'counter', 'Bytes processed by local operations',
+               [({'operation': name}, stats['bytes']) for name, stats in timings])
+
+        metric('last_run_timestamp_seconds', 'gauge', 'When the run was started', [({}, data['started_at'])])
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        """Writes the metrics into the file, in Prometheus text format when it has .prom extension, JSON otherwise."""
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+
+        # textfile collector may read the file at any moment, so it's replaced atomically
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+
+# the registry all the components of the process report into
+registry = MetricsRegistry()
+
+
+def _body_size(body, headers: Optional[dict]) -> int:
+    for name, value in (headers or {}).items():
+        if name.lower() == 'content-length':
+            return int(value)
+
+    if isinstance(body, (bytes, str)):
+        return len(body)
+
+    return 0
+
+
+def instrument_http(http):
+    """Makes the (already authorized) httplib2.Http report transferred bytes and statuses into the registry."""
+    request = http.request
+
+    def instrumented_request(uri, method='GET', body=None, headers=None, *args, **kwargs):
+        resp, content = request(uri, method, body, headers, *args, **kwargs)
+        registry.record_transfer(_body_size(body, headers), len(content or b''), resp.status)
+        return resp, content
+
+    http.request = instrumented_request
+
+    return http
@@ -1,36 +1,149 @@
-from typing import Iterable, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# size key of the videos which have MD5 but no size in the description
+UNKNOWN_SIZE = '?'
 
 
 class UploadVideoResponse(object):
+    __slots__ = ('videoId',)
+
     def __init__(self, videoId: str):
         self.videoId = videoId
 
 
 class Playlist(object):
-    def __init__(self, playlistId: str, title: str, description: str = None, etag: str = None):
+    __slots__ = ('playlistId', 'title', 'etag')
+
+    def __init__(self, playlistId: str, title: str, etag: str = None):
         self.playlistId = playlistId
         self.title = title
-        self.description = description
         self.etag = etag
 
+    def to_data(self) -> list:
+        """Plain form the playlist is cached in."""
+        return [self.playlistId, self.title, self.etag]
+
+    @classmethod
+    def from_data(cls, data: list) -> 'Playlist':
+        return cls(*data)
+
 
 class GetMyPlaylistsResponse(object):
+    __slots__ = ('playlists',)
+
     def __init__(self, playlists: Iterable[Playlist]):
         self.playlists = playlists
 
 
 class Video(object):
-    def __init__(self, videoId: str, title: str, description: str):
+    """Uploaded video along with the metadata parsed from its description.
+
+    The description itself is not kept -- only the fields needed to tell
+    whether a local file is uploaded already, so that memory and cache size
+    do not depend on descriptions length.
+    """
+
+    __slots__ = ('videoId', 'title', 'md5', 'size', 'fileName', 'modifiedAt')
+
+    def __init__(
+            self,
+            videoId: str,
+            title: str,
+            md5: Optional[str] = None,
+            size: Optional[str] = None,
+            fileName: Optional[str] = None,
+            modifiedAt: Optional[str] = None):
         self.videoId = videoId
         self.title = title
-        self.description = description
+        self.md5 = md5
+        self.size = size
+        self.fileName = fileName
+        self.modifiedAt = modifiedAt
+
+    def to_data(self) -> list:
+        """Plain form the video is cached in."""
+        return [self.videoId, self.title, self.md5, self.size, self.fileName, self.modifiedAt]
+
+    @classmethod
+    def from_data(cls, data: list) -> 'Video':
+        return cls(*data)
 
 
 class PlaylistVideosResponse(object):
+    __slots__ = ('videos',)
+
     def __init__(self, videos: Iterable[Video]):
         self.videos = videos
 
 
+class VideoIndex(object):
+    """Lookup of the uploaded videos by the metadata stored in their description.
+
+    Besides the MD5 videos are indexed by the metadata key (file name, size
+    and modification time) which can be checked without reading the file,
+    and videos with MD5 by their size, so that only the local files which
+    have the size of some uploaded video need to be hashed to be compared.
+    """
+
+    def __init__(
+            self,
+            by_md5: Optional[Dict[str, Video]] = None,
+            by_metadata: Optional[Dict[str, Video]] = None,
+            by_size: Optional[Dict[str, List[Video]]] = None):
+        self.by_md5 = by_md5 if by_md5 is not None else {}
+        self.by_metadata = by_metadata if by_metadata is not None else {}
+        self.by_size = by_size if by_size is not None else {}
+
+    def __len__(self) -> int:
+        return len(self.by_md5)
+
+    def update(self, other: 'VideoIndex') -> None:
+        self.by_md5.update(other.by_md5)
+        self.by_metadata.update(other.by_metadata)
+        for size_key, videos in other.by_size.items():
+            self.by_size.setdefault(size_key, []).extend(videos)
+
+    def find_by_md5(self, md5: str) -> Optional[Video]:
+        return self.by_md5.get(md5)
+
+    def find_by_metadata(self, metadata_key: str) -> Optional[Video]:
+        return self.by_metadata.get(metadata_key)
+
+    def add(self, video: Video, md5: Optional[str], metadata_key: str, size_key: str) -> None:
+        """Indexes the video uploaded for the file with given keys."""
+        self.by_metadata[metadata_key] = video
+        if md5:
+            self.by_md5[md5] = video
+            self.by_size.setdefault(size_key, []).append(video)
+
+    def has_size_candidate(self, size_key: str) -> bool:
+        """Whether a video with MD5 may have given size, i.e. whether a local file of that size may be uploaded."""
+        return size_key in self.by_size or UNKNOWN_SIZE in self.by_size
+
+
+class LocalFile(object):
+    """Discovered local file along with its stat taken once during the discovery."""
+
+    __slots__ = ('path', 'size', 'created_at', 'modified_at')
+
+    def __init__(self, path: str, size: int, created_at: float, modified_at: float):
+        self.path = path
+        self.size = size
+        self.created_at = created_at
+        self.modified_at = modified_at
+
+
+class BatchItemResult(object):
+    """Outcome of a single item of a bulk call -- either a result or an error."""
+
+    __slots__ = ('itemId', 'result', 'error')
+
+    def __init__(self, itemId: str, result: Optional[object] = None, error: Optional[Exception] = None):
+        self.itemId = itemId
+        self.result = result
+        self.error = error
+
+
 class YouTubeClient(object):
     def authorize(self) -> None:
         raise NotImplementedError()
@@ -38,24 +151,76 @@ class YouTubeClient(object):
     def file_hash(self, path: str) -> str:
         raise NotImplementedError()
 
+    def file_hashes(self, paths: Iterable[str]) -> Dict[str, str]:
+        raise NotImplementedError()
+
+    def file_hashes_ahead(
+            self,
+            paths: Iterable[str],
+            should_hash: Optional[Callable[[str], bool]] = None,
+    ) -> Iterator[Tuple[str, Optional[str]]]:
+        raise NotImplementedError()
+
+    def cached_file_hash(self, path: str) -> Optional[str]:
+        raise NotImplementedError()
+
+    def file_metadata_key(self, path: str) -> str:
+        raise NotImplementedError()
+
+    def file_size_key(self, path: str) -> str:
+        raise NotImplementedError()
+
+    def file_partial_hash(self, path: str) -> str:
+        raise NotImplementedError()
+
     def is_video(self, path: str) -> bool:
         raise NotImplementedError()
 
+    def parse_video(self, videoId: str, title: str, description: Optional[str]) -> Video:
+        raise NotImplementedError()
+
     def is_matching_video(self, local_hash: str, video: Video) -> bool:
         raise NotImplementedError()
 
+    def build_video_index(self, videos: Iterable[Video]) -> VideoIndex:
+        raise NotImplementedError()
+
     def get_my_playlists(self) -> GetMyPlaylistsResponse:
         raise NotImplementedError()
 
+    def get_playlist_etags(self, playlistIds: Iterable[str]) -> Dict[str, BatchItemResult]:
+        raise NotImplementedError()
+
     def get_playlist_videos(self, playlistId: str, etag: Optional[str] = None) -> PlaylistVideosResponse:
         raise NotImplementedError()
 
+    def get_playlist_video_index(self, playlistId: str, etag: Optional[str] = None) -> VideoIndex:
+        raise NotImplementedError()
+
+    def get_playlist_video_indices(self, playlists: Iterable[Playlist], concurrency: int = 8) -> Dict[str, VideoIndex]:
+        raise NotImplementedError()
+
     def upload_video(self, path: str, title: str, description: str = '', privacyLevel: str = 'unlisted') -> UploadVideoResponse:
         raise NotImplementedError()
 
     def add_video_to_playlist(self, playlistId: str, videoId: str) -> None:
         raise NotImplementedError()
 
+    def add_videos_to_playlist(self, playlistId: str, videoIds: Iterable[str]) -> Dict[str, BatchItemResult]:
+        raise NotImplementedError()
+
+    def queue_playlist_add(self, playlistId: str, videoId: str) -> int:
+        raise NotImplementedError()
+
+    def queued_playlist_adds(self) -> Dict[str, List[str]]:
+        raise NotImplementedError()
+
+    def add_queued_videos_to_playlist(self, playlistId: str) -> Dict[str, BatchItemResult]:
+        raise NotImplementedError()
+
     def update_video(self, videoId: str, newTitle: Optional[str], newDescription: Optional[str]) -> None:
         raise NotImplementedError()
 
+    def complete_pending_descriptions(self) -> None:
+        raise NotImplementedError()
+
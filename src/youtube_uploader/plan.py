@@ -0,0 +1,113 @@
+import csv
+import json
+import logging
+import math
+import os
+from typing import Callable, Iterable, List, Optional
+
+from youtube_uploader.model import Video
+
+log = logging.getLogger(__name__)
+
+# statistics of the previous runs, e.g. achieved upload throughput
+RUN_STATS_CACHE_SECTION = 'run-stats-v1'
+
+
+class PlannedUpload(object):
+    def __init__(self, path: str, size: int, md5: Optional[str] = None):
+        self.path = path
+        self.size = size
+        self.md5 = md5
+
+
+class UploadPlan(object):
+    """Files which would be uploaded by the run along with the estimated cost of the upload.
+
+    `bandwidth` is the expected aggregate upload throughput in bytes per
+    second, `daily_units` is the amount of quota units all the projects
+    get per day -- the corresponding estimates are omitted when not known.
+    """
+
+    def __init__(self, units_per_upload: int, bandwidth: Optional[float] = None, daily_units: Optional[int] = None):
+        self.units_per_upload = units_per_upload
+        self.bandwidth = bandwidth
+        self.daily_units = daily_units
+        self.uploads: List[PlannedUpload] = []
+        self.skipped = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(upload.size for upload in self.uploads)
+
+    @property
+    def estimated_units(self) -> int:
+        return len(self.uploads) * self.units_per_upload
+
+    @property
+    def estimated_seconds(self) -> Optional[float]:
+        if not self.bandwidth:
+            return None
+        return self.total_bytes / self.bandwidth
+
+    @property
+    def estimated_days(self) -> Optional[int]:
+        """Days the quota of all the projects is enough to upload everything in."""
+        if not self.daily_units:
+            return None
+        return math.ceil(self.estimated_units / self.daily_units)
+
+    def to_dict(self) -> dict:
+        return {
+            'uploads': [{'path': upload.path, 'size': upload.size, 'md5': upload.md5} for upload in self.uploads],
+            'skipped': self.skipped,
+            'total_bytes': self.total_bytes,
+            'estimated_units': self.estimated_units,
+            'estimated_seconds': self.estimated_seconds,
+            'estimated_days': self.estimated_days,
+        }
+
+    def write(self, path: str) -> None:
+        """Writes the plan into the file, a row per file when it has .csv extension, JSON otherwise."""
+        with open(path, 'w', newline='') as file:
+            if os.path.splitext(path)[1].lower() == '.csv':
+                writer = csv.writer(file)
+                writer.writerow(['path', 'size', 'md5'])
+                for upload in self.uploads:
+                    writer.writerow([upload.path, upload.size, upload.md5 or ''])
+            else:
+                json.dump(self.to_dict(), file, indent=2)
+
+    def log_summary(self) -> None:
+        for upload in self.uploads:
+            log.info(f'  would upload {upload.path} ({upload.size / (1024 * 1024):.2f} MiB)')
+
+        log.info(f'Plan: {len(self.uploads)} videos to upload ({self.total_bytes / (1024 * 1024):.2f} MiB), '
+                 f'{self.skipped} already uploaded')
+        log.info(f'  estimated quota: {self.estimated_units} units'
+                 + (f' ({self.estimated_days} days with the current projects)' if self.estimated_days is not None else ''))
+
+        if self.estimated_seconds is not None:
+            log.info(f'  estimated upload time: {self.estimated_seconds / 3600:.2f} hours '
+                     f'at {self.bandwidth / (1024 * 1024):.2f} MB/s')
+        else:
+            log.info('  upload time can not be estimated -- specify the bandwidth or make a real run first')
+
+
+def build_plan(
+        paths: Iterable[str],
+        find_uploaded: Callable[[str], Optional[Video]],
+        cached_md5: Callable[[str], Optional[str]],
+        units_per_upload: int,
+        bandwidth: Optional[float] = None,
+        daily_units: Optional[int] = None,
+) -> UploadPlan:
+    plan = UploadPlan(units_per_upload, bandwidth, daily_units)
+
+    for path in paths:
+        if find_uploaded(path):
+            plan.skipped += 1
+            continue
+
+        plan.uploads.append(PlannedUpload(path, os.path.getsize(path), cached_md5(path)))
+
+    return plan
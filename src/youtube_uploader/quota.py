@@ -0,0 +1,172 @@
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable
+
+from googleapiclient.errors import HttpError
+
+from youtube_uploader.cache import YoutubeCacheBase
+from youtube_uploader.retry import error_reasons
+
+log = logging.getLogger(__name__)
+
+# units spent per project and day, an entry per process so that processes
+# sharing the cache do not overwrite each other's counts
+QUOTA_USAGE_CACHE_SECTION = 'quota-usage-v2'
+
+# default amount of units every project gets per day
+DEFAULT_DAILY_QUOTA = 10000
+
+# estimated costs of the calls in quota units, see
+# https://developers.google.com/youtube/v3/determine_quota_cost
+QUOTA_COSTS = {
+    'playlists.list': 1,
+    'playlistItems.list': 1,
+    'playlistItems.insert': 50,
+    'videos.list': 1,
+    'videos.insert': 1600,
+    'videos.update': 50,
+}
+
+# error reasons which mean the project has no quota left for today
+QUOTA_EXCEEDED_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+
+try:
+    from zoneinfo import ZoneInfo
+    PACIFIC_TIMEZONE = ZoneInfo('America/Los_Angeles')
+except Exception:  # no tz database available, DST is not accounted for then
+    PACIFIC_TIMEZONE = timezone(timedelta(hours=-8))
+
+
+class QuotaExceededException(Exception):
+    pass
+
+
+class CredentialSet(object):
+    """Client secrets and credentials files of a single Google Cloud project."""
+
+    def __init__(self, client_secrets_file_path: str, credentials_file_path: str):
+        self.client_secrets_file_path = client_secrets_file_path
+        self.credentials_file_path = credentials_file_path
+        self._project_id = None
+
+    @property
+    def project_id(self) -> str:
+        """Project the quota is accounted for, taken from the client secrets."""
+        if self._project_id is None:
+            try:
+                with open(self.client_secrets_file_path, 'r') as file:
+                    secrets = json.load(file)
+                client = secrets.get('installed') or secrets.get('web') or {}
+                self._project_id = client.get('project_id') or client.get('client_id')
+            except (OSError, ValueError) as e:
+                log.warning(f'unable to read project ID from {self.client_secrets_file_path}: {e}')
+
+            self._project_id = self._project_id or self.client_secrets_file_path
+
+        return self._project_id
+
+
+def pacific_date() -> str:
+    """Quota is reset at midnight Pacific time."""
+    return datetime.now(PACIFIC_TIMEZONE).date().isoformat()
+
+
+def is_quota_exceeded(error: Exception) -> bool:
+    if not isinstance(error, HttpError) or error.resp.status != 403:
+        return False
+
+    return bool(error_reasons(error) & QUOTA_EXCEEDED_REASONS)
+
+
+class QuotaTracker(object):
+    """Tracks estimated quota units spent by every project during the current Pacific day.
+
+    Usage is stored in the cache, so that it's known to subsequent runs made
+    the same day. Every process counts its own units in a separate entry and
+    the entries are summed up, so processes sharing the cache see each other's
+    usage once it is flushed. The numbers are estimates -- quota used by other
+    tools or failed calls is not seen, so a project is also marked as exhausted
+    once the API reports that its quota is exceeded.
+    """
+
+    def __init__(self, cache: YoutubeCacheBase, daily_limit: int = DEFAULT_DAILY_QUOTA):
+        self.cache = cache
+        self.daily_limit = daily_limit
+        self._lock = threading.Lock()
+
+        # random rather than the pid, which is reused by later runs
+        self._process_id = uuid.uuid4().hex
+
+    def used(self, project: str) -> int:
+        today = pacific_date()
+
+        return sum(
+            entry.get('units', 0)
+            for entry in self.cache.entries(QUOTA_USAGE_CACHE_SECTION).values()
+            if isinstance(entry, dict) and entry.get('project') == project and entry.get('date') == today)
+
+    def remaining(self, project: str) -> int:
+        return max(0, self.daily_limit - self.used(project))
+
+    def _own_key(self, project: str) -> str:
+        return f'{project}/{self._process_id}'
+
+    def _own_used(self, project: str) -> int:
+        entry = self.cache.get(QUOTA_USAGE_CACHE_SECTION, self._own_key(project))
+
+        if not isinstance(entry, dict) or entry.get('date') != pacific_date():
+            return 0
+
+        return entry.get('units', 0)
+
+    def _drop_outdated(self) -> None:
+        today = pacific_date()
+
+        for key, entry in self.cache.entries(QUOTA_USAGE_CACHE_SECTION).items():
+            if not isinstance(entry, dict) or entry.get('date') != today:
+                self.cache.update(QUOTA_USAGE_CACHE_SECTION, key, None)
+
+    def _set_own_used(self, project: str, units: int) -> None:
+        key = self._own_key(project)
+
+        try:
+            entry = self.cache.get(QUOTA_USAGE_CACHE_SECTION, key)
+            if not isinstance(entry, dict) or entry.get('date') != pacific_date():
+                # first units of the day, entries of the previous days are not needed anymore
+                self._drop_outdated()
+
+            self.cache.update(QUOTA_USAGE_CACHE_SECTION, key, {
+                'project': project,
+                'date': pacific_date(),
+                'units': units,
+            })
+        except Exception as e:
+            log.warning(f'unable to save quota usage into the cache: {e}')
+
+    def spend(self, project: str, units: int) -> None:
+        with self._lock:
+            self._set_own_used(project, self._own_used(project) + units)
+
+    def mark_exhausted(self, project: str) -> None:
+        log.warning(f'quota of project {project} is exhausted for today')
+
+        with self._lock:
+            missing = self.daily_limit - self.used(project)
+            if missing > 0:
+                self._set_own_used(project, self._own_used(project) + missing)
+
+    def pick(self, projects: Iterable[str], units: int) -> str:
+        """Returns the first project which has enough units left for today."""
+        remaining: Dict[str, int] = {}
+
+        for project in projects:
+            remaining[project] = self.remaining(project)
+            if remaining[project] >= units:
+                return project
+
+        raise QuotaExceededException(
+            f'None of the projects has {units} quota units left for today (remaining: {remaining}), '
+            f'quota is reset at midnight Pacific time')
@@ -0,0 +1,205 @@
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+import timeit
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, Set, TypeVar
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from youtube_uploader.metrics import registry as metrics
+
+log = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# statuses of the errors which are likely gone when the call is repeated
+RETRIABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# 403 reasons of the short term rate limits (unlike quotaExceeded which lasts until the next day)
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+# transport level errors, the request may not have reached the server at all
+RETRIABLE_EXCEPTIONS = (
+    httplib2.HttpLib2Error, IOError, http.client.NotConnected,
+    http.client.IncompleteRead, http.client.ImproperConnectionState,
+    http.client.CannotSendRequest, http.client.CannotSendHeader,
+    http.client.ResponseNotReady, http.client.BadStatusLine,
+)
+
+
+class RetryPolicy(object):
+    """How many times and how long apart a failed call of an endpoint is repeated.
+
+    Delays grow exponentially with "full jitter" (random between zero and
+    the exponential delay), so that the workers failed at once do not
+    retry at once as well.
+    """
+
+    def __init__(
+            self,
+            max_retries: int = 5,
+            base_delay: float = 1.0,
+            max_delay: float = 60.0,
+            statuses: Optional[Set[int]] = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.statuses = statuses if statuses is not None else RETRIABLE_STATUSES
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+# for the calls which are not safe to repeat blindly, the caller checks
+# what went through before making them again
+SINGLE_ATTEMPT = RetryPolicy(max_retries=0)
+
+RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    # a chunk of an upload, the upload itself may take hours and has to survive longer outages
+    'videos.insert': RetryPolicy(max_retries=10, max_delay=120.0),
+    # not idempotent, a retry after the server handled the call adds the video twice
+    'playlistItems.insert': RetryPolicy(max_retries=3),
+}
+
+
+class CircuitBreaker(object):
+    """Pauses all the API calls once too many of them failed in a row.
+
+    After `threshold` consecutive retriable failures (across all the
+    threads) calls wait for `cooldown` seconds before going on. The pause
+    doubles, up to `max_cooldown`, every time the failures go on, and is
+    reset by the first successful call.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0, max_cooldown: float = 600.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self._failures = 0
+        self._next_cooldown = cooldown
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return timeit.default_timer() < self._open_until
+
+    def wait(self) -> None:
+        with self._lock:
+            pause = self._open_until - timeit.default_timer()
+
+        if pause > 0:
+            log.debug(f'API calls are paused for {pause:.1f} sec')
+            metrics.record_timing('api.paused', pause)
+            time.sleep(pause)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._next_cooldown = self.cooldown
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+
+            now = timeit.default_timer()
+            if self._failures < self.threshold or now < self._open_until:
+                return
+
+            log.warning(f'{self._failures} API calls failed in a row, pausing all calls for {self._next_cooldown:.0f} sec')
+            self._open_until = now + self._next_cooldown
+            self._next_cooldown = min(self.max_cooldown, self._next_cooldown * 2)
+            self._failures = 0
+
+
+def error_reasons(error: HttpError) -> Set[str]:
+    try:
+        content = error.content.decode('utf-8') if isinstance(error.content, bytes) else error.content
+        details = json.loads(content)['error']
+        return {item.get('reason') for item in details.get('errors', [])}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return set()
+
+
+def is_retriable(error: BaseException, policy: RetryPolicy = DEFAULT_RETRY_POLICY) -> bool:
+    if isinstance(error, HttpError):
+        if error.resp.status in policy.statuses:
+            return True
+        return error.resp.status == 403 and bool(error_reasons(error) & RATE_LIMIT_REASONS)
+
+    # local files going away do not come back
+    if isinstance(error, (FileNotFoundError, PermissionError, IsADirectoryError)):
+        return False
+
+    return isinstance(error, RETRIABLE_EXCEPTIONS)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked to wait before the next call, if it did."""
+    if not isinstance(error, HttpError):
+        return None
+
+    value = error.resp.get('retry-after')
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retries(
+        endpoint: str,
+        call: Callable[[], T],
+        breaker: Optional[CircuitBreaker] = None,
+        policy: Optional[RetryPolicy] = None,
+) -> T:
+    """Makes the call, repeating it on retriable errors according to the endpoint retry policy."""
+    policy = policy or RETRY_POLICIES.get(endpoint, DEFAULT_RETRY_POLICY)
+    attempt = 0
+
+    while True:
+        if breaker is not None:
+            breaker.wait()
+
+        try:
+            result = call()
+        except Exception as e:
+            if not is_retriable(e, policy):
+                raise
+
+            if breaker is not None:
+                breaker.record_failure()
+
+            attempt += 1
+            if attempt > policy.max_retries:
+                if policy.max_retries > 0:
+                    log.error(f'{endpoint} failed {attempt} times, giving up')
+                raise
+
+            delay = max(retry_after(e) or 0.0, policy.delay(attempt))
+            metrics.record_retry(endpoint)
+            log.warning(f'{endpoint} failed ({e}), retrying in {delay:.1f} sec ({attempt}/{policy.max_retries})...')
+            time.sleep(delay)
+            continue
+
+        if breaker is not None:
+            breaker.record_success()
+
+        return result
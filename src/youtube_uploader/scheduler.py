@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+import timeit
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional
+
+from youtube_uploader.model import YouTubeClient, Video
+
+log = logging.getLogger(__name__)
+
+
+class UploadSummary(object):
+    def __init__(self):
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.skipped = 0
+        self.postponed = 0  # would not fit before the deadline
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Aggregate upload throughput in MB/s."""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.uploaded_bytes / (1024 * 1024) / self.elapsed
+
+
+class UploadScheduler(object):
+    """Uploads files using several concurrent uploads.
+
+    Files are handled in the given order: while uploads are running the
+    upcoming files are hashed and checked against already uploaded videos,
+    so that the next upload can start as soon as a slot is freed.
+
+    With a deadline an upload is only started when it's expected to finish
+    before the deadline. The speed of a single upload is estimated from the
+    uploads done so far, `upload_rate` (bytes per second) is used until the
+    first one is done; without any estimate uploads are started until the
+    deadline passes.
+    """
+
+    def __init__(
+            self,
+            client: YouTubeClient,
+            find_uploaded: Callable[[str], Optional[Video]],
+            concurrency: int = 1,
+            on_uploaded: Optional[Callable[[str, str], None]] = None,
+            privacy_level: str = 'unlisted',
+            deadline: Optional[datetime] = None,
+            upload_rate: Optional[float] = None):
+        self.client = client
+        self.find_uploaded = find_uploaded
+        self.concurrency = max(1, concurrency)
+        self.on_uploaded = on_uploaded
+        self.privacy_level = privacy_level
+        self.deadline = deadline
+        self.upload_rate = upload_rate
+
+        self._summary = UploadSummary()
+        self._summary_lock = threading.Lock()
+
+        # bytes and seconds of the finished uploads, to estimate the next ones
+        self._measured_bytes = 0
+        self._measured_seconds = 0.0
+
+    def _estimated_rate(self) -> Optional[float]:
+        with self._summary_lock:
+            if self._measured_seconds > 0:
+                return self._measured_bytes / self._measured_seconds
+        return self.upload_rate
+
+    def _fits_before_deadline(self, path: str) -> bool:
+        if self.deadline is None:
+            return True
+
+        left = (self.deadline - datetime.now()).total_seconds()
+        rate = self._estimated_rate()
+
+        if not rate:
+            return left > 0
+
+        estimated = os.path.getsize(path) / rate
+        if estimated > left:
+            log.info(f'  not starting upload of {path}: estimated {estimated / 60:.1f} min, '
+                     f'{max(0.0, left) / 60:.1f} min left until {self.deadline:%H:%M}')
+            return False
+
+        return True
+
+    def _upload(self, path: str) -> str:
+        _, fileName = os.path.split(path)
+        fileNameNoExt = os.path.splitext(fileName)[0]
+        size = os.path.getsize(path)
+
+        log.info(f'uploading {path} ({size / (1024 * 1024):.2f} MiB)...')
+
+        started_at = timeit.default_timer()
+        upload_response = self.client.upload_video(
+            path, title=fileNameNoExt, privacyLevel=self.privacy_level)
+
+        log.info(f'  upload of {fileName} successfull, ID: {upload_response.videoId}')
+
+        with self._summary_lock:
+            self._summary.uploaded += 1
+            self._summary.uploaded_bytes += size
+            self._measured_bytes += size
+            self._measured_seconds += timeit.default_timer() - started_at
+
+        if self.on_uploaded:
+            self.on_uploaded(path, upload_response.videoId)
+
+        return upload_response.videoId
+
+    @staticmethod
+    def _raise_first_failure(futures: List[Future]) -> None:
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+
+    def run(self, paths: Iterable[str]) -> UploadSummary:
+        started_at = timeit.default_timer()
+
+        # files being uploaded plus the ones already checked and waiting for
+        # a free upload slot -- keeps hashing just ahead of the uploads
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+        futures: List[Future] = []
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='uploader') as executor:
+                try:
+                    for path in paths:
+                        # stop starting new uploads once any of them failed
+                        self._raise_first_failure(futures)
+
+                        slots.acquire()
+
+                        log.debug(f'handling {path}...')
+
+                        try:
+                            already_uploaded = self.find_uploaded(path)
+                        except BaseException:
+                            slots.release()
+                            raise
+
+                        if already_uploaded:
+                            log.debug(
+                                f'  already uploaded as {already_uploaded.title} (ID: {already_uploaded.videoId})')
+                            self._summary.skipped += 1
+                            slots.release()
+                            continue
+
+                        if not self._fits_before_deadline(path):
+                            self._summary.postponed += 1
+                            slots.release()
+
+                            if datetime.now() >= self.deadline:
+                                log.info(f'Deadline {self.deadline:%H:%M} has passed, not starting any more uploads')
+                                break
+
+                            # smaller files may still fit
+                            continue
+
+                        future = executor.submit(self._upload, path)
+                        future.add_done_callback(lambda _: slots.release())
+
+                        # only running and failed uploads are kept around
+                        futures = [f for f in futures if not f.done() or f.exception() is not None]
+                        futures.append(future)
+                except BaseException:
+                    # uploads which have not started yet are dropped, the
+                    # running ones are let to finish
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            self._raise_first_failure(futures)
+        finally:
+            self._summary.elapsed = timeit.default_timer() - started_at
+
+            log.info(f'Uploaded {self._summary.uploaded} videos '
+                     f'({self._summary.uploaded_bytes / (1024 * 1024):.2f} MiB) '
+                     f'in {self._summary.elapsed:.2f} sec, {self._summary.throughput:.2f} MB/s '
+                     f'using {self.concurrency} concurrent uploads'
+                     + (f', {self._summary.postponed} postponed until the next run' if self._summary.postponed else ''))
+
+        return self._summary
@@ -0,0 +1,102 @@
+import re
+import threading
+import time
+import timeit
+from datetime import datetime, time as time_of_day, timedelta
+from typing import List, Optional, Tuple
+
+RATE_WINDOW_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(.+)$')
+
+
+def parse_time_of_day(value: str) -> time_of_day:
+    try:
+        return datetime.strptime(value.strip(), '%H:%M').time()
+    except ValueError:
+        raise Exception(f'Not a valid time of day (HH:MM): {value}')
+
+
+class BandwidthSchedule(object):
+    """Upload rate limit in bytes per second, possibly depending on the time of day.
+
+    Parsed from a comma separated list of rates in MB/s, each either a
+    default one (e.g. `5`) or one applied within a window of the day
+    (e.g. `08:00-20:00=1`), windows may span midnight. The first matching
+    window wins, 0 means no limit.
+    """
+
+    def __init__(self, default: float = 0.0, windows: Optional[List[Tuple[time_of_day, time_of_day, float]]] = None):
+        self.default = default
+        self.windows = windows or []
+
+    @staticmethod
+    def parse(spec: str) -> 'BandwidthSchedule':
+        schedule = BandwidthSchedule()
+
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            match = RATE_WINDOW_PATTERN.match(item)
+            try:
+                if match:
+                    start = time_of_day(int(match.group(1)), int(match.group(2)))
+                    end = time_of_day(int(match.group(3)), int(match.group(4)))
+                    schedule.windows.append((start, end, float(match.group(5)) * 1024 * 1024))
+                else:
+                    schedule.default = float(item) * 1024 * 1024
+            except ValueError:
+                raise Exception(f'Not a valid bandwidth limit: {item}')
+
+        return schedule
+
+    def rate_at(self, moment: time_of_day) -> float:
+        for start, end, rate in self.windows:
+            if start <= end:
+                if start <= moment < end:
+                    return rate
+            elif moment >= start or moment < end:
+                return rate
+
+        return self.default
+
+
+class BandwidthLimiter(object):
+    """Token bucket shared by all the uploads of the process.
+
+    Bucket holds at most a second worth of bytes; reading more than there
+    is puts the bucket into debt, which the reader waits out.
+    """
+
+    def __init__(self, schedule: BandwidthSchedule):
+        self.schedule = schedule
+        self._tokens = 0.0
+        self._updated_at = timeit.default_timer()
+        self._lock = threading.Lock()
+
+    def current_rate(self) -> float:
+        return self.schedule.rate_at(datetime.now().time())
+
+    def consume(self, size: int) -> None:
+        with self._lock:
+            rate = self.current_rate()
+            now = timeit.default_timer()
+
+            if rate <= 0:
+                self._tokens = 0.0
+                self._updated_at = now
+                return
+
+            self._tokens = min(rate, self._tokens + (now - self._updated_at) * rate)
+            self._updated_at = now
+            self._tokens -= size
+
+            wait = -self._tokens / rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+def next_occurrence(moment: time_of_day, now: Optional[datetime] = None) -> datetime:
+    """The closest point in the future which has given time of day."""
+    now = now or datetime.now()
+    candidate = datetime.combine(now.date(), moment)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    return candidate
@@ -0,0 +1,252 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+import timeit
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct('iIII')
+INOTIFY_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+
+class FileWatcher(object):
+    """Reports files which appear or change under the root directory once they stop changing.
+
+    A file is reported when nothing happened to it for `settle` seconds and
+    its size did not change in the meantime, so files which are still being
+    copied are not picked up half-written. Subclasses only tell which paths
+    might have changed.
+    """
+
+    def __init__(self, root: str, is_wanted: Callable[[str], bool], settle: float = 10.0):
+        self.root = root
+        self.is_wanted = is_wanted
+        self.settle = settle
+
+        # path -> (time of the last change, size at that time)
+        self._pending: Dict[str, Tuple[float, int]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def _changes(self, timeout: float) -> Iterable[str]:
+        """Waits at most `timeout` seconds for the changes and returns paths which might have changed."""
+        raise NotImplementedError()
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return -1
+
+    def _take_settled(self) -> List[str]:
+        now = timeit.default_timer()
+        settled = []
+
+        for path, (changed_at, size) in list(self._pending.items()):
+            if now - changed_at < self.settle:
+                continue
+
+            current_size = self._size(path)
+
+            if current_size < 0:
+                log.debug(f'{path} is gone before it settled')
+                del self._pending[path]
+            elif current_size != size:
+                self._pending[path] = (now, current_size)
+            else:
+                settled.append(path)
+                del self._pending[path]
+
+        return settled
+
+    def batches(self, should_stop: Optional[Callable[[], bool]] = None) -> Iterator[List[str]]:
+        """Yields lists of settled files until `should_stop` returns True."""
+        while should_stop is None or not should_stop():
+            timeout = min(self.settle, 1.0) if self._pending else 1.0
+
+            for path in self._changes(timeout):
+                if self.is_wanted(path):
+                    self._pending[path] = (timeit.default_timer(), self._size(path))
+
+            settled = self._take_settled()
+            if settled:
+                yield sorted(settled)
+
+
+class InotifyWatcher(FileWatcher):
+    """Gets notified by the kernel about files closed after writing or moved in, Linux only."""
+
+    def __init__(self, root: str, is_wanted: Callable[[str], bool], settle: float = 10.0):
+        super().__init__(root, is_wanted, settle)
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        # watch descriptor -> directory
+        self._dirs: Dict[int, str] = {}
+
+        try:
+            self._watch_tree(root)
+        except BaseException:
+            self.close()
+            raise
+
+        log.info(f'Watching {len(self._dirs)} directories under {root} using inotify')
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _watch(self, dir: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir), INOTIFY_WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, f'unable to watch {dir}: {os.strerror(code)}'
+                                + (' (consider raising fs.inotify.max_user_watches)' if code == errno.ENOSPC else ''))
+        self._dirs[wd] = dir
+
+    def _watch_tree(self, root: str) -> List[str]:
+        """Watches the directory with all its subdirectories, returns files already inside."""
+        files = []
+
+        for dir, _, names in os.walk(root):
+            self._watch(dir)
+            files.extend(os.path.join(dir, name) for name in names)
+
+        return files
+
+    def _read_events(self) -> Iterator[Tuple[int, int, str]]:
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, size = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset + size].rstrip(b'\0'))
+                offset += size
+                yield wd, mask, name
+
+    def _changes(self, timeout: float) -> Iterable[str]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        changed = []
+
+        for wd, mask, name in self._read_events():
+            if mask & IN_Q_OVERFLOW:
+                log.warning(f'inotify queue overflowed, checking all the files under {self.root}')
+                changed.extend(os.path.join(dir, name) for dir, _, names in os.walk(self.root) for name in names)
+                continue
+
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+
+            dir = self._dirs.get(wd)
+            if dir is None:
+                continue
+
+            path = os.path.join(dir, name)
+
+            if mask & IN_ISDIR:
+                # files may have been put into the new directory before it got watched
+                try:
+                    changed.extend(self._watch_tree(path))
+                except OSError as e:
+                    log.warning(f'unable to watch {path}: {e}')
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changed.append(path)
+
+        return changed
+
+
+class PollingWatcher(FileWatcher):
+    """Finds changed files by comparing sizes and modification times of all the files every `interval` seconds."""
+
+    def __init__(self, root: str, is_wanted: Callable[[str], bool], settle: float = 10.0, interval: float = 30.0):
+        super().__init__(root, is_wanted, settle)
+        self.interval = interval
+        self._files = self._snapshot()
+        self._scanned_at = timeit.default_timer()
+
+        log.info(f'Watching {root} by listing it every {interval:.0f} sec')
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+
+        for dir, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dir, name)
+                if not self.is_wanted(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_size, stat.st_mtime_ns)
+
+        return files
+
+    def _changes(self, timeout: float) -> Iterable[str]:
+        wait = self._scanned_at + self.interval - timeit.default_timer()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+
+        if wait > 0:
+            time.sleep(wait)
+
+        previous, self._files = self._files, self._snapshot()
+        self._scanned_at = timeit.default_timer()
+
+        return [path for path, state in self._files.items() if previous.get(path) != state]
+
+
+def create_watcher(
+        root: str,
+        is_wanted: Callable[[str], bool],
+        settle: float = 10.0,
+        poll_interval: float = 30.0,
+) -> FileWatcher:
+    """Watches using inotify when possible, falls back to listing the directory periodically."""
+    try:
+        return InotifyWatcher(root, is_wanted, settle)
+    except (OSError, AttributeError) as e:
+        # AttributeError -- libc without inotify (not Linux)
+        log.warning(f'unable to use inotify ({e}), falling back to polling')
+        return PollingWatcher(root, is_wanted, settle, poll_interval)
@@ -1,9 +1,12 @@
 import logging
 import os
 import tempfile
+import threading
+import time
 import unittest
+from datetime import datetime
 
-from youtube_uploader.cache import YamlYoutubeCache
+from youtube_uploader.cache import CHECKPOINT_SLOWDOWN, YamlYoutubeCache, SqliteYoutubeCache
 from youtube_uploader.model import PlaylistVideosResponse, Video
 
 log = logging.getLogger(__name__)
@@ -39,8 +42,149 @@ class YamlYoutubeCacheTest(unittest.TestCase):
         self.assertEqual('Text 2 ' * 10, cache.get('test', 'text2'))
 
 
+class YamlYoutubeCacheCheckpointTest(unittest.TestCase):
+    """Periodic checkpoints and atomicity of YamlYoutubeCache flushes."""
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.yaml')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_updates_are_checkpointed_without_explicit_flush(self):
+        cache = YamlYoutubeCache(self.path, checkpoint_interval=0.01)
+        cache.read_from_disk()
+        cache.update('test', 'a', 1)
+        time.sleep(0.02)
+        cache.update('test', 'b', 2)
+
+        # simulate the process being killed -- no flush is called
+        restored = YamlYoutubeCache(self.path)
+        restored.read_from_disk()
+        self.assertEqual(1, restored.get('test', 'a'))
+        self.assertEqual(2, restored.get('test', 'b'))
+
+    def test_slow_checkpoints_are_made_rarer(self):
+        cache = YamlYoutubeCache(self.path, checkpoint_interval=0.01)
+        cache.read_from_disk()
+        cache.flush = lambda: time.sleep(0.01)
+
+        cache.update('test', 'a', 1)
+        time.sleep(0.02)
+        cache.update('test', 'b', 2)
+
+        self.assertGreaterEqual(cache._checkpoint_delay, 0.01 * CHECKPOINT_SLOWDOWN)
+
+    def test_no_checkpoints_without_interval(self):
+        cache = YamlYoutubeCache(self.path)
+        cache.read_from_disk()
+        cache.update('test', 'a', 1)
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_flush_without_changes_keeps_file_untouched(self):
+        with YamlYoutubeCache(self.path) as cache:
+            cache.update('test', 'a', 1)
+
+        mtime = os.stat(self.path).st_mtime_ns
+
+        with YamlYoutubeCache(self.path) as cache:
+            self.assertEqual(1, cache.get('test', 'a'))
+
+        self.assertEqual(mtime, os.stat(self.path).st_mtime_ns)
+
+    def test_failed_flush_keeps_previous_cache(self):
+        with YamlYoutubeCache(self.path) as cache:
+            cache.update('test', 'a', 1)
+
+        cache = YamlYoutubeCache(self.path)
+        cache.read_from_disk()
+        cache.update('test', 'b', threading.Lock())  # can not be serialized
+        with self.assertRaises(Exception):
+            cache.flush()
+
+        restored = YamlYoutubeCache(self.path)
+        restored.read_from_disk()
+        self.assertEqual(1, restored.get('test', 'a'))
+
+
+class YamlYoutubeCacheSharedTest(unittest.TestCase):
+    """Several YamlYoutubeCache instances sharing the same file."""
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.yaml')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_concurrent_updates_are_merged(self):
+        first = YamlYoutubeCache(self.path, shared=True)
+        second = YamlYoutubeCache(self.path, shared=True)
+        first.read_from_disk()
+        second.read_from_disk()
+
+        first.update('hashes', 'a', 1)
+        second.update('hashes', 'b', 2)
+        first.flush()
+        second.flush()
+
+        restored = YamlYoutubeCache(self.path)
+        restored.read_from_disk()
+        self.assertEqual(1, restored.get('hashes', 'a'))
+        self.assertEqual(2, restored.get('hashes', 'b'))
+
+    def test_entries_of_a_section_written_by_several_processes(self):
+        first = YamlYoutubeCache(self.path, shared=True)
+        second = YamlYoutubeCache(self.path, shared=True)
+        first.read_from_disk()
+        second.read_from_disk()
+
+        first.update('queue', 'a', 1)
+        first.update('queue', 'gone', 3)
+        first.flush()
+        second.update('queue', 'b', 2)
+        second.flush()
+        first.update('queue', 'gone', None)
+        first.flush()
+
+        restored = YamlYoutubeCache(self.path)
+        restored.read_from_disk()
+        self.assertEqual({'a': 1, 'b': 2}, restored.entries('queue'))
+        self.assertEqual({}, restored.entries('missing'))
+
+    def test_flush_makes_entries_of_other_processes_visible(self):
+        first = YamlYoutubeCache(self.path, shared=True)
+        second = YamlYoutubeCache(self.path, shared=True)
+        first.read_from_disk()
+        second.read_from_disk()
+
+        first.update('hashes', 'a', 1)
+        first.flush()
+        second.update('hashes', 'b', 2)
+        second.flush()
+
+        self.assertEqual(1, second.get('hashes', 'a'))
+
+    def test_own_changes_win_for_the_same_key(self):
+        first = YamlYoutubeCache(self.path, shared=True)
+        second = YamlYoutubeCache(self.path, shared=True)
+        first.read_from_disk()
+        second.read_from_disk()
+
+        first.update('hashes', 'a', 1)
+        first.flush()
+        second.update('hashes', 'a', 2)
+        second.flush()
+
+        restored = YamlYoutubeCache(self.path)
+        restored.read_from_disk()
+        self.assertEqual(2, restored.get('hashes', 'a'))
+
+
 class YamlYoutubeCacheSerializationTest(unittest.TestCase):
-    """Verify that model objects survive a cache round-trip."""
+    """Verify that cached plain data survives a round-trip and objects are never constructed."""
 
     def _temp_path(self):
         f = tempfile.NamedTemporaryFile(delete=False)
@@ -48,25 +192,118 @@ class YamlYoutubeCacheSerializationTest(unittest.TestCase):
         log.info('temp path: %s', f.name)
         return f.name
 
-    def test_playlist_videos_response_round_trip(self):
+    def test_video_data_round_trip(self):
         path = self._temp_path()
         cache = YamlYoutubeCache(path)
 
-        cache.update(
-            'section',
-            'key',
-            PlaylistVideosResponse([
-                Video('id1', 'title1', 'description1'),
-                Video('id2', 'title2', 'description2'),
-            ])
-        )
+        cache.update('section', 'key', {
+            'videos': [
+                Video('id1', 'title1', md5='a' * 32, size='1.00 MiB').to_data(),
+                Video('id2', 'title2').to_data(),
+            ],
+            'cached_at': datetime(2020, 1, 2, 3, 4, 5),
+        })
         cache.flush()
 
         cache2 = YamlYoutubeCache(path)
         cache2.read_from_disk()
 
         restored = cache2.get('section', 'key')
+        videos = [Video.from_data(data) for data in restored['videos']]
+
+        self.assertEqual(['id1', 'id2'], [video.videoId for video in videos])
+        self.assertEqual('a' * 32, videos[0].md5)
+        self.assertEqual(datetime(2020, 1, 2, 3, 4, 5), restored['cached_at'])
+
+    def test_python_objects_written_by_older_versions_are_ignored(self):
+        path = self._temp_path()
+        with open(path, 'w') as file:
+            file.write('playlists:\n'
+                       '  PL1:\n'
+                       '    data: !!python/object:youtube_uploader.model.PlaylistVideosResponse\n'
+                       '      videos: []\n'
+                       '    version: v1\n'
+                       'file-hashes-v1:\n'
+                       '  /a.mp4: {md5: abc}\n')
+
+        cache = YamlYoutubeCache(path)
+        cache.read_from_disk()
+
+        self.assertIsNone(cache.get('playlists', 'PL1')['data'])
+        self.assertEqual({'md5': 'abc'}, cache.get('file-hashes-v1', '/a.mp4'))
+
+
+class SqliteYoutubeCacheTest(unittest.TestCase):
+    """Point lookups, flushing and YAML import of SqliteYoutubeCache."""
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.sqlite')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_values_survive_flush_and_reopen(self):
+        with SqliteYoutubeCache(self.path) as cache:
+            cache.update('test', 'text1', 'Text 1')
+            cache.update('test', 'video', {'videos': [Video('id1', 'title1').to_data()], 'cached_at': datetime.now()})
+
+        with SqliteYoutubeCache(self.path) as cache:
+            self.assertEqual('Text 1', cache.get('test', 'text1'))
+            self.assertEqual('id1', cache.get('test', 'video')['videos'][0][0])
+            self.assertIsNone(cache.get('test', 'missing'))
+            self.assertIsNone(cache.get('missing', 'text1'))
+
+    def test_python_objects_written_by_older_versions_are_ignored(self):
+        with SqliteYoutubeCache(self.path) as cache:
+            cache.update('test', 'text', 'Text')
+            cache.update('test', 'object', PlaylistVideosResponse([]))
+
+        with SqliteYoutubeCache(self.path) as cache:
+            self.assertEqual('Text', cache.get('test', 'text'))
+            self.assertIsNone(cache.get('test', 'object'))
+
+    def test_entries_include_unflushed_updates(self):
+        with SqliteYoutubeCache(self.path) as cache:
+            cache.update('queue', 'a', 1)
+            cache.update('queue', 'gone', 3)
+            cache.update('other', 'c', 4)
+
+        with SqliteYoutubeCache(self.path) as cache:
+            cache.update('queue', 'b', 2)
+            cache.update('queue', 'gone', None)
+            self.assertEqual({'a': 1, 'b': 2}, cache.entries('queue'))
+
+    def test_unflushed_updates_are_visible(self):
+        cache = SqliteYoutubeCache(self.path)
+        cache.update('test', 'key', 1)
+        self.assertEqual(1, cache.get('test', 'key'))
+
+    def test_flush_only_writes_changed_entries(self):
+        with SqliteYoutubeCache(self.path) as cache:
+            cache.update('test', 'a', 1)
+            cache.update('test', 'b', 2)
+
+        # entry changed by another writer must not be overwritten by a stale value
+        with SqliteYoutubeCache(self.path) as other:
+            other.update('test', 'a', 10)
+
+        with SqliteYoutubeCache(self.path) as cache:
+            cache.update('test', 'b', 20)
+
+        with SqliteYoutubeCache(self.path) as cache:
+            self.assertEqual(10, cache.get('test', 'a'))
+            self.assertEqual(20, cache.get('test', 'b'))
+
+    def test_import_from_yaml(self):
+        yaml_path = os.path.join(self.dir.name, 'cache.yaml')
+        with YamlYoutubeCache(yaml_path) as yaml_cache:
+            yaml_cache.update('file-hashes-v1', '/a.mp4', {'md5': 'abc'})
+            yaml_cache.update('playlists', 'PL1', {'etag': 'e1'})
 
-        self.assertIsInstance(restored, PlaylistVideosResponse)
-        self.assertEqual(2, len(restored.videos))
+        with SqliteYoutubeCache(self.path) as cache:
+            self.assertEqual(2, cache.import_from_yaml(yaml_path))
 
+        with SqliteYoutubeCache(self.path) as cache:
+            self.assertEqual({'md5': 'abc'}, cache.get('file-hashes-v1', '/a.mp4'))
+            self.assertEqual({'etag': 'e1'}, cache.get('playlists', 'PL1'))
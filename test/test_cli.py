@@ -0,0 +1,101 @@
+import unittest
+from typing import Dict, List, Optional
+
+from youtube_uploader.cli import find_already_uploaded
+from youtube_uploader.model import Video, VideoIndex
+
+
+class FakeClient(object):
+    """Stands in for the client, files are known by their path only."""
+
+    def __init__(self, hashes: Dict[str, str], cached: Optional[Dict[str, str]] = None):
+        self.hashes = hashes
+        self.cached = cached or {}
+        self.hashed: List[str] = []
+
+    def file_metadata_key(self, path: str) -> str:
+        return f'{path}|meta'
+
+    def file_hash(self, path: str) -> str:
+        self.hashed.append(path)
+        return self.hashes[path]
+
+    def cached_file_hash(self, path: str) -> Optional[str]:
+        return self.cached.get(path)
+
+
+class FindAlreadyUploadedTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.uploaded = Video('video1', 'a', md5='a' * 32)
+        self.index = VideoIndex()
+        self.index.add(self.uploaded, 'a' * 32, 'a.mp4|meta', '1.00 MiB')
+
+    def test_off_finds_uploaded_file_by_md5(self):
+        client = FakeClient({'a.mp4': 'a' * 32, 'b.mp4': 'b' * 32})
+
+        self.assertIs(self.uploaded, find_already_uploaded(client, self.index, 'a.mp4'))
+        self.assertIsNone(find_already_uploaded(client, self.index, 'b.mp4'))
+        self.assertEqual(['a.mp4', 'b.mp4'], client.hashed)
+
+    def test_off_ignores_matching_metadata(self):
+        # e.g. the file was replaced keeping its name, size and mtime
+        client = FakeClient({'a.mp4': 'c' * 32})
+
+        self.assertIsNone(find_already_uploaded(client, self.index, 'a.mp4', 'off'))
+
+    def test_trust_takes_matching_metadata_without_hashing(self):
+        client = FakeClient({'a.mp4': 'c' * 32})
+
+        self.assertIs(self.uploaded, find_already_uploaded(client, self.index, 'a.mp4', 'trust'))
+        self.assertEqual([], client.hashed)
+
+    def test_trust_hashes_files_without_matching_metadata(self):
+        client = FakeClient({'copy.mp4': 'a' * 32})
+
+        self.assertIs(self.uploaded, find_already_uploaded(client, self.index, 'copy.mp4', 'trust'))
+        self.assertEqual(['copy.mp4'], client.hashed)
+
+    def test_confirm_checks_md5_of_matching_metadata(self):
+        client = FakeClient({'a.mp4': 'c' * 32})
+        self.assertIsNone(find_already_uploaded(client, self.index, 'a.mp4', 'confirm'))
+
+        client = FakeClient({'a.mp4': 'a' * 32})
+        self.assertIs(self.uploaded, find_already_uploaded(client, self.index, 'a.mp4', 'confirm'))
+        self.assertEqual(['a.mp4'], client.hashed)
+
+    def test_hash_while_upload_uses_only_known_hash_of_new_files(self):
+        client = FakeClient({'new.mp4': 'n' * 32, 'copy.mp4': 'a' * 32}, cached={'copy.mp4': 'a' * 32})
+
+        self.assertIsNone(find_already_uploaded(client, self.index, 'new.mp4', hash_while_upload=True))
+        self.assertIs(self.uploaded, find_already_uploaded(client, self.index, 'copy.mp4', hash_while_upload=True))
+        self.assertEqual([], client.hashed)
+
+    def test_hash_while_upload_confirms_matching_metadata(self):
+        client = FakeClient({'a.mp4': 'a' * 32})
+
+        self.assertIs(self.uploaded, find_already_uploaded(client, self.index, 'a.mp4', hash_while_upload=True))
+        self.assertEqual(['a.mp4'], client.hashed)
+
+    def test_file_without_size_candidate_is_not_hashed(self):
+        client = FakeClient({'b.mp4': 'b' * 32})
+
+        found = find_already_uploaded(client, self.index, 'b.mp4', needs_md5=lambda path: False)
+
+        self.assertIsNone(found)
+        self.assertEqual([], client.hashed)
+
+    def test_file_with_size_candidate_is_hashed(self):
+        client = FakeClient({'copy.mp4': 'a' * 32})
+
+        found = find_already_uploaded(client, self.index, 'copy.mp4', 'confirm', needs_md5=lambda path: True)
+
+        self.assertIs(self.uploaded, found)
+        self.assertEqual(['copy.mp4'], client.hashed)
+
+    def test_matching_metadata_is_confirmed_even_without_size_candidate(self):
+        client = FakeClient({'a.mp4': 'a' * 32})
+
+        found = find_already_uploaded(client, self.index, 'a.mp4', 'confirm', needs_md5=lambda path: False)
+
+        self.assertIs(self.uploaded, found)
+        self.assertEqual(['a.mp4'], client.hashed)
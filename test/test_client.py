@@ -1,7 +1,18 @@
+import io
+import json
+import os
+import tempfile
 import unittest
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
-from youtube_uploader.client import YouTubeClientImpl, SUPPORTED_VIDEO_EXTENSIONS
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaIoBaseUpload
+
+from youtube_uploader.cache import YamlYoutubeCache
+from youtube_uploader.client import YouTubeClientImpl, SUPPORTED_VIDEO_EXTENSIONS, resume_upload_request
+from youtube_uploader.model import Playlist
+from youtube_uploader.quota import CredentialSet, QuotaTracker, QuotaExceededException
 
 
 def make_client() -> YouTubeClientImpl:
@@ -42,3 +53,768 @@ class IsVideoTest(unittest.TestCase):
             with self.subTest(name=name):
                 self.assertFalse(self.client.is_video(name))
 
+
+class AuthenticatedServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.client = make_client()
+
+    def test_service_is_built_once_and_reused(self):
+        credentials = MagicMock()
+        credentials.access_token_expired = False
+
+        with patch.object(self.client, '_get_credentials', return_value=credentials) as get_credentials, \
+             patch('youtube_uploader.client.build') as build:
+            first = self.client._get_authenticated_service()
+            second = self.client._get_authenticated_service()
+
+        self.assertIs(first, second)
+        get_credentials.assert_called_once()
+        build.assert_called_once()
+        credentials.refresh.assert_not_called()
+
+    def test_expired_token_is_refreshed_in_place(self):
+        credentials = MagicMock()
+        credentials.access_token_expired = False
+
+        with patch.object(self.client, '_get_credentials', return_value=credentials), \
+             patch('youtube_uploader.client.build'):
+            self.client._get_authenticated_service()
+            credentials.access_token_expired = True
+            self.client._get_authenticated_service()
+
+        http, _ = self.client._local.services[self.client.projects[0]]
+        credentials.refresh.assert_called_once_with(http)
+
+    def test_http_does_not_follow_308_of_resumable_uploads(self):
+        credentials = MagicMock()
+        credentials.authorize.side_effect = lambda http: http
+
+        with patch.object(self.client, '_get_credentials', return_value=credentials), \
+             patch('youtube_uploader.client.build'):
+            self.client._get_authenticated_service()
+
+        http, _ = self.client._local.services[self.client.projects[0]]
+        self.assertIsInstance(http, httplib2.Http)
+        self.assertNotIn(308, http.redirect_codes)
+        self.assertIn(301, http.redirect_codes)
+
+
+def playlist_items_page(items, nextPageToken=None, etag='items-etag') -> dict:
+    page = {'etag': etag, 'items': [
+        {'id': videoId, 'snippet': {'title': title, 'description': description}}
+        for videoId, title, description in items
+    ]}
+    if nextPageToken:
+        page['nextPageToken'] = nextPageToken
+    return page
+
+
+class VideoIndexTest(unittest.TestCase):
+    md5_a = 'a' * 32
+    md5_b = 'b' * 32
+
+    def setUp(self):
+        self.client = make_client()
+        self.dir = tempfile.TemporaryDirectory()
+        self.client._cache = YamlYoutubeCache(os.path.join(self.dir.name, 'cache.yaml'))
+        self.client._cache.read_from_disk()
+
+        self.youtube = MagicMock()
+        self.client._get_authenticated_service = MagicMock(return_value=self.youtube)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_build_video_index_parses_md5_line(self):
+        videos = [
+            self.client.parse_video('id1', 'a', f'File name: a.mp4\nDir: /videos\nCreated at: 2020-01-02T03:04:05\n'
+                                                f'Modified at: 2020-01-02T03:04:05\nSize: 1.50 MiB\nMD5: {self.md5_a}\n[auto uploaded]'),
+            self.client.parse_video('id2', 'b', f'some text\nMD5: {self.md5_b}'),
+            self.client.parse_video('id3', 'manual', 'uploaded manually'),
+            self.client.parse_video('id4', 'empty', None),
+        ]
+
+        index = self.client.build_video_index(videos)
+
+        self.assertEqual(2, len(index))
+        self.assertEqual('id1', index.find_by_metadata('a.mp4|1.50 MiB|2020-01-02T03:04:05').videoId)
+        self.assertEqual('id1', index.find_by_md5(self.md5_a).videoId)
+        self.assertEqual('id2', index.find_by_md5(self.md5_b).videoId)
+        self.assertIsNone(index.find_by_md5('c' * 32))
+
+    def test_playlist_index_is_cached_by_etag(self):
+        self.youtube.playlistItems().list().execute.side_effect = [
+            playlist_items_page([('id1', 'a', f'MD5: {self.md5_a}')], nextPageToken='p2'),
+            playlist_items_page([('id2', 'b', f'MD5: {self.md5_b}')]),
+        ]
+
+        index = self.client.get_playlist_video_index('PL1', etag='etag1')
+        cached_index = self.client.get_playlist_video_index('PL1', etag='etag1')
+
+        self.assertEqual('id2', index.find_by_md5(self.md5_b).videoId)
+        self.assertEqual('id2', cached_index.find_by_md5(self.md5_b).videoId)
+        # only the parsed fields are cached, not the descriptions
+        self.assertEqual([[['id1', 'a', self.md5_a, None, None, None]], [['id2', 'b', self.md5_b, None, None, None]]],
+                         [page['videos'] for page in self.client._cache.get('playlists', 'PL1')['pages']])
+        self.assertEqual(2, self.youtube.playlistItems().list().execute.call_count)
+
+    def test_local_file_metadata_key_matches_generated_description(self):
+        path = os.path.join(self.dir.name, 'clip.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 3 * 1024 * 1024)
+
+        self.client._hasher = MagicMock()
+        self.client._hasher.md5.return_value = self.md5_a
+        description = self.client._generate_metadata(path)
+
+        index = self.client.build_video_index([self.client.parse_video('id1', 'clip', description)])
+
+        self.assertEqual('id1', index.find_by_metadata(self.client.file_metadata_key(path)).videoId)
+        self.assertEqual('id1', index.find_by_md5(self.md5_a).videoId)
+        self.assertTrue(index.has_size_candidate(self.client.file_size_key(path)))
+        self.assertFalse(index.has_size_candidate('3.01 MiB'))
+
+    def test_videos_without_size_are_candidates_for_any_size(self):
+        index = self.client.build_video_index([
+            self.client.parse_video('id1', 'a', f'Size: 1.50 MiB\nMD5: {self.md5_a}'),
+            self.client.parse_video('id2', 'manual', 'Size: 2.00 MiB'),
+        ])
+
+        self.assertTrue(index.has_size_candidate('1.50 MiB'))
+        self.assertFalse(index.has_size_candidate('2.00 MiB'))
+
+        index.update(self.client.build_video_index([self.client.parse_video('id3', 'b', f'MD5: {self.md5_b}')]))
+
+        self.assertTrue(index.has_size_candidate('2.00 MiB'))
+
+    def test_unchanged_playlist_items_are_revalidated_conditionally(self):
+        execute = self.youtube.playlistItems().list().execute
+        execute.side_effect = [
+            playlist_items_page([('id1', 'a', f'MD5: {self.md5_a}')], etag='items1'),
+            HttpError(httplib2.Response({'status': 304}), b''),
+        ]
+
+        self.client.get_playlist_video_index('PL1', etag='etag1')
+        # e.g. playlist title was changed, but not its items
+        index = self.client.get_playlist_video_index('PL1', etag='etag2')
+
+        self.assertEqual('id1', index.find_by_md5(self.md5_a).videoId)
+        self.assertEqual('items1', self.youtube.playlistItems().list().headers.__setitem__.call_args[0][1])
+        self.assertEqual('etag2', self.client._cache.get('playlists', 'PL1')['etag'])
+
+    def test_every_page_of_playlist_items_is_revalidated(self):
+        execute = self.youtube.playlistItems().list().execute
+        execute.side_effect = [
+            playlist_items_page([('id1', 'a', f'MD5: {self.md5_a}')], nextPageToken='p2', etag='items1'),
+            playlist_items_page([('id2', 'b', 'MD5: pending')], etag='items2'),
+            HttpError(httplib2.Response({'status': 304}), b''),
+            # e.g. MD5 filled in after the upload
+            playlist_items_page([('id2', 'b', f'MD5: {self.md5_b}')], etag='items3'),
+        ]
+
+        self.client.get_playlist_video_index('PL1', etag='etag1')
+        index = self.client.get_playlist_video_index('PL1', etag='etag2')
+
+        self.assertEqual('id1', index.find_by_md5(self.md5_a).videoId)
+        self.assertEqual('id2', index.find_by_md5(self.md5_b).videoId)
+        self.assertEqual(['items1', 'items2'], [
+            call.args[1] for call in self.youtube.playlistItems().list().headers.__setitem__.call_args_list])
+
+    def test_unchanged_playlists_are_revalidated_conditionally(self):
+        execute = self.youtube.playlists().list().execute
+        execute.side_effect = [
+            {'etag': 'mine1', 'items': [
+                {'id': 'PL1', 'etag': 'etag1', 'snippet': {'title': 'title1', 'description': ''}},
+            ]},
+            HttpError(httplib2.Response({'status': 304}), b''),
+        ]
+
+        self.client.get_my_playlists()
+        playlists = self.client.get_my_playlists()
+
+        self.assertEqual(['PL1'], [playlist.playlistId for playlist in playlists.playlists])
+        self.assertEqual('mine1', self.youtube.playlists().list().headers.__setitem__.call_args[0][1])
+        self.assertIn(50, [call.kwargs.get('maxResults') for call in self.youtube.playlists().list.call_args_list])
+        self.assertEqual(2, execute.call_count)
+
+    def test_playlist_indices_are_fetched_for_all_playlists(self):
+        self.youtube.playlistItems().list().execute.side_effect = lambda: playlist_items_page([])
+
+        indices = self.client.get_playlist_video_indices(
+            [Playlist(f'PL{i}', f'title{i}', etag=f'etag{i}') for i in range(5)], concurrency=3)
+
+        self.assertEqual({f'PL{i}' for i in range(5)}, set(indices.keys()))
+
+
+class FakeBatch(object):
+    """Stands in for BatchHttpRequest, fails the items listed in `failing`."""
+
+    def __init__(self, callback, failing, error: Exception = None):
+        self.callback = callback
+        self.failing = failing
+        self.error = error or Exception('boom')
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append(request_id)
+
+    def execute(self):
+        for request_id in self.requests:
+            if request_id in self.failing:
+                self.callback(request_id, None, self.error)
+            else:
+                self.callback(request_id, {'id': f'item{request_id}'}, None)
+
+
+class BatchCallsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = make_client()
+        self.youtube = MagicMock()
+        self.client._get_authenticated_service = MagicMock(return_value=self.youtube)
+
+    def test_playlist_etags_are_requested_in_chunks_of_50(self):
+        ids = [f'PL{i}' for i in range(120)]
+        self.youtube.playlists().list.reset_mock()
+        self.youtube.playlists().list().execute.side_effect = [
+            {'items': [{'id': i, 'etag': f'etag-{i}'} for i in ids[:50]]},
+            {'items': [{'id': i, 'etag': f'etag-{i}'} for i in ids[50:100]]},
+            {'items': [{'id': i, 'etag': f'etag-{i}'} for i in ids[100:119]]},  # last one is gone
+        ]
+
+        results = self.client.get_playlist_etags(ids)
+
+        self.assertEqual(3, self.youtube.playlists().list().execute.call_count)
+        self.assertEqual('etag-PL0', results['PL0'].result)
+        self.assertEqual('etag-PL118', results['PL118'].result)
+        self.assertIsNone(results['PL118'].error)
+        self.assertIsNotNone(results['PL119'].error)
+
+    def test_add_videos_to_playlist_reports_per_item_results(self):
+        self.youtube.new_batch_http_request.side_effect = \
+            lambda callback: FakeBatch(callback, failing={'1'})
+
+        results = self.client.add_videos_to_playlist('PL1', ['v0', 'v1', 'v2'])
+
+        self.assertIsNone(results['v0'].error)
+        self.assertIsNotNone(results['v1'].error)
+        self.assertIsNone(results['v2'].error)
+        self.youtube.new_batch_http_request.assert_called_once()
+
+    def test_queued_playlist_adds_are_saved_right_away_and_kept_until_added(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'cache.yaml')
+            self.client._cache = YamlYoutubeCache(path)
+            self.client._cache.read_from_disk()
+
+            for videoId in ['v0', 'v1', 'v2']:
+                self.client.queue_playlist_add('PL1', videoId)
+
+            # e.g. the process is killed before the videos are added
+            restarted = make_client()
+            restarted._cache = YamlYoutubeCache(path)
+            restarted._cache.read_from_disk()
+            self.assertEqual({'PL1': ['v0', 'v1', 'v2']}, restarted.queued_playlist_adds())
+
+            self.youtube.new_batch_http_request.side_effect = \
+                lambda callback: FakeBatch(callback, failing={'1'})
+
+            self.client.add_queued_videos_to_playlist('PL1')
+
+            self.assertEqual({'PL1': ['v1']}, self.client.queued_playlist_adds())
+
+    def test_videos_queued_by_previous_run_are_checked_before_adding(self):
+        with tempfile.TemporaryDirectory() as dir:
+            self.client._cache = YamlYoutubeCache(os.path.join(dir, 'cache.yaml'))
+            self.client._cache.read_from_disk()
+
+            # the previous run may have been killed right after adding v0
+            previous = make_client()
+            previous._cache = self.client._cache
+            previous.queue_playlist_add('PL1', 'v0')
+            previous.queue_playlist_add('PL1', 'v1')
+            self.client.queue_playlist_add('PL1', 'v2')
+
+            checked = []
+
+            def list_items(part, playlistId, videoId, maxResults):
+                checked.append(videoId)
+                request = MagicMock()
+                request.execute.return_value = {'items': [{'id': 'item0'}] if videoId == 'v0' else []}
+                return request
+
+            self.youtube.playlistItems().list.side_effect = list_items
+
+            batches = []
+
+            def new_batch(callback):
+                batches.append(FakeBatch(callback, failing=set()))
+                return batches[-1]
+
+            self.youtube.new_batch_http_request.side_effect = new_batch
+
+            results = self.client.add_queued_videos_to_playlist('PL1')
+
+            self.assertEqual(['v0', 'v1'], checked)
+            self.assertEqual([['0', '1']], [batch.requests for batch in batches])
+            self.assertTrue(all(result.error is None for result in results.values()))
+            self.assertEqual({}, self.client.queued_playlist_adds())
+
+    def test_playlist_adds_queued_by_processes_sharing_the_cache_are_all_kept(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'cache.yaml')
+            first, second = make_client(), make_client()
+            first._cache = YamlYoutubeCache(path, shared=True)
+            second._cache = YamlYoutubeCache(path, shared=True)
+            first._cache.read_from_disk()
+            second._cache.read_from_disk()
+
+            first.queue_playlist_add('PL1', 'vA')
+            second.queue_playlist_add('PL1', 'vB')
+
+            restarted = make_client()
+            restarted._cache = YamlYoutubeCache(path)
+            restarted._cache.read_from_disk()
+            self.assertEqual({'PL1': ['vA', 'vB']}, restarted.queued_playlist_adds())
+
+
+class ResumableUploadSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.client = make_client()
+        self.dir = tempfile.TemporaryDirectory()
+        self.client._cache = YamlYoutubeCache(os.path.join(self.dir.name, 'cache.yaml'))
+        self.client._cache.read_from_disk()
+        self.client._hasher = MagicMock()
+        self.client._hasher.md5.return_value = 'a' * 32
+
+        self.youtube = MagicMock()
+        self.client._get_authenticated_service = MagicMock(return_value=self.youtube)
+
+        self.path = os.path.join(self.dir.name, 'clip.mp4')
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 1024)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _save_session(self, uri='https://upload/session', progress=512):
+        stat = os.stat(self.path)
+        self.client._cache.update('upload-sessions-v1', self.path, {
+            'uri': uri, 'progress': progress, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+
+    def test_progress_is_persisted_and_dropped_after_success(self):
+        request = MagicMock()
+        request.resumable_uri = 'https://upload/session'
+        request.resumable_progress = 256
+        progress = MagicMock()
+        progress.progress.return_value = 0.25
+        saved = []
+
+        def next_chunk():
+            if not saved:
+                saved.append(True)
+                return progress, None
+            # session is in the cache while the upload is in progress
+            self.assertEqual(256, self.client._cache.get('upload-sessions-v1', self.path)['progress'])
+            return None, {'id': 'video1'}
+
+        request.next_chunk.side_effect = next_chunk
+        self.youtube.videos().insert.return_value = request
+
+        response = self.client.upload_video(self.path, 'clip')
+
+        self.assertEqual('video1', response.videoId)
+        self.assertIsNone(self.client._cache.get('upload-sessions-v1', self.path))
+
+    def test_upload_is_resumed_from_saved_session(self):
+        self._save_session()
+        request = MagicMock()
+        request.next_chunk.return_value = (None, {'id': 'video1'})
+        self.youtube.videos().insert.return_value = request
+
+        self.client.upload_video(self.path, 'clip')
+
+        self.assertEqual('https://upload/session', request.resumable_uri)
+        self.assertEqual(512, request.resumable_progress)
+        self.assertTrue(request._in_error_state)
+
+    def test_resumed_request_asks_server_for_received_bytes_first(self):
+        # the real googleapiclient request, resume_upload_request relies on its internals
+        sent = []
+
+        class RecordingHttp(object):
+            def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+                sent.append((method, dict(headers or {})))
+                if len(sent) == 1:
+                    return httplib2.Response({'status': '308', 'range': 'bytes=0-511'}), b''
+                return httplib2.Response({'status': '200'}), b'{"id": "video1"}'
+
+        media = MediaIoBaseUpload(io.BytesIO(b'x' * 1024), 'video/mp4', chunksize=256 * 1024, resumable=True)
+        request = HttpRequest(RecordingHttp(), lambda resp, content: json.loads(content),
+                              'https://upload/start', method='POST', resumable=media)
+
+        resume_upload_request(request, 'https://upload/session', 0)
+        _, response = request.next_chunk()
+
+        self.assertEqual({'id': 'video1'}, response)
+        self.assertEqual(('PUT', {'Content-Range': 'bytes */1024', 'content-length': '0'}), sent[0])
+        self.assertEqual('bytes 512-1023/1024', sent[1][1]['Content-Range'])
+
+    def test_expired_session_starts_over(self):
+        self._save_session()
+        expired = MagicMock()
+        expired.next_chunk.side_effect = HttpError(httplib2.Response({'status': 404}), b'')
+        fresh = MagicMock()
+        fresh.resumable_uri = None
+        fresh.next_chunk.return_value = (None, {'id': 'video1'})
+        self.youtube.videos().insert.side_effect = [expired, fresh]
+
+        response = self.client.upload_video(self.path, 'clip')
+
+        self.assertEqual('video1', response.videoId)
+        self.assertFalse(isinstance(fresh._in_error_state, bool))  # was never touched
+
+    def test_session_of_changed_file_is_discarded(self):
+        self._save_session()
+        with open(self.path, 'ab') as f:
+            f.write(b'more')
+        request = MagicMock()
+        request.next_chunk.return_value = (None, {'id': 'video1'})
+        self.youtube.videos().insert.return_value = request
+
+        self.client.upload_video(self.path, 'clip')
+
+        self.assertNotEqual('https://upload/session', request.resumable_uri)
+
+    def test_hash_while_upload_completes_description_with_md5(self):
+        self.client._hash_while_upload = True
+        self.client._hasher.cached_md5.return_value = None
+        request = MagicMock()
+        request.next_chunk.return_value = (None, {'id': 'video1'})
+        self.youtube.videos().insert.return_value = request
+        self.youtube.videos().list().execute.return_value = {
+            'items': [{'snippet': {'title': 'clip', 'description': 'old', 'categoryId': '22'}}]}
+
+        with patch('youtube_uploader.client.HashingMediaFileUpload') as media_class:
+            media_class.return_value.md5.return_value = 'b' * 32
+            self.client.upload_video(self.path, 'clip')
+
+        inserted = self.youtube.videos().insert.call_args.kwargs['body']['snippet']['description']
+        self.assertIn('MD5: pending', inserted)
+
+        updated = self.youtube.videos().update.call_args.kwargs['body']
+        self.assertEqual('video1', updated['id'])
+        self.assertIn(f'MD5: {"b" * 32}', updated['snippet']['description'])
+        self.client._hasher.md5.assert_not_called()
+        self.client._hasher.remember.assert_called_once()
+        self.assertEqual({}, self.client._cache.entries('pending-descriptions-v2'))
+
+    def test_failed_description_update_is_retried_later(self):
+        self.client._hash_while_upload = True
+        self.client._hasher.cached_md5.return_value = None
+        request = MagicMock()
+        request.next_chunk.return_value = (None, {'id': 'video1'})
+        self.youtube.videos().insert.return_value = request
+        self.youtube.videos().list().execute.side_effect = Exception('network is down')
+
+        with patch('youtube_uploader.client.HashingMediaFileUpload') as media_class:
+            media_class.return_value.md5.return_value = 'b' * 32
+            self.client.upload_video(self.path, 'clip')
+
+        self.assertIn('video1', self.client._cache.entries('pending-descriptions-v2'))
+
+        # saved even if the process is killed right after the upload
+        restarted = YamlYoutubeCache(self.client._cache.path)
+        restarted.read_from_disk()
+        self.assertIn('video1', restarted.entries('pending-descriptions-v2'))
+
+        self.youtube.videos().list().execute.side_effect = None
+        self.youtube.videos().list().execute.return_value = {'items': [{'snippet': {'description': ''}}]}
+        self.client.complete_pending_descriptions()
+
+        self.assertEqual({}, self.client._cache.entries('pending-descriptions-v2'))
+
+    def test_resumed_session_with_md5_placeholder_completes_the_description(self):
+        # started by a --hash-while-upload run, the file was hashed upfront since
+        stat = os.stat(self.path)
+        self.client._cache.update('upload-sessions-v1', self.path, {
+            'uri': 'https://upload/session', 'progress': 512, 'pending_md5': True,
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+        self.client._hasher.cached_md5.return_value = 'c' * 32
+        request = MagicMock()
+        request.next_chunk.return_value = (None, {'id': 'video1'})
+        self.youtube.videos().insert.return_value = request
+        self.youtube.videos().list().execute.return_value = {
+            'items': [{'snippet': {'title': 'clip', 'description': 'MD5: pending', 'categoryId': '22'}}]}
+
+        with patch('youtube_uploader.client.HashingMediaFileUpload') as media_class:
+            self.client.upload_video(self.path, 'clip')
+
+        media_class.assert_not_called()
+        updated = self.youtube.videos().update.call_args.kwargs['body']
+        self.assertEqual('video1', updated['id'])
+        self.assertIn(f'MD5: {"c" * 32}', updated['snippet']['description'])
+
+    def test_session_remembers_md5_placeholder(self):
+        self.client._hash_while_upload = True
+        self.client._hasher.cached_md5.return_value = None
+        request = MagicMock()
+        request.resumable_uri = 'https://upload/session'
+        request.resumable_progress = 256
+        saved = []
+
+        def next_chunk():
+            if not saved:
+                saved.append(True)
+                status = MagicMock()
+                status.progress.return_value = 0.25
+                return status, None
+            saved.append(dict(self.client._cache.get('upload-sessions-v1', self.path)))
+            return None, {'id': 'video1'}
+
+        request.next_chunk.side_effect = next_chunk
+        self.youtube.videos().insert.return_value = request
+        self.youtube.videos().list().execute.return_value = {'items': [{'snippet': {'description': ''}}]}
+
+        with patch('youtube_uploader.client.HashingMediaFileUpload') as media_class:
+            media_class.return_value.md5.return_value = 'b' * 32
+            self.client.upload_video(self.path, 'clip')
+
+        self.assertTrue(saved[1]['pending_md5'])
+
+    def test_pending_descriptions_of_processes_sharing_the_cache_are_all_kept(self):
+        path = os.path.join(self.dir.name, 'shared.yaml')
+        first, second = make_client(), make_client()
+        first._cache = YamlYoutubeCache(path, shared=True)
+        second._cache = YamlYoutubeCache(path, shared=True)
+        first._cache.read_from_disk()
+        second._cache.read_from_disk()
+
+        first._set_pending_description('videoA', 'MD5: a')
+        second._set_pending_description('videoB', 'MD5: b')
+
+        restarted = YamlYoutubeCache(path)
+        restarted.read_from_disk()
+        self.assertEqual({'videoA': 'MD5: a', 'videoB': 'MD5: b'}, restarted.entries('pending-descriptions-v2'))
+
+
+def quota_exceeded_error() -> HttpError:
+    content = b'{"error": {"code": 403, "errors": [{"reason": "quotaExceeded"}]}}'
+    return HttpError(httplib2.Response({'status': 403}), content)
+
+
+def http_error(status: int, headers: dict = None) -> HttpError:
+    return HttpError(httplib2.Response({'status': status, **(headers or {})}), b'{}')
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.client = make_client()
+        self.youtube = MagicMock()
+        self.client._get_authenticated_service = MagicMock(return_value=self.youtube)
+
+        sleep = patch('youtube_uploader.retry.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def test_transient_errors_are_retried(self):
+        self.youtube.playlists().list().execute.side_effect = [
+            http_error(503),
+            ConnectionResetError('reset by peer'),
+            {'items': [{'id': 'PL1', 'etag': 'etag1'}]},
+        ]
+
+        self.assertEqual('etag1', self.client.get_playlist_etags(['PL1'])['PL1'].result)
+        self.assertEqual(2, self.sleep.call_count)
+
+    def test_retry_after_is_respected(self):
+        self.youtube.playlists().list().execute.side_effect = [
+            http_error(429, {'retry-after': '120'}),
+            {'items': [{'id': 'PL1', 'etag': 'etag1'}]},
+        ]
+
+        self.client.get_playlist_etags(['PL1'])
+
+        self.assertGreaterEqual(self.sleep.call_args[0][0], 120)
+
+    def test_permanent_errors_are_not_retried(self):
+        self.youtube.playlists().list().execute.side_effect = [http_error(404)]
+
+        self.assertIsNotNone(self.client.get_playlist_etags(['PL1'])['PL1'].error)
+        self.sleep.assert_not_called()
+
+    def test_failed_upload_chunk_is_retried(self):
+        request = MagicMock()
+        request.next_chunk.side_effect = [http_error(500), (None, {'id': 'video1'})]
+
+        self.assertEqual('video1', self.client._resumable_upload(request))
+        self.assertEqual(2, request.next_chunk.call_count)
+
+    def test_items_failed_in_batch_are_sent_again(self):
+        batches = []
+
+        def new_batch(callback):
+            batches.append(FakeBatch(callback, failing={'1'} if not batches else set(), error=http_error(503)))
+            return batches[-1]
+
+        self.youtube.new_batch_http_request.side_effect = new_batch
+        self.youtube.playlistItems().list().execute.return_value = {'items': []}
+
+        results = self.client.add_videos_to_playlist('PL1', ['v0', 'v1', 'v2'])
+
+        self.assertEqual(['0', '1', '2'], batches[0].requests)
+        self.assertEqual(['0'], batches[1].requests)
+        self.assertTrue(all(result.error is None for result in results.values()))
+
+    def test_failed_batch_is_not_sent_again_for_videos_added_anyway(self):
+        batches = []
+
+        def new_batch(callback):
+            batches.append(FakeBatch(callback, failing=set()))
+            if len(batches) == 1:
+                # the server handled the batch, but the response got lost
+                batches[-1].execute = MagicMock(side_effect=http_error(503))
+            return batches[-1]
+
+        def list_items(part, playlistId, videoId, maxResults):
+            request = MagicMock()
+            request.execute.return_value = {'items': [{'id': 'item1'}] if videoId == 'v1' else []}
+            return request
+
+        self.youtube.new_batch_http_request.side_effect = new_batch
+        self.youtube.playlistItems().list.side_effect = list_items
+
+        results = self.client.add_videos_to_playlist('PL1', ['v0', 'v1', 'v2'])
+
+        # the batch itself is sent once, the retry has only the videos not in the playlist
+        self.assertEqual(1, batches[0].execute.call_count)
+        self.assertEqual(['0', '1'], batches[1].requests)
+        self.assertTrue(all(result.error is None for result in results.values()))
+
+    def test_quota_is_spent_for_every_attempt(self):
+        self.client._spend = MagicMock()
+        self.youtube.playlists().list().execute.side_effect = [
+            http_error(503),
+            {'items': [{'id': 'PL1', 'etag': 'etag1'}]},
+        ]
+
+        self.client.get_playlist_etags(['PL1'])
+
+        self.assertEqual(2, self.client._spend.call_count)
+
+
+class ProjectRotationTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+        credential_sets = []
+        for project in ['project-a', 'project-b']:
+            secrets_path = os.path.join(self.dir.name, f'{project}.json')
+            with open(secrets_path, 'w') as f:
+                f.write(f'{{"installed": {{"project_id": "{project}", "client_id": "id"}}}}')
+            credential_sets.append(CredentialSet(secrets_path, os.path.join(self.dir.name, f'{project}.creds')))
+
+        with patch('youtube_uploader.client.YamlYoutubeCache'), \
+             patch('youtube_uploader.client.YouTubeHasher'):
+            self.client = YouTubeClientImpl(credential_sets=credential_sets)
+
+        self.client._cache = YamlYoutubeCache(os.path.join(self.dir.name, 'cache.yaml'))
+        self.client._cache.read_from_disk()
+        self.client._quota = QuotaTracker(self.client._cache)
+        self.client._hasher = MagicMock()
+        self.client._hasher.md5.return_value = 'a' * 32
+
+        self.services = {'project-a': MagicMock(), 'project-b': MagicMock()}
+        self.client._get_authenticated_service = MagicMock(side_effect=lambda project: self.services[project])
+
+        self.path = os.path.join(self.dir.name, 'clip.mp4')
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 1024)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_project_ids_are_taken_from_client_secrets(self):
+        self.assertEqual(['project-a', 'project-b'], self.client.projects)
+
+    def test_upload_moves_to_next_project_when_quota_is_exceeded(self):
+        exceeded = MagicMock()
+        exceeded.resumable_uri = None
+        exceeded.next_chunk.side_effect = quota_exceeded_error()
+        self.services['project-a'].videos().insert.return_value = exceeded
+        uploaded = MagicMock()
+        uploaded.resumable_uri = None
+        uploaded.next_chunk.return_value = (None, {'id': 'video1'})
+        self.services['project-b'].videos().insert.return_value = uploaded
+
+        response = self.client.upload_video(self.path, 'clip')
+
+        self.assertEqual('video1', response.videoId)
+        self.assertEqual(0, self.client.quota.remaining('project-a'))
+        self.assertEqual(10000 - 1600, self.client.quota.remaining('project-b'))
+
+    def test_upload_fails_when_all_projects_are_exhausted(self):
+        self.client.quota.spend('project-a', 9000)
+        self.client.quota.mark_exhausted('project-b')
+
+        with self.assertRaises(QuotaExceededException):
+            self.client.upload_video(self.path, 'clip')
+
+    def test_resumed_upload_uses_project_which_started_it(self):
+        stat = os.stat(self.path)
+        self.client._cache.update('upload-sessions-v1', self.path, {
+            'project': 'project-b', 'uri': 'https://upload/session', 'progress': 512,
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+        request = MagicMock()
+        request.next_chunk.return_value = (None, {'id': 'video1'})
+        self.services['project-b'].videos().insert.return_value = request
+
+        self.client.upload_video(self.path, 'clip')
+
+        self.assertTrue(request._in_error_state)
+        self.services['project-a'].videos().insert.assert_not_called()
+        self.assertEqual(10000, self.client.quota.remaining('project-b'))  # spent when it was started
+
+
+class OfflineClientTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.client = make_client()
+        self.client._cache = YamlYoutubeCache(os.path.join(self.dir.name, 'cache.yaml'))
+        self.client._cache.read_from_disk()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _cache_playlists_online(self):
+        youtube = MagicMock()
+        youtube.playlists().list().execute.return_value = {'items': [
+            {'id': 'PL1', 'etag': 'etag1', 'snippet': {'title': 'Backup', 'description': ''}}]}
+        youtube.playlistItems().list().execute.return_value = playlist_items_page([('id1', 'a', f'MD5: {"a" * 32}')])
+
+        with patch.object(self.client, '_get_authenticated_service', return_value=youtube):
+            playlists = self.client.get_my_playlists()
+            self.client.get_playlist_video_indices(playlists.playlists)
+
+    def test_cached_playlists_and_content_are_used_without_api(self):
+        self._cache_playlists_online()
+        self.client.offline = True
+
+        playlists = self.client.get_my_playlists()
+        indices = self.client.get_playlist_video_indices(
+            [Playlist('PL1', 'Backup', etag='changed'), Playlist('PL2', 'Not cached', etag='etag2')])
+
+        self.assertEqual(['PL1'], [playlist.playlistId for playlist in playlists.playlists])
+        self.assertEqual('id1', indices['PL1'].find_by_md5('a' * 32).videoId)
+        self.assertEqual(0, len(indices['PL2']))
+
+    def test_offline_client_never_authorizes(self):
+        self.client.offline = True
+
+        with self.assertRaises(Exception):
+            self.client.get_my_playlists()  # not cached yet
+
+        with patch.object(self.client, '_get_credentials') as get_credentials:
+            with self.assertRaises(Exception):
+                self.client.update_video('id1', 'title', None)
+
+        get_credentials.assert_not_called()
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+
+from youtube_uploader.cache import YamlYoutubeCache
+from youtube_uploader.discovery import DirectoryScanner, ordered_by_modification_time
+from youtube_uploader.model import LocalFile
+
+
+def is_video(name: str) -> bool:
+    return name.endswith('.mp4')
+
+
+class DirectoryScannerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.dir.name, 'videos')
+        self._make_file('a.mp4', b'a')
+        self._make_file('notes.txt', b'text')
+        self._make_file(os.path.join('2020', 'b.mp4'), b'bb')
+        self._make_file(os.path.join('2020', 'june', 'c.mp4'), b'ccc')
+
+        self.cache = YamlYoutubeCache(os.path.join(self.dir.name, 'cache.yaml'))
+        self.cache.read_from_disk()
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _make_file(self, relative_path: str, content: bytes) -> str:
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_discovers_wanted_files_recursively_with_stat(self):
+        files = DirectoryScanner(is_video).scan(self.root)
+
+        by_name = {os.path.basename(file.path): file for file in files}
+        self.assertEqual({'a.mp4', 'b.mp4', 'c.mp4'}, set(by_name))
+        self.assertEqual(3, by_name['c.mp4'].size)
+        self.assertEqual(os.path.getmtime(by_name['c.mp4'].path), by_name['c.mp4'].modified_at)
+
+    def test_unchanged_directories_are_taken_from_the_index(self):
+        DirectoryScanner(is_video, cache=self.cache).scan(self.root)
+
+        scanner = DirectoryScanner(is_video, cache=self.cache)
+        files = scanner.scan(self.root)
+
+        self.assertEqual(3, len(files))
+        self.assertEqual(0, scanner.dirs_scanned)
+        self.assertEqual(3, scanner.dirs_reused)
+
+    def test_changed_directories_are_listed_again(self):
+        DirectoryScanner(is_video, cache=self.cache).scan(self.root)
+
+        new_path = self._make_file(os.path.join('2020', 'd.mp4'), b'dddd')
+        # make sure directory mtime differs even on coarse timestamp filesystems
+        dir_stat = os.stat(os.path.dirname(new_path))
+        os.utime(os.path.dirname(new_path), ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns + 1_000_000_000))
+
+        scanner = DirectoryScanner(is_video, cache=self.cache)
+        files = scanner.scan(self.root)
+
+        self.assertIn(new_path, [file.path for file in files])
+        self.assertEqual(1, scanner.dirs_scanned)
+
+
+class OrderedByModificationTimeTest(unittest.TestCase):
+    @staticmethod
+    def _files(*modified_at):
+        return [LocalFile(f'/{i}.mp4', 1, 0, ts) for i, ts in enumerate(modified_at)]
+
+    def test_fully_sorted_without_look_ahead(self):
+        files = self._files(5, 3, 4, 1, 2)
+
+        ordered = list(ordered_by_modification_time(files))
+
+        self.assertEqual([1, 2, 3, 4, 5], [file.modified_at for file in ordered])
+
+    def test_sorted_within_look_ahead_window(self):
+        files = self._files(3, 1, 2, 6, 4, 5)
+
+        ordered = list(ordered_by_modification_time(files, look_ahead=2))
+
+        self.assertEqual([1, 2, 3, 4, 5, 6], [file.modified_at for file in ordered])
+
+    def test_yields_before_input_is_exhausted(self):
+        consumed = []
+
+        def files():
+            for file in self._files(1, 2, 3, 4):
+                consumed.append(file)
+                yield file
+
+        first = next(ordered_by_modification_time(files(), look_ahead=1))
+
+        self.assertEqual(1, first.modified_at)
+        self.assertEqual(2, len(consumed))
+
+    def test_same_modification_time_keeps_discovery_order(self):
+        files = self._files(1, 1, 1)
+
+        ordered = list(ordered_by_modification_time(files, look_ahead=5))
+
+        self.assertEqual(['/0.mp4', '/1.mp4', '/2.mp4'], [file.path for file in ordered])
@@ -0,0 +1,273 @@
+import hashlib
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from youtube_uploader.cache import YamlYoutubeCache
+from youtube_uploader.hasher import PARTIAL_HASH_SPAN, HashClaims, StagedFingerprints, YouTubeHasher
+
+
+class YouTubeHasherTest(unittest.TestCase):
+    """Hashing results and their caching."""
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = YamlYoutubeCache(os.path.join(self.dir.name, 'cache.yaml'))
+        self.cache.read_from_disk()
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _make_file(self, name: str, content: bytes) -> str:
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_md5_matches_hashlib_across_block_boundaries(self):
+        content = os.urandom(3 * 64 * 1024 + 17)
+        path = self._make_file('a.mp4', content)
+
+        hasher = YouTubeHasher(self.cache, block_size=64 * 1024)
+
+        self.assertEqual(hashlib.md5(content).hexdigest(), hasher.md5(path))
+
+    def test_md5_of_files_smaller_than_block_size(self):
+        hasher = YouTubeHasher(self.cache, block_size=1024 * 1024)
+
+        for size in (0, 17, 3 * 64 * 1024 + 17):
+            content = os.urandom(size)
+            path = self._make_file(f'{size}.mp4', content)
+
+            self.assertEqual(hashlib.md5(content).hexdigest(), hasher.md5(path))
+
+    def test_md5_many_hashes_all_files_and_populates_cache(self):
+        contents = {f'{i}.mp4': os.urandom(1000 + i) for i in range(10)}
+        paths = {self._make_file(name, content): content for name, content in contents.items()}
+
+        hasher = YouTubeHasher(self.cache, workers=3)
+        result = hasher.md5_many(paths.keys())
+
+        self.assertEqual(len(paths), len(result))
+        for path, content in paths.items():
+            self.assertEqual(hashlib.md5(content).hexdigest(), result[path])
+            self.assertEqual(result[path], hasher._get_from_cache(path, os.stat(path)))
+
+    def test_md5_many_skips_missing_files(self):
+        path = self._make_file('a.mp4', b'data')
+        missing = os.path.join(self.dir.name, 'missing.mp4')
+
+        result = YouTubeHasher(self.cache).md5_many([path, missing])
+
+        self.assertEqual([path], list(result.keys()))
+
+    def test_cached_hash_is_recalculated_when_file_changes(self):
+        path = self._make_file('a.mp4', b'first')
+        hasher = YouTubeHasher(self.cache)
+        self.assertEqual(hashlib.md5(b'first').hexdigest(), hasher.md5(path))
+
+        # same path, different content and size
+        self._make_file('a.mp4', b'second version')
+
+        self.assertEqual(hashlib.md5(b'second version').hexdigest(), hasher.md5(path))
+
+    def test_cached_hash_is_recalculated_when_mtime_changes(self):
+        path = self._make_file('a.mp4', b'first')
+        hasher = YouTubeHasher(self.cache)
+        hasher.md5(path)
+
+        # same size, but rewritten in place later on
+        self._make_file('a.mp4', b'other')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        self.assertEqual(hashlib.md5(b'other').hexdigest(), hasher.md5(path))
+
+    def test_legacy_entry_is_trusted_and_migrated_when_file_is_older(self):
+        path = self._make_file('a.mp4', b'content')
+        self.cache.update('file-hashes-v1', path, {
+            'md5': 'legacy-hash',
+            'calculated_at': datetime.now() + timedelta(seconds=5),
+        })
+
+        hasher = YouTubeHasher(self.cache)
+
+        self.assertEqual('legacy-hash', hasher.md5(path))
+        self.assertEqual(os.path.getsize(path), self.cache.get('file-hashes-v1', path)['size'])
+
+    def test_legacy_entry_is_dropped_when_file_is_newer(self):
+        path = self._make_file('a.mp4', b'content')
+        self.cache.update('file-hashes-v1', path, {
+            'md5': 'legacy-hash',
+            'calculated_at': datetime.fromtimestamp(time.time() - 3600),
+        })
+
+        hasher = YouTubeHasher(self.cache)
+
+        self.assertEqual(hashlib.md5(b'content').hexdigest(), hasher.md5(path))
+
+    def test_md5_ahead_keeps_order_and_reads_input_lazily(self):
+        contents = [os.urandom(100 + i) for i in range(8)]
+        paths = [self._make_file(f'{i}.mp4', content) for i, content in enumerate(contents)]
+        consumed = []
+
+        def source():
+            for path in paths:
+                consumed.append(path)
+                yield path
+
+        hasher = YouTubeHasher(self.cache, workers=2)
+        results = hasher.md5_ahead(source(), ahead=3)
+
+        first = next(results)
+        self.assertEqual((paths[0], hashlib.md5(contents[0]).hexdigest()), first)
+        self.assertEqual(4, len(consumed))
+
+        rest = list(results)
+        self.assertEqual(paths[1:], [path for path, _ in rest])
+        self.assertEqual([hashlib.md5(c).hexdigest() for c in contents[1:]], [md5 for _, md5 in rest])
+        self.assertEqual(hashlib.md5(contents[5]).hexdigest(), hasher.cached_md5(paths[5]))
+
+    def test_md5_ahead_stopped_early_does_not_hash_queued_files(self):
+        paths = [self._make_file(f'{i}.mp4', os.urandom(100 + i)) for i in range(20)]
+        hasher = YouTubeHasher(self.cache, workers=1)
+        hashed = []
+        calculate = hasher._caclculate_md5
+
+        def slow_md5(path):
+            time.sleep(0.01)
+            hashed.append(path)
+            return calculate(path)
+
+        hasher._caclculate_md5 = slow_md5
+
+        results = hasher.md5_ahead(paths, ahead=10)
+        next(results)
+        results.close()
+
+        self.assertLess(len(hashed), 5)
+        self.assertEqual({}, hasher._worker_stats)  # logged and reset
+
+    def test_md5_ahead_passes_through_rejected_and_missing_files(self):
+        path = self._make_file('a.mp4', b'data')
+        skipped = self._make_file('b.mp4', b'other')
+        missing = os.path.join(self.dir.name, 'missing.mp4')
+
+        results = list(YouTubeHasher(self.cache).md5_ahead(
+            [path, skipped, missing], should_hash=lambda p: p != skipped))
+
+        self.assertEqual([(path, hashlib.md5(b'data').hexdigest()), (skipped, None), (missing, None)], results)
+
+    def test_file_claimed_by_another_process_is_not_hashed_again(self):
+        path = self._make_file('a.mp4', os.urandom(1000))
+        claims_dir = os.path.join(self.dir.name, 'cache.yaml.hashing')
+
+        # a process with its own (not yet flushed) view of the shared cache
+        first = YouTubeHasher(self.cache, claims=HashClaims(claims_dir))
+        md5 = first.md5(path)
+
+        other_cache = YamlYoutubeCache(os.path.join(self.dir.name, 'other.yaml'))
+        other_cache.read_from_disk()
+        second = YouTubeHasher(other_cache, claims=HashClaims(claims_dir))
+        second._caclculate_md5 = lambda path: self.fail('hashed twice')
+
+        self.assertEqual(md5, second.md5(path))
+
+        # the claim is only valid for the file as it was hashed
+        self._make_file('a.mp4', os.urandom(1001))
+        second._caclculate_md5 = lambda path: 'changed'
+        self.assertEqual('changed', second.md5(path))
+
+    def test_claims_are_removed_once_released(self):
+        first_path = self._make_file('a.mp4', os.urandom(1000))
+        second_path = self._make_file('b.mp4', os.urandom(1000))
+        claims_dir = os.path.join(self.dir.name, 'cache.yaml.hashing')
+
+        first = YouTubeHasher(self.cache, claims=HashClaims(claims_dir))
+        first.md5(first_path)
+        first.md5(second_path)
+
+        # e.g. the first process was killed before releasing its claims
+        other_cache = YamlYoutubeCache(os.path.join(self.dir.name, 'other.yaml'))
+        other_cache.read_from_disk()
+        second = YouTubeHasher(other_cache, claims=HashClaims(claims_dir))
+        second.md5(first_path)
+
+        second.release_claims()
+        self.assertEqual(1, len(os.listdir(claims_dir)))
+
+        first.release_claims()
+        self.assertEqual([], os.listdir(claims_dir))
+
+
+class StagedFingerprintsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = YamlYoutubeCache(os.path.join(self.dir.name, 'cache.yaml'))
+        self.cache.read_from_disk()
+        self.hasher = YouTubeHasher(self.cache)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _make_file(self, name: str, content: bytes) -> str:
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_partial_hash_of_large_file_covers_head_and_tail(self):
+        head = os.urandom(PARTIAL_HASH_SPAN)
+        tail = os.urandom(PARTIAL_HASH_SPAN)
+        first = self._make_file('a.mp4', head + b'a' * 1024 + tail)
+        second = self._make_file('b.mp4', head + b'b' * 1024 + tail)
+        third = self._make_file('c.mp4', head + b'a' * 1024 + os.urandom(PARTIAL_HASH_SPAN))
+
+        self.assertEqual(self.hasher.partial_hash(first), self.hasher.partial_hash(second))
+        self.assertNotEqual(self.hasher.partial_hash(first), self.hasher.partial_hash(third))
+        self.assertIsNone(self.hasher.cached_md5(first))
+
+    def test_partial_hash_of_small_file_is_its_md5(self):
+        path = self._make_file('a.mp4', b'data')
+
+        self.assertEqual(hashlib.md5(b'data').hexdigest(), self.hasher.partial_hash(path))
+        self.assertEqual(hashlib.md5(b'data').hexdigest(), self.hasher.cached_md5(path))
+        self.assertIsNotNone(self.cache.get('file-partial-hashes-v1', path))
+
+    def test_local_duplicates_are_dropped_and_only_colliding_files_need_md5(self):
+        original = self._make_file('a.mp4', b'same content')
+        unique = self._make_file('b.mp4', b'unique')
+        same_size = self._make_file('c.mp4', b'othe content')
+        copy = self._make_file('d.mp4', b'same content')
+        remote = self._make_file('e.mp4', b'remote!!')
+
+        fingerprints = StagedFingerprints(
+            self.hasher.partial_hash, self.hasher.md5, has_remote_candidate=lambda path: path == remote)
+
+        unique_paths = list(fingerprints.iter_unique([original, unique, same_size, copy, remote]))
+
+        self.assertEqual([original, unique, same_size, remote], unique_paths)
+        self.assertEqual({copy: original}, fingerprints.duplicates)
+        self.assertFalse(fingerprints.needs_md5(unique))
+        self.assertFalse(fingerprints.needs_md5(same_size))
+        self.assertTrue(fingerprints.needs_md5(original))
+        self.assertTrue(fingerprints.needs_md5(remote))
+
+    def test_remote_candidates_are_not_asked_while_staging(self):
+        first = self._make_file('a.mp4', b'first')
+        second = self._make_file('b.mp4', b'second')
+        asked = []
+
+        def has_remote_candidate(path: str) -> bool:
+            asked.append(path)
+            return path == second
+
+        fingerprints = StagedFingerprints(self.hasher.partial_hash, self.hasher.md5, has_remote_candidate)
+
+        self.assertEqual([first, second], list(fingerprints.iter_unique([first, second])))
+        self.assertEqual([], asked)
+
+        self.assertFalse(fingerprints.needs_md5(first))
+        self.assertTrue(fingerprints.needs_md5(second))
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import tempfile
+import unittest
+
+from typing import List
+
+from youtube_uploader.media import THROTTLE_BLOCK_SIZE, HashingMediaFileUpload
+
+
+class RecordingLimiter(object):
+    def __init__(self):
+        self.consumed: List[int] = []
+
+    def consume(self, size: int) -> None:
+        self.consumed.append(size)
+
+
+class HashingMediaFileUploadTest(unittest.TestCase):
+    chunk_size = 256 * 1024
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.content = os.urandom(5 * self.chunk_size + 123)
+        self.path = os.path.join(self.dir.name, 'clip.mp4')
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+        self.expected = hashlib.md5(self.content).hexdigest()
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _read_all_from(self, media: HashingMediaFileUpload, offset: int) -> None:
+        while True:
+            data = media.getbytes(offset, self.chunk_size)
+            offset += len(data)
+            if len(data) < self.chunk_size:
+                break
+
+    def _send_all_from(self, media: HashingMediaFileUpload, offset: int) -> None:
+        # the way googleapiclient sends a chunk of a stream: seek, then read while sending
+        stream = media.stream()
+        stream.seek(offset)
+        while True:
+            data = stream.read(8192)
+            if not data:
+                break
+
+    def test_md5_of_sequentially_uploaded_chunks(self):
+        media = HashingMediaFileUpload(self.path, chunksize=self.chunk_size)
+
+        self._read_all_from(media, 0)
+
+        self.assertEqual(self.expected, media.md5())
+
+    def test_md5_of_streamed_upload(self):
+        media = HashingMediaFileUpload(self.path, chunksize=self.chunk_size)
+        self.assertTrue(media.has_stream())
+
+        self._send_all_from(media, 0)
+
+        self.assertEqual(self.expected, media.md5())
+
+    def test_md5_when_streamed_upload_is_resumed_in_the_middle(self):
+        media = HashingMediaFileUpload(self.path, chunksize=self.chunk_size)
+
+        self._send_all_from(media, 3 * self.chunk_size)
+
+        self.assertEqual(self.expected, media.md5())
+
+    def test_limiter_paces_the_send_in_small_reads(self):
+        limiter = RecordingLimiter()
+        media = HashingMediaFileUpload(self.path, chunksize=self.chunk_size, limiter=limiter)
+
+        stream = media.stream()
+        stream.seek(0)
+        data = stream.read(self.chunk_size)
+
+        self.assertEqual(THROTTLE_BLOCK_SIZE, len(data))
+        self.assertEqual([THROTTLE_BLOCK_SIZE], limiter.consumed)
+
+        self._send_all_from(media, len(data))
+
+        self.assertEqual(len(self.content), sum(limiter.consumed))
+        self.assertLessEqual(max(limiter.consumed), THROTTLE_BLOCK_SIZE)
+        self.assertEqual(self.expected, media.md5())
+
+    def test_md5_when_chunks_are_resent_after_error(self):
+        media = HashingMediaFileUpload(self.path, chunksize=self.chunk_size)
+
+        media.getbytes(0, self.chunk_size)
+        media.getbytes(self.chunk_size, self.chunk_size)
+        # server confirmed only part of the second chunk
+        self._read_all_from(media, self.chunk_size + 1000)
+
+        self.assertEqual(self.expected, media.md5())
+
+    def test_md5_when_upload_is_resumed_in_the_middle(self):
+        media = HashingMediaFileUpload(self.path, chunksize=self.chunk_size)
+
+        self._read_all_from(media, 3 * self.chunk_size)
+
+        self.assertEqual(self.expected, media.md5())
+
+    def test_md5_when_server_already_has_everything(self):
+        media = HashingMediaFileUpload(self.path, chunksize=self.chunk_size)
+
+        self.assertEqual(self.expected, media.md5())
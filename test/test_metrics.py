@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from youtube_uploader.metrics import MetricsRegistry, instrument_http, registry
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_calls_are_aggregated_per_endpoint(self):
+        with self.registry.call('videos.list') as call:
+            call.status = 200
+        with self.assertRaises(ValueError):
+            with self.registry.call('videos.list'):
+                raise ValueError()
+        self.registry.record_retry('videos.list')
+        self.registry.record_units('videos.list', 2)
+
+        stats = self.registry.to_dict()['api']['videos.list']
+
+        self.assertEqual(2, stats['calls'])
+        self.assertEqual(1, stats['errors'])
+        self.assertEqual(1, stats['retries'])
+        self.assertEqual(2, stats['units'])
+        self.assertEqual({'200': 1}, stats['statuses'])
+
+    def test_transfers_outside_of_a_call_are_ignored(self):
+        self.registry.record_transfer(10, 20, 200)
+
+        self.assertEqual({}, self.registry.to_dict()['api'])
+
+    def test_prometheus_output_has_labelled_samples(self):
+        with self.registry.call('playlists.list'):
+            self.registry.record_transfer(0, 512, 200)
+        self.registry.record_timing('hasher.md5', 1.5, 1024)
+
+        output = self.registry.to_prometheus()
+
+        self.assertIn('youtube_uploader_api_calls_total{endpoint="playlists.list"} 1', output)
+        self.assertIn('youtube_uploader_api_received_bytes_total{endpoint="playlists.list"} 512', output)
+        self.assertIn('youtube_uploader_api_responses_total{endpoint="playlists.list",status="200"} 1', output)
+        self.assertIn('youtube_uploader_operation_bytes_total{operation="hasher.md5"} 1024', output)
+
+    def test_write_picks_format_by_extension(self):
+        self.registry.record_timing('cache.flush', 0.25)
+
+        with tempfile.TemporaryDirectory() as dir:
+            self.registry.write(os.path.join(dir, 'metrics.json'))
+            self.registry.write(os.path.join(dir, 'metrics.prom'))
+
+            with open(os.path.join(dir, 'metrics.json')) as f:
+                self.assertEqual(0.25, json.load(f)['timings']['cache.flush']['seconds'])
+            with open(os.path.join(dir, 'metrics.prom')) as f:
+                self.assertIn('# TYPE youtube_uploader_operation_seconds_total counter', f.read())
+
+
+class InstrumentHttpTest(unittest.TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def tearDown(self):
+        registry.reset()
+
+    def test_bytes_and_status_are_reported_into_the_current_call(self):
+        http = MagicMock()
+        http.request.return_value = (MagicMock(status=308), b'x' * 10)
+        instrument_http(http)
+
+        with registry.call('videos.insert'):
+            http.request('https://upload', method='PUT', body=b'y' * 100, headers={'Content-Length': '100'})
+
+        stats = registry.to_dict()['api']['videos.insert']
+        self.assertEqual(100, stats['bytes_sent'])
+        self.assertEqual(10, stats['bytes_received'])
+        self.assertEqual({'308': 1}, stats['statuses'])
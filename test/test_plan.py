@@ -0,0 +1,52 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+
+from youtube_uploader.model import Video
+from youtube_uploader.plan import build_plan
+
+
+class BuildPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for name, size in [('new.mp4', 3 * 1024 * 1024), ('uploaded.mp4', 1024), ('another.mp4', 1024 * 1024)]:
+            path = os.path.join(self.dir.name, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+            self.paths.append(path)
+
+        self.plan = build_plan(
+            self.paths,
+            find_uploaded=lambda path: Video('id1', 'uploaded') if path.endswith('uploaded.mp4') else None,
+            cached_md5=lambda path: 'a' * 32,
+            units_per_upload=1650,
+            bandwidth=1024 * 1024,
+            daily_units=3000)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_totals_and_estimates(self):
+        self.assertEqual([self.paths[0], self.paths[2]], [upload.path for upload in self.plan.uploads])
+        self.assertEqual(1, self.plan.skipped)
+        self.assertEqual(4 * 1024 * 1024, self.plan.total_bytes)
+        self.assertEqual(3300, self.plan.estimated_units)
+        self.assertEqual(4.0, self.plan.estimated_seconds)
+        self.assertEqual(2, self.plan.estimated_days)
+
+    def test_plan_is_written_as_json_or_csv(self):
+        json_path = os.path.join(self.dir.name, 'plan.json')
+        csv_path = os.path.join(self.dir.name, 'plan.csv')
+
+        self.plan.write(json_path)
+        self.plan.write(csv_path)
+
+        with open(json_path) as f:
+            self.assertEqual(3300, json.load(f)['estimated_units'])
+        with open(csv_path, newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(['path', 'size', 'md5'], rows[0])
+        self.assertEqual([self.paths[0], str(3 * 1024 * 1024), 'a' * 32], rows[1])
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from youtube_uploader.cache import YamlYoutubeCache
+from youtube_uploader.quota import CredentialSet, QuotaTracker, QuotaExceededException, is_quota_exceeded
+
+
+class QuotaTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.yaml')
+        self.cache = YamlYoutubeCache(self.path)
+        self.cache.read_from_disk()
+        self.tracker = QuotaTracker(self.cache, daily_limit=5000)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_usage_is_kept_in_the_cache(self):
+        self.tracker.spend('p1', 1600)
+        self.tracker.spend('p1', 50)
+        self.cache.flush()
+
+        cache = YamlYoutubeCache(self.path)
+        cache.read_from_disk()
+
+        self.assertEqual(5000 - 1650, QuotaTracker(cache, daily_limit=5000).remaining('p1'))
+
+    def test_usage_is_reset_on_the_next_pacific_day(self):
+        with patch('youtube_uploader.quota.pacific_date', return_value='2020-01-01'):
+            self.tracker.spend('p1', 4000)
+            self.assertEqual(1000, self.tracker.remaining('p1'))
+
+        with patch('youtube_uploader.quota.pacific_date', return_value='2020-01-02'):
+            self.assertEqual(5000, self.tracker.remaining('p1'))
+
+    def test_usage_of_processes_sharing_the_cache_is_summed_up(self):
+        first_cache = YamlYoutubeCache(self.path, shared=True)
+        first_cache.read_from_disk()
+        second_cache = YamlYoutubeCache(self.path, shared=True)
+        second_cache.read_from_disk()
+
+        QuotaTracker(first_cache, daily_limit=5000).spend('p1', 1600)
+        second = QuotaTracker(second_cache, daily_limit=5000)
+        second.spend('p1', 50)
+        first_cache.flush()
+        second_cache.flush()
+
+        self.assertEqual(1650, second.used('p1'))
+
+        cache = YamlYoutubeCache(self.path, shared=True)
+        cache.read_from_disk()
+        self.assertEqual(1650, QuotaTracker(cache, daily_limit=5000).used('p1'))
+
+    def test_usage_of_previous_days_is_dropped(self):
+        with patch('youtube_uploader.quota.pacific_date', return_value='2020-01-01'):
+            QuotaTracker(self.cache).spend('p1', 4000)
+
+        with patch('youtube_uploader.quota.pacific_date', return_value='2020-01-02'):
+            self.tracker.spend('p1', 50)
+
+            self.assertEqual(1, len(self.cache.entries('quota-usage-v2')))
+            self.assertEqual(50, self.tracker.used('p1'))
+
+    def test_pick_returns_first_project_with_enough_units(self):
+        self.tracker.spend('p1', 4000)
+        self.tracker.mark_exhausted('p2')
+
+        self.assertEqual('p1', self.tracker.pick(['p1', 'p2', 'p3'], 1))
+        self.assertEqual('p3', self.tracker.pick(['p1', 'p2', 'p3'], 1600))
+
+        with self.assertRaises(QuotaExceededException):
+            self.tracker.pick(['p1', 'p2'], 1600)
+
+
+class QuotaHelpersTest(unittest.TestCase):
+    def test_quota_exceeded_is_detected_from_error_reason(self):
+        def error(status, content):
+            return HttpError(httplib2.Response({'status': status}), content)
+
+        self.assertTrue(is_quota_exceeded(error(403, b'{"error": {"errors": [{"reason": "quotaExceeded"}]}}')))
+        self.assertFalse(is_quota_exceeded(error(403, b'{"error": {"errors": [{"reason": "forbidden"}]}}')))
+        self.assertFalse(is_quota_exceeded(error(500, b'{"error": {"errors": [{"reason": "quotaExceeded"}]}}')))
+        self.assertFalse(is_quota_exceeded(error(403, b'not json')))
+
+    def test_project_id_falls_back_to_client_id(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'secrets.json')
+            with open(path, 'w') as f:
+                f.write('{"web": {"client_id": "123.apps.googleusercontent.com"}}')
+
+            self.assertEqual('123.apps.googleusercontent.com', CredentialSet(path, 'creds.json').project_id)
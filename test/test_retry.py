@@ -0,0 +1,99 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from youtube_uploader.retry import CircuitBreaker, RetryPolicy, call_with_retries, is_retriable, retry_after
+
+
+def http_error(status: int, content: bytes = b'{}', headers: dict = None) -> HttpError:
+    return HttpError(httplib2.Response({'status': status, **(headers or {})}), content)
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_delay_is_jittered_within_exponential_bound(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+
+        for attempt in range(1, 8):
+            delays = [policy.delay(attempt) for _ in range(50)]
+            self.assertTrue(all(0 <= delay <= min(10.0, 2 ** attempt) for delay in delays))
+            self.assertGreater(len(set(delays)), 1)
+
+    def test_retriable_errors(self):
+        rate_limited = b'{"error": {"errors": [{"reason": "rateLimitExceeded"}]}}'
+        quota_exceeded = b'{"error": {"errors": [{"reason": "quotaExceeded"}]}}'
+
+        self.assertTrue(is_retriable(http_error(503)))
+        self.assertTrue(is_retriable(http_error(429)))
+        self.assertTrue(is_retriable(http_error(403, rate_limited)))
+        self.assertTrue(is_retriable(ConnectionResetError()))
+        self.assertTrue(is_retriable(httplib2.ServerNotFoundError()))
+        self.assertFalse(is_retriable(http_error(403, quota_exceeded)))
+        self.assertFalse(is_retriable(http_error(404)))
+        self.assertFalse(is_retriable(FileNotFoundError()))
+        self.assertFalse(is_retriable(http_error(503), RetryPolicy(statuses={500})))
+
+    def test_retry_after(self):
+        self.assertEqual(30.0, retry_after(http_error(503, headers={'retry-after': '30'})))
+        self.assertEqual(0.0, retry_after(http_error(503, headers={'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'})))
+        self.assertIsNone(retry_after(http_error(503)))
+        self.assertIsNone(retry_after(http_error(503, headers={'retry-after': 'soon'})))
+
+
+@patch('youtube_uploader.retry.time.sleep')
+class CallWithRetriesTest(unittest.TestCase):
+    def test_gives_up_after_max_retries(self, sleep):
+        call = MagicMock(side_effect=http_error(500))
+
+        with self.assertRaises(HttpError):
+            call_with_retries('videos.list', call, policy=RetryPolicy(max_retries=2))
+
+        self.assertEqual(3, call.call_count)
+        self.assertEqual(2, sleep.call_count)
+
+    def test_endpoint_policy_is_used(self, sleep):
+        call = MagicMock(side_effect=http_error(500))
+
+        with self.assertRaises(HttpError):
+            call_with_retries('playlistItems.insert', call)
+
+        self.assertEqual(4, call.call_count)
+
+    def test_breaker_opens_on_sustained_failures_and_pauses_calls(self, sleep):
+        breaker = CircuitBreaker(threshold=3, cooldown=30.0)
+        call = MagicMock(side_effect=[http_error(502)] * 3 + ['done'])
+
+        self.assertEqual('done', call_with_retries('videos.list', call, breaker=breaker))
+
+        # backoff delays of the endpoint policy are short, the pause is not
+        paused = [args[0] for args, _ in sleep.call_args_list if args[0] > 20]
+        self.assertEqual(1, len(paused))
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_cooldown_doubles_while_failures_go_on_and_resets_on_success(self):
+        now = [0.0]
+
+        with patch('youtube_uploader.retry.timeit.default_timer', side_effect=lambda: now[0]):
+            breaker = CircuitBreaker(threshold=2, cooldown=10.0, max_cooldown=15.0)
+
+            breaker.record_failure()
+            self.assertFalse(breaker.is_open)
+            breaker.record_failure()
+            self.assertTrue(breaker.is_open)
+
+            now[0] = 11.0
+            self.assertFalse(breaker.is_open)
+            breaker.record_failure()
+            breaker.record_failure()
+            self.assertTrue(breaker.is_open)
+            now[0] = 25.0
+            self.assertTrue(breaker.is_open)  # 15 seconds this time
+
+            now[0] = 27.0
+            breaker.record_success()
+            breaker.record_failure()
+            breaker.record_failure()
+            now[0] = 38.0
+            self.assertFalse(breaker.is_open)  # back to 10 seconds
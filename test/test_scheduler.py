@@ -0,0 +1,122 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+from youtube_uploader.model import UploadVideoResponse, Video
+from youtube_uploader.scheduler import UploadScheduler
+
+
+class FakeUploadClient(object):
+    """Records uploads, tracks how many of them were running at once."""
+
+    def __init__(self, delay: float = 0.05, failing: str = None):
+        self.delay = delay
+        self.failing = failing
+        self.uploaded = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def upload_video(self, path, title, description='', privacyLevel='unlisted'):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if path == self.failing:
+                raise Exception('upload failed')
+            with self._lock:
+                self.uploaded.append(path)
+            return UploadVideoResponse(f'id-{title}')
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+class UploadSchedulerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i in range(6):
+            path = os.path.join(self.dir.name, f'{i}.mp4')
+            with open(path, 'wb') as f:
+                f.write(b'x' * 1024)
+            self.paths.append(path)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_uploads_run_concurrently(self):
+        client = FakeUploadClient()
+        uploaded = []
+
+        summary = UploadScheduler(
+            client, find_uploaded=lambda path: None, concurrency=3,
+            on_uploaded=lambda path, videoId: uploaded.append(videoId)).run(self.paths)
+
+        self.assertEqual(6, summary.uploaded)
+        self.assertEqual(6 * 1024, summary.uploaded_bytes)
+        self.assertEqual(3, client.max_running)
+        self.assertEqual({f'id-{i}' for i in range(6)}, set(uploaded))
+
+    def test_already_uploaded_files_are_skipped(self):
+        client = FakeUploadClient(delay=0)
+        uploaded_before = {self.paths[0], self.paths[3]}
+
+        summary = UploadScheduler(
+            client,
+            find_uploaded=lambda path: Video('id', 'title') if path in uploaded_before else None,
+        ).run(self.paths)
+
+        self.assertEqual(4, summary.uploaded)
+        self.assertEqual(2, summary.skipped)
+        self.assertEqual([p for p in self.paths if p not in uploaded_before], client.uploaded)
+
+    def test_failure_stops_new_uploads_and_is_raised(self):
+        client = FakeUploadClient(delay=0.02, failing=self.paths[1])
+        find_uploaded = MagicMock(return_value=None)
+
+        with self.assertRaises(Exception):
+            UploadScheduler(client, find_uploaded=find_uploaded, concurrency=1).run(self.paths)
+
+        self.assertNotIn(self.paths[-1], client.uploaded)
+
+
+class UploadSchedulerDeadlineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i, size in enumerate([1024, 10 * 1024, 512]):
+            path = os.path.join(self.dir.name, f'{i}.mp4')
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+            self.paths.append(path)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_files_not_fitting_before_deadline_are_postponed(self):
+        client = FakeUploadClient(delay=0)
+
+        # 1 KiB/s, 5 seconds left: the 10 KiB file does not fit
+        summary = UploadScheduler(
+            client, find_uploaded=lambda path: None,
+            deadline=datetime.now() + timedelta(seconds=5), upload_rate=1024).run(self.paths)
+
+        self.assertEqual(2, summary.uploaded)
+        self.assertEqual(1, summary.postponed)
+        self.assertEqual([self.paths[0], self.paths[2]], client.uploaded)
+
+    def test_nothing_is_started_past_deadline(self):
+        client = FakeUploadClient(delay=0)
+
+        summary = UploadScheduler(
+            client, find_uploaded=lambda path: None,
+            deadline=datetime.now() - timedelta(seconds=1)).run(self.paths)
+
+        self.assertEqual(0, summary.uploaded)
+        self.assertEqual([], client.uploaded)
@@ -0,0 +1,84 @@
+import unittest
+from datetime import datetime, time
+from unittest.mock import patch
+
+from youtube_uploader.throttle import BandwidthLimiter, BandwidthSchedule, next_occurrence, parse_time_of_day
+
+MB = 1024 * 1024
+
+
+class BandwidthScheduleTest(unittest.TestCase):
+    def test_parse(self):
+        schedule = BandwidthSchedule.parse('08:00-20:00=1, 22:00-06:00=0, 5')
+
+        self.assertEqual(5 * MB, schedule.default)
+        self.assertEqual([(time(8), time(20), 1 * MB), (time(22), time(6), 0.0)], schedule.windows)
+
+    def test_parse_invalid(self):
+        with self.assertRaises(Exception):
+            BandwidthSchedule.parse('fast')
+
+    def test_rate_at(self):
+        schedule = BandwidthSchedule.parse('08:00-20:00=1,22:00-06:00=0,5')
+
+        self.assertEqual(1 * MB, schedule.rate_at(time(8)))
+        self.assertEqual(5 * MB, schedule.rate_at(time(20)))
+        self.assertEqual(0, schedule.rate_at(time(23, 30)))
+        self.assertEqual(0, schedule.rate_at(time(5, 59)))
+        self.assertEqual(5 * MB, schedule.rate_at(time(6)))
+
+
+class BandwidthLimiterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 100.0
+        self.slept = []
+
+        def sleep(seconds):
+            self.slept.append(seconds)
+            self.now += seconds
+
+        patches = [
+            patch('youtube_uploader.throttle.timeit.default_timer', side_effect=lambda: self.now),
+            patch('youtube_uploader.throttle.time.sleep', side_effect=sleep),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_reads_are_paced_to_the_rate(self):
+        limiter = BandwidthLimiter(BandwidthSchedule(default=1 * MB))
+
+        for _ in range(4):
+            limiter.consume(MB // 2)
+
+        # nothing was accumulated upfront, so 2 MiB take 2 seconds
+        self.assertAlmostEqual(2.0, self.now - 100.0)
+
+    def test_burst_is_limited_to_a_second(self):
+        limiter = BandwidthLimiter(BandwidthSchedule(default=1 * MB))
+        self.now += 60
+
+        limiter.consume(3 * MB)
+
+        self.assertAlmostEqual(2.0, sum(self.slept))
+
+    def test_no_limit(self):
+        limiter = BandwidthLimiter(BandwidthSchedule())
+
+        limiter.consume(100 * MB)
+
+        self.assertEqual([], self.slept)
+
+
+class TimeOfDayTest(unittest.TestCase):
+    def test_parse_time_of_day(self):
+        self.assertEqual(time(7, 30), parse_time_of_day('07:30'))
+
+        with self.assertRaises(Exception):
+            parse_time_of_day('25:00')
+
+    def test_next_occurrence(self):
+        now = datetime(2024, 3, 1, 22, 0)
+
+        self.assertEqual(datetime(2024, 3, 1, 23, 0), next_occurrence(time(23), now))
+        self.assertEqual(datetime(2024, 3, 2, 7, 0), next_occurrence(time(7), now))
@@ -0,0 +1,126 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from youtube_uploader import cli
+from youtube_uploader.cli import select_watched_files, watch_and_upload
+from youtube_uploader.scheduler import UploadSummary
+from youtube_uploader.watcher import FileWatcher, InotifyWatcher, PollingWatcher
+
+
+def is_video(path: str) -> bool:
+    return path.endswith('.mp4')
+
+
+class FileWatcherTestMixin(object):
+    def make_watcher(self) -> FileWatcher:
+        raise NotImplementedError()
+
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.dir.name, 'old.mp4'), 'wb') as f:
+            f.write(b'old')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _write_slowly(self, path: str, parts: int, delay: float) -> None:
+        for _ in range(parts):
+            with open(path, 'ab') as f:
+                f.write(b'x' * 1024)
+            time.sleep(delay)
+
+    def test_new_files_are_reported_once_settled(self):
+        with self.make_watcher() as watcher:
+            subdir = os.path.join(self.dir.name, 'dump')
+            os.mkdir(subdir)
+            new = os.path.join(subdir, 'new.mp4')
+
+            writer = threading.Thread(target=self._write_slowly, args=(new, 5, 0.1))
+            writer.start()
+
+            with open(os.path.join(self.dir.name, 'notes.txt'), 'w') as f:
+                f.write('not a video')
+
+            started_at = time.time()
+            batch = next(watcher.batches(should_stop=lambda: time.time() - started_at > 10))
+            writer.join()
+
+            self.assertEqual([new], batch)
+            self.assertEqual(5 * 1024, os.path.getsize(new))
+
+    def test_stops_when_asked(self):
+        with self.make_watcher() as watcher:
+            self.assertEqual([], list(watcher.batches(should_stop=lambda: True)))
+
+
+class PollingWatcherTest(FileWatcherTestMixin, unittest.TestCase):
+    def make_watcher(self) -> FileWatcher:
+        return PollingWatcher(self.dir.name, is_video, settle=0.3, interval=0.1)
+
+
+class InotifyWatcherTest(FileWatcherTestMixin, unittest.TestCase):
+    def make_watcher(self) -> FileWatcher:
+        try:
+            return InotifyWatcher(self.dir.name, is_video, settle=0.3)
+        except (OSError, AttributeError) as e:
+            self.skipTest(f'inotify is not available: {e}')
+
+
+class ListedWatcher(object):
+    """Watcher reporting the given batches at once."""
+
+    def __init__(self, root: str, batches):
+        self.root = root
+        self._batches = batches
+
+    def batches(self, should_stop):
+        return iter(self._batches)
+
+
+class WatchedFilesSelectionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+
+        # e.g. an old directory moved into the watched one
+        self.old = os.path.join(self.dir.name, 'old.mp4')
+        with open(self.old, 'wb') as f:
+            f.write(b'old')
+        old_ts = datetime(2015, 1, 1).timestamp()
+        os.utime(self.old, (old_ts, old_ts))
+
+        self.new = os.path.join(self.dir.name, 'new.mp4')
+        with open(self.new, 'wb') as f:
+            f.write(b'new')
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_cut_offs_of_the_discovery_apply_to_watched_files(self):
+        removed = os.path.join(self.dir.name, 'removed.mp4')
+
+        self.assertEqual(
+            [self.new], select_watched_files([self.old, self.new, removed], None, datetime(2020, 1, 1)))
+        self.assertEqual(
+            [], select_watched_files([self.old, self.new], datetime.now() + timedelta(days=1)))
+        self.assertEqual([self.old, self.new], select_watched_files([self.old, self.new], None))
+
+    def test_batches_with_nothing_selected_are_not_uploaded(self):
+        watcher = ListedWatcher(self.dir.name, [[self.old], [self.old, self.new]])
+        uploads = []
+
+        def upload(batch):
+            uploads.append(batch)
+            return UploadSummary()
+
+        # the logger of the CLI is only set up by main()
+        with patch.object(cli, 'log', logging.getLogger(__name__)):
+            watch_and_upload(
+                watcher, upload, select=lambda batch: select_watched_files(batch, None, datetime(2020, 1, 1)))
+
+        self.assertEqual([[self.new]], uploads)